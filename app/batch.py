@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import time
+import matplotlib
+matplotlib.use("Agg")  # Sin ventanas: antes de que plotting importe pyplot
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import CACHE_HABILITADA, LECTURA_CONCURRENTE, GRAFICOS_DIR, RENDER_WORKERS, RENDER_FORMATOS
+from app.databases.neo4j import Neo4jConnector
+from app.databases.pool import GestorConexiones
+from app.databases.fetching import LectorConcurrente
+from app.services.cache import CacheResultados, CacheJoins
+from app.services.rollups import RollupMensual
+from app.services.rendering import GRAFICOS, RenderizadorLotes
+from app.utils.instrumentation import accion
+from app.main import datos_graficos_combinados, datos_mongodb, datos_neo4j, datos_accidentes_mensuales
+
+# Conjunto de app/data/graphs: septiembre-diciembre y años completos 2017-2020
+PERIODOS_POR_DEFECTO = [(f"{anio}-09-01", f"{anio}-12-31") for anio in range(2017, 2021)] + \
+                       [(f"{anio}-01-01", f"{anio}-12-31") for anio in range(2017, 2021)]
+ANIOS_POR_DEFECTO = [str(anio) for anio in range(2017, 2021)]
+
+def _periodo(texto):
+    inicio, _, fin = texto.partition(":")
+    if not fin:
+        raise argparse.ArgumentTypeError("El período debe tener la forma AAAA-MM-DD:AAAA-MM-DD")
+    return inicio, fin
+
+def trabajos(periodos, anios, graficos, categorias, severidades):
+    # (tipo, parámetros, nombre de archivo sin extensión) para cada gráfico pedido
+    lista = []
+    for inicio, fin in periodos:
+        for tipo in ("combinado", "mongodb", "neo4j"):
+            if tipo in graficos:
+                lista.append((tipo, (f"{inicio}T00:00:00Z", f"{fin}T23:59:59Z"), f"{tipo}_{inicio}_{fin}"))
+    if "mensual" in graficos:
+        for anio in anios:
+            for categoria in categorias:
+                lista.append(("mensual", (anio, '1', categoria), f"mensual_{anio}_{categoria.replace(' ', '_')}"))
+            for severidad in severidades:
+                lista.append(("mensual", (anio, '2', severidad), f"mensual_{anio}_severidad_{severidad}"))
+    return lista
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera gráficos a archivo sin interacción.")
+    parser.add_argument("--periodos", nargs="+", type=_periodo, default=PERIODOS_POR_DEFECTO,
+                        help="Períodos AAAA-MM-DD:AAAA-MM-DD")
+    parser.add_argument("--anios", nargs="+", default=ANIOS_POR_DEFECTO, help="Años de los gráficos mensuales")
+    parser.add_argument("--graficos", nargs="+", choices=list(GRAFICOS), default=["combinado", "mensual"])
+    parser.add_argument("--categorias", nargs="+", default=["All"], help="Condiciones climáticas (gráfico mensual)")
+    parser.add_argument("--severidades", nargs="*", default=[], help="Severidades (gráfico mensual)")
+    parser.add_argument("--tipo-clima", default=None, help="Filtro de tipo de clima (gráfico combinado)")
+    parser.add_argument("--severidad", default=None, help="Filtro de severidad del clima (gráfico combinado)")
+    parser.add_argument("--formatos", nargs="+", choices=["png", "svg", "pdf"], default=list(RENDER_FORMATOS))
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    parser.add_argument("--salida", default=GRAFICOS_DIR)
+    parser.add_argument("--sin-csv", action="store_true", help="No exportar los CSV de cada gráfico")
+    args = parser.parse_args(argv)
+
+    gestor = GestorConexiones()
+    gestor.calentar()
+    coleccion_mongodb = gestor.coleccion_mongodb
+    neo4j = Neo4jConnector(gestor)
+    cache = CacheResultados() if CACHE_HABILITADA else None
+    cache_joins = CacheJoins()
+    rollup = RollupMensual()
+    lector = LectorConcurrente(coleccion_mongodb, neo4j) if LECTURA_CONCURRENTE else None
+
+    inicio = time.perf_counter()
+    try:
+        with accion("batch"), \
+                RenderizadorLotes(args.salida, args.formatos, args.workers, export=not args.sin_csv) as renderizador:
+            for tipo, parametros, nombre in trabajos(args.periodos, args.anios, args.graficos, args.categorias,
+                                                     args.severidades):
+                print(f"Calculando {nombre}...")
+                if tipo == "combinado":
+                    datos = datos_graficos_combinados(*parametros, args.tipo_clima, args.severidad, coleccion_mongodb,
+                                                      neo4j, cache, cache_joins, lector)
+                elif tipo == "mongodb":
+                    datos = datos_mongodb(*parametros, coleccion_mongodb, cache, lector)
+                elif tipo == "neo4j":
+                    datos = datos_neo4j(*parametros, neo4j, cache, lector)
+                else:
+                    datos = datos_accidentes_mensuales(*parametros, coleccion_mongodb, neo4j, rollup, cache, lector)
+                renderizador.enviar(tipo, datos, nombre)
+            rutas = renderizador.esperar()
+    finally:
+        if lector is not None:
+            lector.close()
+        gestor.close()
+
+    for ruta in rutas:
+        print(f"Escrito {ruta}")
+    print(f"{len(rutas)} archivos en {time.perf_counter() - inicio:.1f} s")
+
+if __name__ == "__main__":
+    main()
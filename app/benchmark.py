@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import BENCHMARK_DIR, DISTANCIA_MAXIMA_KM, JOIN_WORKERS, MONGODB_BATCH_SIZE
+from app.databases.records import LoteAccidentes, LoteEventos
+from app.services import data_processing
+from app.services.data_processing import (
+    calcular_join_periodo,
+    filtrar_accidentes_por_clima,
+    filtrar_accidentes_por_clima_optimizado,
+    contar_accidentes_por_categoria,
+    contar_accidentes_por_mes,
+)
+from app.services.synthetic import generar_accidentes, generar_eventos
+
+VERSION_REPORTE = 1
+TAMANOS_POR_DEFECTO = [10_000, 100_000, 1_000_000, 10_000_000]
+# Joins medidos: los dos originales sobre documentos y los dos motores sobre lotes compactos
+MODOS_DOCUMENTOS = ["fuerza_bruta", "optimizado"]
+MODOS_COMPACTOS = ["balltree", "intervalos"]
+# Crecimiento supuesto del costo al crecer el tamaño, para omitir corridas que excederían
+# el límite de tiempo (accidentes y eventos crecen juntos)
+EXPONENTE_ESCALADO = {"fuerza_bruta": 2, "optimizado": 2, "balltree": 2, "intervalos": 1}
+
+class Medicion:
+    # Contexto que mide tiempo de pared y pico de memoria (tracemalloc) de una etapa
+    def __init__(self, memoria=True):
+        self.memoria = memoria
+        self.segundos = 0.0
+        self.pico_bytes = None
+
+    def __enter__(self):
+        if self.memoria:
+            tracemalloc.reset_peak()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self._inicio
+        if self.memoria:
+            self.pico_bytes = tracemalloc.get_traced_memory()[1]
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _entorno():
+    import sklearn
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scikit_learn": sklearn.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": _commit_actual(),
+    }
+
+def _fila(tamano, eventos, etapa, modo, medicion=None, filas=None, omitido=None):
+    return {
+        "tamano": tamano,
+        "eventos": eventos,
+        "etapa": etapa,
+        "modo": modo,
+        "segundos": round(medicion.segundos, 6) if medicion else None,
+        "pico_memoria_bytes": medicion.pico_bytes if medicion else None,
+        "filas": filas,
+        "omitido": omitido,
+    }
+
+def _omitir(modo, tamano, previas, limite_segundos):
+    # Estima el tiempo a partir de la corrida anterior del mismo modo
+    if not previas.get(modo):
+        return None
+    tamano_previo, segundos_previos = previas[modo]
+    estimado = segundos_previos * (tamano / tamano_previo) ** EXPONENTE_ESCALADO[modo]
+    if estimado > limite_segundos:
+        return f"estimado {estimado:.0f} s > límite {limite_segundos:.0f} s"
+    return None
+
+def medir_tamano(tamano, args, previas, directorio_exportacion):
+    num_eventos = max(1, int(tamano * args.eventos_por_accidente))
+    filas = []
+    eventos = generar_eventos(num_eventos, args.anio, args.semilla)
+
+    # Ingesta: documentos (como llegan del cursor) -> lotes tipados
+    lotes = []
+    medicion = Medicion(args.memoria)
+    for lote in generar_accidentes(tamano, args.anio, args.semilla, MONGODB_BATCH_SIZE):
+        with Medicion(args.memoria) as parcial:
+            lotes.append(LoteAccidentes.desde_documentos(lote))
+        medicion.segundos += parcial.segundos
+        medicion.pico_bytes = max(medicion.pico_bytes or 0, parcial.pico_bytes or 0) if args.memoria else None
+    del lote
+    accidentes = LoteAccidentes.concatenar(lotes)
+    del lotes
+    filas.append(_fila(tamano, num_eventos, "ingesta", "accidentes", medicion, len(accidentes)))
+    with Medicion(args.memoria) as medicion:
+        lote_eventos = LoteEventos.desde_documentos(eventos)
+    filas.append(_fila(tamano, num_eventos, "ingesta", "eventos", medicion, len(lote_eventos)))
+
+    # Join con cada motor; los modos sobre documentos necesitan todos los accidentes en memoria
+    join = None
+    resultados_documentos = None
+    for modo in MODOS_DOCUMENTOS + MODOS_COMPACTOS:
+        if modo not in args.modos:
+            continue
+        if modo in MODOS_DOCUMENTOS and tamano > args.max_documentos:
+            filas.append(_fila(tamano, num_eventos, "join", modo, omitido="tamaño > --max-documentos"))
+            continue
+        motivo = _omitir(modo, tamano, previas, args.limite_segundos)
+        if motivo:
+            filas.append(_fila(tamano, num_eventos, "join", modo, omitido=motivo))
+            continue
+        if modo in MODOS_DOCUMENTOS:
+            documentos = [documento for lote in generar_accidentes(tamano, args.anio, args.semilla, MONGODB_BATCH_SIZE)
+                          for documento in lote]
+            funcion = filtrar_accidentes_por_clima if modo == "fuerza_bruta" else filtrar_accidentes_por_clima_optimizado
+            with Medicion(args.memoria) as medicion:
+                if modo == "fuerza_bruta":
+                    resultado = funcion(documentos, eventos)
+                else:
+                    resultado = funcion(documentos, eventos, args.distancia)
+            if modo == "optimizado":
+                resultados_documentos = resultado
+            del documentos
+            pares = len(resultado)
+        else:
+            with Medicion(args.memoria) as medicion:
+                resultado = calcular_join_periodo([accidentes], lote_eventos, args.distancia, modo, args.workers)
+            join = resultado
+            pares = len(resultado)
+        previas[modo] = (tamano, medicion.segundos)
+        filas.append(_fila(tamano, num_eventos, "join", modo, medicion, pares))
+        del resultado
+
+    # Agregación: cubo en una pasada frente a los conteos originales sobre dicts
+    if join is not None:
+        with Medicion(args.memoria) as medicion:
+            join._cubo = None
+            cubo = join.cubo()
+            cubo.contar("EventType")
+            cubo.contar("Severity")
+            cubo.contar_por_mes()
+        filas.append(_fila(tamano, num_eventos, "agregacion", "cubo", medicion, int(cubo.conteos.sum())))
+    if resultados_documentos is not None:
+        with Medicion(args.memoria) as medicion:
+            contar_accidentes_por_categoria(resultados_documentos, "EventType")
+            contar_accidentes_por_categoria(resultados_documentos, "Severity")
+            contar_accidentes_por_mes(resultados_documentos)
+        filas.append(_fila(tamano, num_eventos, "agregacion", "dicts", medicion, len(resultados_documentos)))
+        del resultados_documentos
+
+    # Exportación: lote de accidentes como .npz (formato de la caché) y conteos como CSV
+    with Medicion(args.memoria) as medicion:
+        ruta = os.path.join(directorio_exportacion, f"accidentes_{tamano}.npz")
+        np.savez_compressed(ruta, **accidentes.columnas())
+        escritas = len(accidentes)
+        if join is not None:
+            celdas = pd.DataFrame(list(join.cubo().celdas()), columns=["EventType", "Severity", "Mes", "State", "Cantidad"])
+            celdas.to_csv(os.path.join(directorio_exportacion, f"conteos_{tamano}.csv"), index=False)
+            escritas += len(celdas)
+    filas.append(_fila(tamano, num_eventos, "exportacion", "npz+csv", medicion, escritas))
+    return filas
+
+def imprimir_tabla(filas):
+    print(f"{'Tamaño':>10} {'Etapa':<12} {'Modo':<13} {'Segundos':>10} {'Pico MB':>9} {'Filas':>11}")
+    for fila in filas:
+        if fila["omitido"]:
+            print(f"{fila['tamano']:>10} {fila['etapa']:<12} {fila['modo']:<13} omitido: {fila['omitido']}")
+            continue
+        pico = f"{fila['pico_memoria_bytes'] / 1e6:.1f}" if fila["pico_memoria_bytes"] is not None else "-"
+        print(f"{fila['tamano']:>10} {fila['etapa']:<12} {fila['modo']:<13} {fila['segundos']:>10.3f} {pico:>9} "
+              f"{fila['filas']:>11}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta, join, agregación y exportación con datos sintéticos.")
+    parser.add_argument("--tamanos", nargs="+", type=int, default=TAMANOS_POR_DEFECTO, help="Cantidades de accidentes")
+    parser.add_argument("--eventos-por-accidente", type=float, default=0.1)
+    parser.add_argument("--modos", nargs="+", choices=MODOS_DOCUMENTOS + MODOS_COMPACTOS,
+                        default=MODOS_DOCUMENTOS + MODOS_COMPACTOS)
+    parser.add_argument("--distancia", type=float, default=DISTANCIA_MAXIMA_KM)
+    parser.add_argument("--workers", type=int, default=JOIN_WORKERS)
+    parser.add_argument("--anio", type=int, default=2017)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--max-documentos", type=int, default=1_000_000,
+                        help="Tamaño máximo para los joins sobre documentos (todos en memoria)")
+    parser.add_argument("--limite-segundos", type=float, default=600,
+                        help="Omitir un modo si el tiempo estimado supera este límite")
+    parser.add_argument("--sin-memoria", dest="memoria", action="store_false",
+                        help="No medir memoria (tracemalloc agrega sobrecosto a las etapas en Python)")
+    parser.add_argument("--salida", default=None, help="Ruta del reporte JSON")
+    args = parser.parse_args(argv)
+
+    salida = args.salida or os.path.join(
+        BENCHMARK_DIR, f"benchmark_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    if args.memoria:
+        tracemalloc.start()
+
+    directorio_exportacion = tempfile.mkdtemp(prefix="benchmark_")
+    filas = []
+    previas = {}
+    try:
+        for tamano in sorted(args.tamanos):
+            print(f"Midiendo {tamano} accidentes...")
+            filas.extend(medir_tamano(tamano, args, previas, directorio_exportacion))
+    finally:
+        shutil.rmtree(directorio_exportacion, ignore_errors=True)
+        if args.memoria:
+            tracemalloc.stop()
+
+    reporte = {
+        "version": VERSION_REPORTE,
+        "fecha": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "entorno": _entorno(),
+        "parametros": {
+            "tamanos": sorted(args.tamanos),
+            "eventos_por_accidente": args.eventos_por_accidente,
+            "modos": args.modos,
+            "distancia_maxima_km": args.distancia,
+            "workers": args.workers,
+            "anio": args.anio,
+            "semilla": args.semilla,
+            "tamano_lote": MONGODB_BATCH_SIZE,
+            "tamano_lote_join": data_processing.TAMANO_LOTE_JOIN,
+            "memoria_tracemalloc": args.memoria,
+        },
+        "resultados": filas,
+    }
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, indent=2, sort_keys=True, ensure_ascii=False)
+        archivo.write("\n")
+    imprimir_tabla(filas)
+    print(f"Reporte: {salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+import time
+_INICIO = time.perf_counter()  # Antes de cualquier otro import, para medir el arranque del script
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Solo módulos livianos al inicio: cada subcomando importa lo que su camino necesita
+# (conexiones, joins, gráficos o exportación) después de validar los argumentos
+from app.config import BENCHMARK_DIR, EXPORT_FORMATO, RENDER_FORMATOS, SNAPSHOT_DIR, SYNC_K
+
+# Módulos cuya carga domina el arranque
+MODULOS_PESADOS = ["numpy", "pandas", "sklearn", "scipy", "matplotlib", "pyarrow", "pymongo", "neo4j", "dateutil"]
+
+def _fecha(texto, fin=False):
+    from app.databases.fetching import normalizar_fecha
+    try:
+        return normalizar_fecha(texto, fin)
+    except ValueError:
+        raise SystemExit(f"Fecha inválida: {texto} (usar AAAA-MM-DD o AAAA-MM-DDTHH:MM:SSZ)")
+
+def _region(args):
+    # Región de --caja, --estado o --circulo (None: todo el país)
+    from app.databases.regions import Region
+    try:
+        if args.caja:
+            return Region.de_caja(*args.caja)
+        if args.estado:
+            return Region.de_estado(args.estado)
+        if args.circulo:
+            return Region.de_circulo(*args.circulo)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    return None
+
+def _nombre(base, region):
+    # Nombre de archivo del gráfico, con la región si la hay
+    if region is None:
+        return base
+    return f"{base}_" + region.clave().replace(":", "_").replace(",", "_")
+
+def _tiempo(args, etapa, inicio):
+    if args.tiempos:
+        print(f"[tiempo] {etapa}: {time.perf_counter() - inicio:.3f} s", file=sys.stderr)
+    return time.perf_counter()
+
+def _arranque_listo(args, neo4j=True):
+    # Con --solo-arranque el comando termina aquí, con sus módulos ya importados y antes
+    # de conectarse; informa el tiempo y los módulos cargados para `arranque`. El driver de
+    # Neo4j se importa al conectar, así que se incluye para medir hasta la primera consulta.
+    if not args.solo_arranque:
+        return False
+    if neo4j:
+        importlib.import_module("neo4j")
+    print(json.dumps({"segundos": time.perf_counter() - _INICIO, "modulos": len(sys.modules),
+                      "pesados": [modulo for modulo in MODULOS_PESADOS if modulo in sys.modules]}))
+    return True
+
+@contextlib.contextmanager
+def _conexiones(args, neo4j=True):
+    # Conexiones, caché y lector como en main.py, sin precalentar los pools (un comando
+    # hace una sola consulta por fuente). El comando mongodb no carga el driver de Neo4j.
+    # Con --snapshot las fuentes son las columnas locales, sin caché ni lector: ya están en
+    # disco y solo se lee lo que el período usa.
+    if getattr(args, "snapshot", None):
+        from app.databases.snapshot import abrir_snapshot
+        try:
+            accidentes, eventos = abrir_snapshot(args.snapshot)
+        except (FileNotFoundError, ValueError) as e:
+            raise SystemExit(str(e))
+        try:
+            yield accidentes, eventos, None, None
+        except ValueError as e:  # Período fuera del snapshot
+            raise SystemExit(str(e))
+        return
+    from app.config import CACHE_HABILITADA, LECTURA_CONCURRENTE
+    from app.services.cache import CacheResultados
+    cache = CacheResultados() if CACHE_HABILITADA and not args.sin_cache else None
+    if not neo4j:
+        from app.databases.mongodb import conectar_mongodb
+        coleccion_mongodb = conectar_mongodb()
+        try:
+            yield coleccion_mongodb, None, cache, None
+        finally:
+            coleccion_mongodb.database.client.close()
+        return
+    from app.databases.neo4j import Neo4jConnector
+    from app.databases.pool import GestorConexiones
+    from app.databases.fetching import LectorConcurrente
+    gestor = GestorConexiones()
+    coleccion_mongodb = gestor.coleccion_mongodb
+    conector = Neo4jConnector(gestor)
+    lector = LectorConcurrente(coleccion_mongodb, conector) if LECTURA_CONCURRENTE else None
+    try:
+        yield coleccion_mongodb, conector, cache, lector
+    finally:
+        if lector is not None:
+            lector.close()
+        gestor.close()
+
+def _rollup(args, clase, archivo):
+    # Con --snapshot el rollup se guarda dentro del snapshot: sus marcas de agua son de esos datos
+    if args.snapshot:
+        return clase(os.path.join(args.snapshot, "rollups", archivo))
+    return clase()
+
+def _sin_grafo(args):
+    if args.desde_grafo and args.snapshot:
+        raise SystemExit("--desde-grafo lee Neo4j; no se combina con --snapshot")
+
+def _importar_graficos(args):
+    # Con --json no se carga matplotlib; con --salida se dibuja sin ventanas (Agg)
+    if args.json:
+        return None
+    if args.salida:
+        import matplotlib
+        matplotlib.use("Agg")
+        from app.services.rendering import renderizar
+        return renderizar
+    from app.services import plotting
+    return plotting
+
+def _entregar(args, tipo, datos, nombre, graficos, inicio):
+    inicio = _tiempo(args, "datos", inicio)
+    if args.json:
+        from app.utils.serialization import a_json, condiciones_a_json
+        print(json.dumps(condiciones_a_json(datos) if tipo == "mongodb" else a_json(datos), ensure_ascii=False,
+                         indent=2))
+        return
+    if args.salida:
+        for ruta in graficos(tipo, datos, os.path.join(args.salida, nombre), args.formatos, not args.sin_csv):
+            print(f"Escrito {ruta}")
+    else:
+        from app.services.rendering import GRAFICOS
+        getattr(graficos, GRAFICOS[tipo])(**datos, export=not args.sin_csv)
+    _tiempo(args, "gráfico", inicio)
+
+def _salida_datos(args):
+    # Con --json los mensajes de progreso de main.py van a stderr para no mezclarse con el JSON
+    return contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext()
+
+def comando_combinado(args):
+    from app.main import datos_graficos_combinados, datos_combinados_grafo
+    graficos = _importar_graficos(args)
+    if _arranque_listo(args, neo4j=not args.snapshot):
+        return
+    _sin_grafo(args)
+    fecha_inicio, fecha_fin = _fecha(args.inicio), _fecha(args.fin, fin=True)
+    region = _region(args)
+    if args.desde_grafo and region is not None:
+        raise SystemExit("--desde-grafo no admite región")
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, cache, lector), _salida_datos(args):
+        if args.desde_grafo:
+            datos = datos_combinados_grafo(fecha_inicio, fecha_fin, args.tipo_clima, args.severidad, neo4j)
+        else:
+            datos = datos_graficos_combinados(fecha_inicio, fecha_fin, args.tipo_clima, args.severidad,
+                                              coleccion_mongodb, neo4j, cache, None, lector, region)
+    _entregar(args, "combinado", datos, _nombre(f"combinado_{args.inicio}_{args.fin}", region), graficos, inicio)
+
+def comando_mongodb(args):
+    from app.main import datos_mongodb
+    graficos = _importar_graficos(args)
+    if _arranque_listo(args, neo4j=False):
+        return
+    fecha_inicio, fecha_fin = _fecha(args.inicio), _fecha(args.fin, fin=True)
+    region = _region(args)
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args, neo4j=False) as (coleccion_mongodb, _, cache, _), _salida_datos(args):
+        datos = datos_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb, cache, region=region)
+    _entregar(args, "mongodb", datos, _nombre(f"mongodb_{args.inicio}_{args.fin}", region), graficos, inicio)
+
+def comando_neo4j(args):
+    from app.main import datos_neo4j
+    graficos = _importar_graficos(args)
+    if _arranque_listo(args, neo4j=not args.snapshot):
+        return
+    fecha_inicio, fecha_fin = _fecha(args.inicio), _fecha(args.fin, fin=True)
+    region = _region(args)
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, cache, lector), _salida_datos(args):
+        datos = datos_neo4j(fecha_inicio, fecha_fin, neo4j, cache, lector, region, coleccion_mongodb)
+    _entregar(args, "neo4j", datos, _nombre(f"neo4j_{args.inicio}_{args.fin}", region), graficos, inicio)
+
+def comando_mensual(args):
+    from app.main import datos_accidentes_mensuales, datos_mensuales_grafo
+    from app.services.rollups import RollupMensual
+    graficos = _importar_graficos(args)
+    if _arranque_listo(args, neo4j=not args.snapshot):
+        return
+    _sin_grafo(args)
+    tipo_analisis = '1' if args.tipo == "clima" else '2'
+    categoria = args.categoria or ("All" if args.tipo == "clima" else None)
+    if categoria is None:
+        raise SystemExit("--categoria es obligatoria con --tipo severidad")
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, cache, lector), _salida_datos(args):
+        if args.desde_grafo:
+            datos = datos_mensuales_grafo(str(args.anio), tipo_analisis, categoria, neo4j)
+        else:
+            datos = datos_accidentes_mensuales(str(args.anio), tipo_analisis, categoria, coleccion_mongodb, neo4j,
+                                               _rollup(args, RollupMensual, "mensual.json"), cache, lector)
+    nombre = f"mensual_{args.anio}_{categoria.replace(' ', '_')}"
+    _entregar(args, "mensual", datos, nombre, graficos, inicio)
+
+def comando_distribuciones(args):
+    # Condiciones ambientales de años completos desde los resúmenes mensuales guardados
+    from app.main import datos_condiciones_anuales
+    from app.services.rollups import RollupCondiciones
+    graficos = _importar_graficos(args)
+    if _arranque_listo(args, neo4j=False):
+        return
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args, neo4j=False) as (coleccion_mongodb, _, _, _), _salida_datos(args):
+        rollup = _rollup(args, RollupCondiciones, "condiciones.json")
+        if args.reconstruir:
+            for anio in args.anios:
+                rollup.invalidar(anio)
+        datos = datos_condiciones_anuales(args.anios, coleccion_mongodb, rollup)
+    nombre = f"distribuciones_{min(args.anios)}" + (f"_{max(args.anios)}" if len(set(args.anios)) > 1 else "")
+    _entregar(args, "mongodb", datos, nombre, graficos, inicio)
+
+def comando_exportar(args):
+    # Solo exportación: pares accidente-evento a Parquet/Arrow, sin gráficos
+    from app.main import exportar_asociaciones_periodo
+    from app.services import exporting
+    if exporting.pa is None:
+        raise SystemExit("La exportación columnar requiere pyarrow (pip install pyarrow)")
+    if _arranque_listo(args, neo4j=not args.snapshot):
+        return
+    fecha_inicio, fecha_fin = _fecha(args.inicio), _fecha(args.fin, fin=True)
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, cache, lector):
+        escritor = exportar_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector,
+                                                 args.reemplazar, args.formato, args.k)
+    print(f"Se exportaron {escritor.filas} pares en {len(escritor.archivos)} archivos bajo {escritor.directorio}")
+    _tiempo(args, "exportación", inicio)
+
+def comando_sincronizar(args):
+    # Sincronización incremental de la tabla de pares accidente-evento (app/services/sync.py)
+    from datetime import date
+    from app.services.sync import TablaAsociaciones, sincronizar
+    if _arranque_listo(args):
+        return
+    try:
+        if date.fromisoformat(args.inicio) > date.fromisoformat(args.fin):
+            raise SystemExit("--inicio debe ser anterior a --fin")
+    except ValueError:
+        raise SystemExit("Las fechas de sincronizar son días AAAA-MM-DD")
+    tabla = TablaAsociaciones()
+    if args.reiniciar:
+        tabla.reiniciar()
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, _, _):
+        resumen = sincronizar(coleccion_mongodb, neo4j, tabla, args.inicio, args.fin, k=args.k)
+    print(f"Accidentes nuevos: {resumen['accidentes_nuevos']}, eventos nuevos: {resumen['eventos_nuevos']}, "
+          f"accidentes revisados por eventos nuevos: {resumen['accidentes_revisados']}")
+    print(f"Pares nuevos: {resumen['pares_nuevos']} (total {tabla.estado['pares']}) "
+          f"en {resumen['segundos']:.2f} s, guardados en {tabla.directorio}")
+    _tiempo(args, "sincronización", inicio)
+
+def comando_grafo(args):
+    # Escribe los pares accidente-evento del período en Neo4j (relaciones DURANTE)
+    from app.main import escribir_asociaciones_periodo
+    if _arranque_listo(args):
+        return
+    fecha_inicio, fecha_fin = _fecha(args.inicio), _fecha(args.fin, fin=True)
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, cache, lector):
+        resumen = escribir_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector, args.k)
+    print(f"Se escribieron {resumen['relaciones']} relaciones DURANTE de {resumen['accidentes']} accidentes "
+          f"({resumen['nodos_creados']} nodos :Accidente nuevos) en {resumen['transacciones']} transacciones")
+    print(f"Escritura: {resumen['segundos_escritura']:.2f} s, {resumen['relaciones_por_s']:.0f} relaciones/s")
+    _tiempo(args, "escritura", inicio)
+
+def comando_indices(args):
+    # Crea los índices que usan las consultas por período y por región. Se corre una vez y
+    # después de cargar accidentes o eventos sin la propiedad Ubicacion.
+    from app.databases.mongodb import asegurar_indices_region
+    if _arranque_listo(args):
+        return
+    with _conexiones(args) as (coleccion_mongodb, neo4j, _, _):
+        mongodb = asegurar_indices_region(coleccion_mongodb)
+        print(f"MongoDB: Ubicacion agregada a {mongodb['documentos_actualizados']} accidentes; "
+              f"índices {', '.join(mongodb['indices'])}")
+        print(f"Neo4j: índice de fechas {neo4j.asegurar_indice_fechas()}")
+        neo4j.asegurar_esquema_asociaciones()
+        print("Neo4j: restricción de :Accidente(ID) e índices de :Evento(EventId) y :Accidente(StartTime)")
+        ubicacion = neo4j.asegurar_indice_ubicacion()
+        print(f"Neo4j: Ubicacion agregada a {ubicacion['eventos_actualizados']} eventos; "
+              f"índice de ubicación {ubicacion['estado']}")
+
+def comando_snapshot(args):
+    # Vuelca Accidents y :Evento a columnas locales ordenadas por fecha (app/databases/snapshot.py)
+    from app.databases.snapshot import PERIODO_COMPLETO, crear_snapshot
+    if _arranque_listo(args):
+        return
+    fecha_inicio = _fecha(args.inicio) if args.inicio else PERIODO_COMPLETO[0]
+    fecha_fin = _fecha(args.fin, fin=True) if args.fin else PERIODO_COMPLETO[1]
+    inicio = _tiempo(args, "arranque", _INICIO)
+    with _conexiones(args) as (coleccion_mongodb, neo4j, _, _):
+        try:
+            manifiesto = crear_snapshot(coleccion_mongodb, neo4j, args.directorio, fecha_inicio, fecha_fin)
+        except ValueError as e:
+            raise SystemExit(str(e))
+    print(f"Snapshot de {manifiesto['accidentes']['filas']} accidentes y {manifiesto['eventos']['filas']} eventos "
+          f"({manifiesto['bytes'] / 1024 ** 2:.1f} MB) en {args.directorio}, {manifiesto['segundos']:.1f} s")
+    _tiempo(args, "snapshot", inicio)
+
+# Casos medidos por `arranque`: nombre -> argumentos de este script
+CASOS_ARRANQUE = {
+    "ayuda": ["--help"],
+    "combinado --json": ["combinado", "--inicio", "2017-01-01", "--fin", "2017-12-31", "--json"],
+    "combinado --salida": ["combinado", "--inicio", "2017-01-01", "--fin", "2017-12-31", "--salida", "graficos"],
+    "combinado (ventana)": ["combinado", "--inicio", "2017-01-01", "--fin", "2017-12-31"],
+    "mongodb --json": ["mongodb", "--inicio", "2017-01-01", "--fin", "2017-12-31", "--json"],
+    "neo4j --json": ["neo4j", "--inicio", "2017-01-01", "--fin", "2017-12-31", "--json"],
+    "mensual --json": ["mensual", "--anio", "2017", "--json"],
+    "exportar": ["exportar", "--inicio", "2017-01-01", "--fin", "2017-12-31"],
+    "combinado --snapshot": ["combinado", "--inicio", "2017-01-01", "--fin", "2017-12-31", "--json", "--snapshot"],
+}
+
+def _medir_proceso(comando, repeticiones):
+    # Tiempo de pared de procesos nuevos (arranque en frío del intérprete incluido)
+    tiempos = []
+    detalle = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = subprocess.run(comando, capture_output=True, text=True)
+        tiempos.append(time.perf_counter() - inicio)
+        if resultado.returncode != 0:
+            return {"error": resultado.stderr.strip().splitlines()[-1] if resultado.stderr.strip() else "error"}
+        lineas = resultado.stdout.strip().splitlines()
+        if lineas and lineas[-1].startswith("{"):
+            detalle = json.loads(lineas[-1])
+    fila = {"min_s": min(tiempos), "mediana_s": statistics.median(tiempos), "repeticiones": repeticiones}
+    if detalle is not None:
+        fila.update({"script_s": detalle["segundos"], "modulos": detalle["modulos"], "pesados": detalle["pesados"]})
+    return fila
+
+def comando_arranque(args):
+    # Mide el arranque en frío de cada subcomando: proceso nuevo hasta quedar listo para
+    # consultar (módulos del camino importados, sin conectarse)
+    script = os.path.abspath(__file__)
+    raiz = os.path.dirname(os.path.dirname(script))
+    casos = {"python -c pass": [sys.executable, "-c", "pass"],
+             "import app.main": [sys.executable, "-c", f"import sys; sys.path.insert(0, {raiz!r}); import app.main"]}
+    for nombre, argumentos in CASOS_ARRANQUE.items():
+        extra = [] if argumentos == ["--help"] else ["--solo-arranque"]
+        casos[nombre] = [sys.executable, script] + argumentos + extra
+
+    filas = {}
+    print(f"{'Caso':<24} {'Mín s':>7} {'Mediana s':>10} {'Módulos':>8}  Pesados cargados")
+    for nombre, comando in casos.items():
+        fila = filas[nombre] = _medir_proceso(comando, args.repeticiones)
+        if "error" in fila:
+            print(f"{nombre:<24} error: {fila['error']}")
+            continue
+        print(f"{nombre:<24} {fila['min_s']:>7.3f} {fila['mediana_s']:>10.3f} {fila.get('modulos', '-'):>8}  "
+              f"{', '.join(fila.get('pesados', [])) or '-'}")
+
+    salida = args.salida_reporte or os.path.join(
+        BENCHMARK_DIR, f"arranque_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump({"fecha": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "python": sys.version.split()[0],
+                   "casos": filas}, archivo, indent=2, sort_keys=True, ensure_ascii=False)
+    print(f"Reporte guardado en {salida}")
+
+def _argumentos_periodo(parser):
+    parser.add_argument("--inicio", required=True, help="AAAA-MM-DD o AAAA-MM-DDTHH:MM:SSZ")
+    parser.add_argument("--fin", required=True, help="AAAA-MM-DD (día completo) o AAAA-MM-DDTHH:MM:SSZ")
+
+def _argumentos_salida(parser):
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument("--json", action="store_true", help="Imprimir los datos como JSON, sin gráfico")
+    grupo.add_argument("--salida", default=None, help="Carpeta donde guardar el gráfico (sin abrir ventana)")
+    parser.add_argument("--formatos", nargs="+", choices=["png", "svg", "pdf"], default=list(RENDER_FORMATOS))
+    parser.add_argument("--sin-csv", action="store_true", help="No exportar el CSV del gráfico")
+
+def _argumentos_region(parser):
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument("--caja", nargs=4, type=float, default=None, metavar=("LAT_MIN", "LNG_MIN", "LAT_MAX", "LNG_MAX"),
+                       help="Solo la región dentro de la caja")
+    grupo.add_argument("--estado", default=None, help="Solo los accidentes del estado (e.g., CA)")
+    grupo.add_argument("--circulo", nargs=3, type=float, default=None, metavar=("LAT", "LNG", "RADIO_KM"),
+                       help="Solo la región a menos de RADIO_KM del centro")
+
+def _argumentos_snapshot(parser):
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR, default=None, metavar="DIR",
+                        help="Leer de un snapshot local (subcomando snapshot) en lugar de MongoDB y Neo4j")
+
+def _argumentos_comunes(parser):
+    parser.add_argument("--sin-cache", action="store_true", help="No leer ni escribir la caché de resultados")
+    parser.add_argument("--tiempos", action="store_true", help="Mostrar en stderr el tiempo de cada etapa")
+    parser.add_argument("--solo-arranque", action="store_true", help=argparse.SUPPRESS)
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Análisis de accidentes y clima sin menú interactivo.")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    combinado = subcomandos.add_parser("combinado", help="Accidentes asociados a eventos climáticos (opción 4)")
+    _argumentos_periodo(combinado)
+    combinado.add_argument("--tipo-clima", default=None, help="Filtro de tipo de clima (e.g., Fog, Rain)")
+    combinado.add_argument("--severidad", default=None, help="Filtro de severidad del clima (e.g., Mild, Severe)")
+    _argumentos_region(combinado)
+    combinado.add_argument("--desde-grafo", action="store_true",
+                           help="Contar las relaciones DURANTE guardadas en Neo4j en lugar de calcular el join")
+    _argumentos_salida(combinado)
+    combinado.set_defaults(funcion=comando_combinado)
+
+    mongodb = subcomandos.add_parser("mongodb", help="Condiciones ambientales de los accidentes (opción 6)")
+    _argumentos_periodo(mongodb)
+    _argumentos_region(mongodb)
+    _argumentos_salida(mongodb)
+    mongodb.set_defaults(funcion=comando_mongodb)
+
+    neo4j = subcomandos.add_parser("neo4j", help="Eventos climáticos del período (opción 7)")
+    _argumentos_periodo(neo4j)
+    _argumentos_region(neo4j)
+    _argumentos_salida(neo4j)
+    neo4j.set_defaults(funcion=comando_neo4j)
+
+    mensual = subcomandos.add_parser("mensual", help="Accidentes por mes de un año (opción 5)")
+    mensual.add_argument("--anio", type=int, required=True)
+    mensual.add_argument("--tipo", choices=["clima", "severidad"], default="clima")
+    mensual.add_argument("--categoria", default=None, help="Condición climática (All por defecto) o severidad")
+    mensual.add_argument("--desde-grafo", action="store_true",
+                         help="Contar las relaciones DURANTE guardadas en Neo4j en lugar del rollup")
+    _argumentos_salida(mensual)
+    mensual.set_defaults(funcion=comando_mensual)
+
+    distribuciones = subcomandos.add_parser("distribuciones", help="Condiciones ambientales de años completos desde "
+                                                                   "histogramas y cuantiles mensuales guardados")
+    distribuciones.add_argument("--anios", type=int, nargs="+", required=True)
+    distribuciones.add_argument("--reconstruir", action="store_true",
+                                help="Descartar los resúmenes guardados de esos años y leerlos de nuevo")
+    _argumentos_salida(distribuciones)
+    distribuciones.set_defaults(funcion=comando_distribuciones)
+
+    exportar = subcomandos.add_parser("exportar", help="Solo exportar pares accidente-evento (opción 10)")
+    _argumentos_periodo(exportar)
+    exportar.add_argument("--formato", choices=["parquet", "arrow"], default=EXPORT_FORMATO)
+    exportar.add_argument("--reemplazar", action="store_true", help="Reemplazar las particiones año/mes del período")
+    exportar.add_argument("--k", type=int, default=1, help="Eventos más cercanos por accidente")
+    exportar.set_defaults(funcion=comando_exportar)
+
+    sincronizar = subcomandos.add_parser("sincronizar", help="Asociar solo los accidentes y eventos nuevos")
+    sincronizar.add_argument("--inicio", required=True, help="AAAA-MM-DD")
+    sincronizar.add_argument("--fin", required=True, help="AAAA-MM-DD (día completo)")
+    sincronizar.add_argument("--k", type=int, default=SYNC_K, help="Eventos más cercanos por accidente")
+    sincronizar.add_argument("--reiniciar", action="store_true", help="Borrar la tabla y asociar todo de nuevo")
+    sincronizar.set_defaults(funcion=comando_sincronizar)
+
+    grafo = subcomandos.add_parser("grafo", help="Guardar pares accidente-evento en Neo4j (opción 11)")
+    _argumentos_periodo(grafo)
+    grafo.add_argument("--k", type=int, default=1, help="Eventos más cercanos por accidente")
+    grafo.set_defaults(funcion=comando_grafo)
+
+    indices = subcomandos.add_parser("indices", help="Crear los índices de fechas y de región en MongoDB y Neo4j")
+    indices.set_defaults(funcion=comando_indices)
+
+    snapshot = subcomandos.add_parser("snapshot", help="Copiar accidentes y eventos a columnas locales para "
+                                                       "analizar sin las bases")
+    snapshot.add_argument("--directorio", default=SNAPSHOT_DIR)
+    snapshot.add_argument("--inicio", default=None, help="AAAA-MM-DD (por defecto, todos los datos)")
+    snapshot.add_argument("--fin", default=None, help="AAAA-MM-DD (día completo)")
+    snapshot.set_defaults(funcion=comando_snapshot)
+
+    for subparser in (combinado, mongodb, neo4j, mensual, distribuciones, exportar):
+        _argumentos_snapshot(subparser)
+    for subparser in (combinado, mongodb, neo4j, mensual, distribuciones, exportar, sincronizar, grafo, indices,
+                      snapshot):
+        _argumentos_comunes(subparser)
+
+    arranque = subcomandos.add_parser("arranque", help="Medir el arranque en frío de cada subcomando")
+    arranque.add_argument("--repeticiones", type=int, default=5)
+    arranque.add_argument("--salida-reporte", default=None, help="Ruta del reporte JSON")
+    arranque.set_defaults(funcion=comando_arranque)
+    return parser
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    args.funcion(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+
 
 MONGODB_URI = "mongodb://localhost:27017"
 MONGODB_DB_NAME = "US-Weather-Accidents"
@@ -6,3 +8,94 @@ MONGODB_COLLECTION_NAME = "Accidents"
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "******"  # Reemplazar con la contraseña correcta
+
+# Modo de join accidente-evento: "fuerza_bruta", "balltree" o "intervalos"
+MODO_JOIN = "balltree"
+
+# Documentos por lote al leer accidentes de MongoDB
+MONGODB_BATCH_SIZE = 50000
+
+# Calcular conteos e histogramas de condiciones en MongoDB (pipeline $facet)
+AGREGACION_EN_SERVIDOR = True
+
+# Registros por lote al leer eventos de Neo4j
+NEO4J_FETCH_SIZE = 10000
+
+# Relaciones (:Accidente)-[:DURANTE]->(:Evento) escritas por transacción
+NEO4J_ESCRITURA_LOTE = 10000
+
+# Caché persistente de resultados por período
+CACHE_HABILITADA = True
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache")
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+# Memoria máxima para joins accidente-evento reutilizados entre filtros
+JOIN_CACHE_MAX_BYTES = 512 * 1024 ** 2  # 512 MB
+DISTANCIA_MAXIMA_KM = 1000
+CUBO_POR_ESTADO = False  # Leer State de cada accidente para desglosar los conteos por estado
+
+# Conteos mensuales materializados (opción 5)
+ROLLUP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rollups", "mensual.json")
+
+# Procesos para el join paralelo (1 = serial, None = todos los núcleos)
+JOIN_WORKERS = 1
+
+# Lectura concurrente de MongoDB y Neo4j por subrangos mensuales
+LECTURA_CONCURRENTE = True
+LECTURA_HILOS = 4  # Subrangos leídos a la vez por cada fuente
+PRECARGAR_PERIODO_SIGUIENTE = True
+
+# Pool de conexiones compartido (MongoDB y Neo4j): un hilo de lectura por subrango más
+# el hilo principal y la precarga; los procesos del join paralelo no usan conexiones
+POOL_TAMANO = LECTURA_HILOS + 2
+POOL_CALENTAR = LECTURA_HILOS  # Conexiones abiertas al iniciar
+POOL_TIMEOUT_S = 60
+
+# Generación de gráficos sin interfaz (python app/batch.py)
+GRAFICOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "graphs")
+RENDER_WORKERS = None  # Procesos que dibujan a la vez (None = todos los núcleos)
+RENDER_FORMATOS = ("png",)
+
+# Reportes de python app/benchmark.py
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "benchmarks")
+
+# Instrumentación por etapas: al terminar cada acción imprime una tabla de tiempos,
+# contadores y RSS, y guarda la traza completa como JSON
+INSTRUMENTACION = False
+TRAZAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "traces")
+RSS_INTERVALO_S = 0.05  # Cada cuánto se muestrea la memoria residente
+
+# Exportación de pares accidente-evento en archivos columnares particionados por año/mes
+# (requiere pyarrow)
+ASOCIACIONES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "exports", "asociaciones")
+EXPORT_FORMATO = "parquet"  # "parquet" o "arrow" (Arrow IPC)
+EXPORT_FILAS_POR_GRUPO = 100000  # Filas por grupo escrito; limita la memoria por partición
+
+# Servicio HTTP/JSON (python app/server.py): conexiones, índices y cachés quedan en memoria
+# entre solicitudes
+SERVICIO_HOST = "127.0.0.1"
+SERVICIO_PUERTO = 8080
+SERVICIO_MAX_CONCURRENTES = 8  # Análisis calculados a la vez; el resto espera turno
+
+# Sincronización incremental (python app/cli.py sincronizar): tabla de pares accidente-evento
+# persistida por mes y marcas de agua de MongoDB (_id) y Neo4j (id de nodo)
+SYNC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sync")
+SYNC_K = 1  # Eventos más cercanos guardados por accidente
+SYNC_MARGEN_EVENTOS_S = 7 * 86400  # Se leen los eventos que empezaron hasta 7 días antes del mes del accidente
+
+# Snapshot local (python app/cli.py snapshot): accidentes y eventos en columnas .npy
+# ordenadas por fecha, que se abren con mmap para analizar sin MongoDB ni Neo4j
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshot")
+SNAPSHOT_FILAS_POR_BLOQUE = 1_000_000  # Filas reordenadas a la vez al cerrar cada tabla
+
+# Distribuciones de las condiciones numéricas que se suman entre meses y años
+# (app/services/sketches.py): bins fijos (inicio, fin, cantidad) y tamaño de los sketches
+# de cuantiles
+BINS_CONDICIONES = {
+    "Precipitation(in)": (0.0, 2.0, 20),
+    "Temperature(F)": (-40.0, 120.0, 32),
+    "Humidity(%)": (0.0, 100.0, 20),
+}
+KLL_K = 200  # Error de rango de los cuantiles ~1.65% con 200
+ROLLUP_CONDICIONES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rollups",
+                                       "condiciones.json")
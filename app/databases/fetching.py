@@ -0,0 +1,186 @@
+import calendar
+import threading
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from app.config import LECTURA_HILOS
+from app.databases.mongodb import consultar_accidentes_por_lotes
+from app.databases.records import LoteAccidentes, LoteEventos
+
+FORMATO_FECHA = "%Y-%m-%dT%H:%M:%SZ"
+
+def _a_datetime(fecha):
+    return datetime.fromisoformat(fecha.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+def _a_texto(fecha):
+    return fecha.strftime(FORMATO_FECHA)
+
+def normalizar_fecha(texto, fin=False):
+    # AAAA-MM-DD (día completo: 00:00:00 como inicio, 23:59:59 como fin) o AAAA-MM-DDTHH:MM:SSZ.
+    # Lanza ValueError si la fecha no es válida.
+    if len(texto) == 10:
+        datetime.strptime(texto, "%Y-%m-%d")
+        return f"{texto}T23:59:59Z" if fin else f"{texto}T00:00:00Z"
+    datetime.strptime(texto, FORMATO_FECHA)
+    return texto
+
+def _sumar_meses(fecha, meses):
+    mes = fecha.month - 1 + meses
+    anio = fecha.year + mes // 12
+    mes = mes % 12 + 1
+    dia = min(fecha.day, calendar.monthrange(anio, mes)[1])
+    return fecha.replace(year=anio, month=mes, day=dia)
+
+def dividir_por_meses(fecha_inicio, fecha_fin):
+    # Subrangos (inicio, fin, fin_exclusivo) que cubren exactamente [fecha_inicio, fecha_fin]:
+    # se corta en cada inicio de mes y solo el último subrango incluye su fin.
+    inicio = _a_datetime(fecha_inicio)
+    fin = _a_datetime(fecha_fin)
+    cortes = []
+    corte = _sumar_meses(inicio.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 1)
+    while corte <= fin:
+        cortes.append(corte)
+        corte = _sumar_meses(corte, 1)
+    if cortes and cortes[-1] == fin:
+        cortes.pop()  # Evitar un último subrango vacío
+    limites = [fecha_inicio] + [_a_texto(c) for c in cortes] + [fecha_fin]
+    return [(limites[i], limites[i + 1], i < len(limites) - 2) for i in range(len(limites) - 1)]
+
+def periodo_siguiente(fecha_inicio, fecha_fin):
+    # Período adyacente posterior: el mismo número de meses si el período son meses
+    # completos, o la misma duración en otro caso.
+    inicio = _a_datetime(fecha_inicio)
+    fin = _a_datetime(fecha_fin)
+    siguiente = fin + timedelta(seconds=1)
+    if inicio.day == 1 and inicio.time() == datetime.min.time() and siguiente.day == 1 \
+            and siguiente.time() == datetime.min.time():
+        meses = (siguiente.year - inicio.year) * 12 + siguiente.month - inicio.month
+        return _a_texto(siguiente), _a_texto(_sumar_meses(siguiente, meses) - timedelta(seconds=1))
+    return _a_texto(siguiente), _a_texto(siguiente + (fin - inicio))
+
+class LectorConcurrente:
+    # Capa de lectura sobre conectar_mongodb/Neo4jConnector: lee ambas fuentes a la vez,
+    # divide los períodos largos en meses leídos en paralelo (cada uno con su cursor o
+    # sesión) y puede precargar en segundo plano el período siguiente. Devuelve lo mismo
+    # que las funciones originales: lista de eventos y lotes de documentos de accidentes,
+    # o con compacto=True un LoteEventos y un LoteAccidentes por mes. Con region cada
+    # lectura mensual lleva el filtro espacial.
+
+    def __init__(self, coleccion_mongodb, neo4j, hilos=LECTURA_HILOS):
+        self.coleccion = coleccion_mongodb
+        self.neo4j = neo4j
+        self.hilos = hilos
+        self._pool_mongodb = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="mongodb")
+        self._pool_neo4j = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="neo4j")
+        self._pool_precarga = ThreadPoolExecutor(max_workers=2, thread_name_prefix="precarga")
+        self._lock = threading.Lock()
+        self._precargas = {}
+        self._pendientes = set()  # Lecturas enviadas a los pools que todavía no terminaron
+
+    def _enviar(self, pool, funcion, *argumentos):
+        futuro = pool.submit(funcion, *argumentos)
+        with self._lock:
+            self._pendientes.add(futuro)
+        futuro.add_done_callback(self._terminado)
+        return futuro
+
+    def _terminado(self, futuro):
+        with self._lock:
+            self._pendientes.discard(futuro)
+
+    def close(self):
+        # shutdown(cancel_futures=True) requiere Python 3.9: se cancelan a mano las lecturas
+        # que todavía no empezaron y se cierran los pools sin esperar las que están en curso
+        with self._lock:
+            pendientes = list(self._pendientes) + list(self._precargas.values())
+            self._precargas = {}
+        for futuro in pendientes:
+            futuro.cancel()
+        for pool in (self._pool_precarga, self._pool_mongodb, self._pool_neo4j):
+            pool.shutdown(wait=False)
+
+    def _tomar_precarga(self, clave):
+        with self._lock:
+            futuro = self._precargas.pop(clave, None)
+        return futuro.result() if futuro is not None else None
+
+    def obtener_eventos_por_periodo(self, fecha_inicio, fecha_fin, region=None):
+        if region is None:
+            precargado = self._tomar_precarga(("eventos", fecha_inicio, fecha_fin, False))
+            if precargado is not None:
+                return precargado
+        return self._leer_eventos(fecha_inicio, fecha_fin, region=region)
+
+    def obtener_lote_eventos(self, fecha_inicio, fecha_fin, region=None):
+        if region is None:
+            precargado = self._tomar_precarga(("eventos", fecha_inicio, fecha_fin, True))
+            if precargado is not None:
+                return precargado
+        return self._leer_eventos(fecha_inicio, fecha_fin, compacto=True, region=region)
+
+    def _leer_eventos(self, fecha_inicio, fecha_fin, compacto=False, region=None):
+        leer = self.neo4j.obtener_lote_eventos if compacto else self.neo4j.obtener_eventos_por_periodo
+        futuros = [
+            self._enviar(self._pool_neo4j, leer, inicio, fin, fin_exclusivo, region)
+            for inicio, fin, fin_exclusivo in dividir_por_meses(fecha_inicio, fecha_fin)
+        ]
+        if compacto:
+            return LoteEventos.concatenar(futuro.result() for futuro in futuros)
+        eventos = []
+        for futuro in futuros:
+            eventos.extend(futuro.result())
+        return eventos
+
+    def consultar_accidentes_por_lotes(self, fecha_inicio, fecha_fin, campos=None, compacto=False, region=None):
+        # Las lecturas empiezan al llamar (no al iterar), para solaparlas con Neo4j.
+        # Como mucho `hilos` meses en memoria a la vez; los lotes salen en orden de fecha.
+        if region is None:
+            precargado = self._tomar_precarga(("accidentes", fecha_inicio, fecha_fin, tuple(campos or ()), compacto))
+            if precargado is not None:
+                return iter(precargado)
+        return self._leer_accidentes(fecha_inicio, fecha_fin, campos, compacto, region)
+
+    def _leer_accidentes(self, fecha_inicio, fecha_fin, campos, compacto=False, region=None):
+        def leer_mes(inicio, fin, fin_exclusivo):
+            lotes = consultar_accidentes_por_lotes(self.coleccion, inicio, fin, campos, fin_exclusivo=fin_exclusivo,
+                                                   region=region)
+            if compacto:
+                # Un LoteAccidentes por mes, construido mientras se recorre el cursor
+                return [LoteAccidentes.desde_documentos(chain.from_iterable(lotes))]
+            return list(lotes)
+
+        pendientes = deque(dividir_por_meses(fecha_inicio, fecha_fin))
+        en_curso = deque()
+        while pendientes and len(en_curso) < self.hilos:
+            en_curso.append(self._enviar(self._pool_mongodb, leer_mes, *pendientes.popleft()))
+
+        def lotes():
+            while en_curso:
+                lotes_mes = en_curso.popleft().result()
+                if pendientes:
+                    en_curso.append(self._enviar(self._pool_mongodb, leer_mes, *pendientes.popleft()))
+                yield from lotes_mes
+
+        return lotes()
+
+    def precargar(self, fecha_inicio, fecha_fin, campos=None, compacto=False):
+        # Lee en segundo plano eventos y accidentes del período; se consumen una sola vez
+        def cargar_eventos():
+            return self._leer_eventos(fecha_inicio, fecha_fin, compacto)
+
+        def cargar_accidentes():
+            return list(self._leer_accidentes(fecha_inicio, fecha_fin, campos, compacto))
+
+        with self._lock:
+            # Solo se conserva la precarga más reciente para acotar la memoria
+            for futuro in self._precargas.values():
+                futuro.cancel()
+            self._precargas = {
+                ("eventos", fecha_inicio, fecha_fin, compacto): self._pool_precarga.submit(cargar_eventos),
+                ("accidentes", fecha_inicio, fecha_fin, tuple(campos or ()), compacto):
+                    self._pool_precarga.submit(cargar_accidentes),
+            }
+
+    def precargar_siguiente(self, fecha_inicio, fecha_fin, campos=None, compacto=False):
+        self.precargar(*periodo_siguiente(fecha_inicio, fecha_fin), campos, compacto)
@@ -0,0 +1,357 @@
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from types import SimpleNamespace
+import numpy as np
+from bson import ObjectId
+from app.config import NEO4J_FETCH_SIZE
+from app.services.data_processing import RADIO_TIERRA_KM
+from app.databases.records import LoteEventos, fechas_a_epoch
+from app.databases.regions import Region
+
+# Sustitutos en memoria de la colección de MongoDB y de Neo4jConnector, con el subconjunto
+# de operaciones que usa la aplicación. Sirven para levantar el servicio o probar los
+# análisis con datos sintéticos (app/services/synthetic.py) sin bases de datos.
+
+def _id_secuencial(i):
+    # ObjectId creciente con el orden de inserción, como los generados por MongoDB
+    return ObjectId(int(i).to_bytes(12, "big"))
+
+def _es_numero(valor):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+def _dentro(punto, forma):
+    # $geoWithin sobre un punto GeoJSON: $centerSphere o un $geometry Polygon que, como los
+    # de Region, es una caja (se compara contra sus extremos)
+    if not isinstance(punto, dict):
+        return False
+    lng, lat = punto["coordinates"]
+    if "$centerSphere" in forma:
+        (lng0, lat0), radio = forma["$centerSphere"]
+        return Region.de_circulo(lat0, lng0, radio * RADIO_TIERRA_KM).contiene(lat, lng)
+    anillo = forma["$geometry"]["coordinates"][0]
+    longitudes, latitudes = [p[0] for p in anillo], [p[1] for p in anillo]
+    return min(latitudes) <= lat <= max(latitudes) and min(longitudes) <= lng <= max(longitudes)
+
+def _cumple(valor, condicion):
+    if not isinstance(condicion, dict):
+        return valor == condicion
+    for operador, referencia in condicion.items():
+        if operador == "$exists":
+            if (valor is not None) != bool(referencia):
+                return False
+            continue
+        if operador == "$geoWithin":
+            if not _dentro(valor, referencia):
+                return False
+            continue
+        if operador == "$type":
+            if referencia != "number" or not _es_numero(valor):
+                return False
+            continue
+        if valor is None or (_es_numero(referencia) != _es_numero(valor)):
+            return False
+        if operador == "$gte" and not valor >= referencia:
+            return False
+        if operador == "$gt" and not valor > referencia:
+            return False
+        if operador == "$lte" and not valor <= referencia:
+            return False
+        if operador == "$lt" and not valor < referencia:
+            return False
+        if operador not in ("$gte", "$gt", "$lte", "$lt"):
+            raise NotImplementedError(f"Operador no soportado: {operador}")
+    return True
+
+def _coincide(documento, filtro):
+    return all(_cumple(documento.get(campo), condicion) for campo, condicion in filtro.items())
+
+def _evaluar(expresion, documento):
+    # Expresiones de agregación usadas por agregar_condiciones_ambientales
+    if isinstance(expresion, str) and expresion.startswith("$"):
+        return documento.get(expresion[1:])
+    if isinstance(expresion, list):
+        return [_evaluar(e, documento) for e in expresion]
+    if not isinstance(expresion, dict):
+        return expresion
+    if not next(iter(expresion), "$").startswith("$"):
+        return {campo: _evaluar(valor, documento) for campo, valor in expresion.items()}
+    operador, argumentos = next(iter(expresion.items()))
+    if operador == "$cond":
+        condicion, si, no = argumentos
+        return _evaluar(si, documento) if _evaluar(condicion, documento) else _evaluar(no, documento)
+    if operador == "$and":
+        return all(_evaluar(a, documento) for a in argumentos)
+    if operador == "$isNumber":
+        return _es_numero(_evaluar(argumentos, documento))
+    if operador == "$eq":
+        a, b = _evaluar(argumentos, documento)
+        return a == b
+    if operador == "$ifNull":
+        valor, alternativa = argumentos
+        valor = _evaluar(valor, documento)
+        return _evaluar(alternativa, documento) if valor is None else valor
+    raise NotImplementedError(f"Expresión no soportada: {operador}")
+
+def _agrupar(documentos, grupo):
+    acumulados = {}
+    for documento in documentos:
+        clave = _evaluar(grupo["_id"], documento)
+        fila = acumulados.setdefault(clave, {"_id": clave})
+        for campo, acumulador in grupo.items():
+            if campo == "_id":
+                continue
+            operador, expresion = next(iter(acumulador.items()))
+            valor = _evaluar(expresion, documento)
+            if operador == "$sum":
+                fila[campo] = fila.get(campo, 0) + valor
+            elif operador in ("$min", "$max"):
+                if valor is None:
+                    fila.setdefault(campo, None)
+                    continue
+                actual = fila.get(campo)
+                if actual is None or (valor < actual if operador == "$min" else valor > actual):
+                    fila[campo] = valor
+            else:
+                raise NotImplementedError(f"Acumulador no soportado: {operador}")
+    return list(acumulados.values())
+
+def _bucket(documentos, opciones):
+    limites = opciones["boundaries"]
+    conteos = {}
+    for documento in documentos:
+        valor = _evaluar(opciones["groupBy"], documento)
+        if _es_numero(valor) and limites[0] <= valor < limites[-1]:
+            clave = limites[bisect_right(limites, valor) - 1]
+        else:
+            clave = opciones["default"]
+        conteos[clave] = conteos.get(clave, 0) + 1
+    return [{"_id": clave, "count": cantidad} for clave, cantidad in conteos.items()]
+
+def _etapas(documentos, etapas):
+    for etapa in etapas:
+        operador, opciones = next(iter(etapa.items()))
+        if operador == "$match":
+            documentos = [d for d in documentos if _coincide(d, opciones)]
+        elif operador == "$group":
+            documentos = _agrupar(documentos, opciones)
+        elif operador == "$bucket":
+            documentos = _bucket(documentos, opciones)
+        elif operador == "$count":
+            documentos = [{opciones: len(documentos)}] if documentos else []
+        elif operador == "$facet":
+            documentos = [{nombre: _etapas(documentos, sub) for nombre, sub in opciones.items()}]
+        else:
+            raise NotImplementedError(f"Etapa no soportada: {operador}")
+    return documentos
+
+class CursorMemoria:
+    def __init__(self, documentos):
+        self._documentos = documentos
+
+    def __iter__(self):
+        return iter(self._documentos)
+
+    def close(self):
+        self._documentos = iter(())
+
+class ColeccionMemoria:
+    # find() y aggregate() sobre documentos en memoria. Start_Time se compara como texto,
+    # igual que en MongoDB; los documentos se ordenan por Start_Time para resolver los
+    # rangos con búsqueda binaria.
+
+    def __init__(self, documentos=()):
+        self._documentos = []
+        self._fechas = []
+        self.indices = []
+        self.insertar(documentos)
+
+    def insertar(self, documentos):
+        nuevos = []
+        for documento in documentos:
+            documento = dict(documento)
+            documento.setdefault("_id", _id_secuencial(len(self._documentos) + len(nuevos) + 1))
+            nuevos.append(documento)
+        self._documentos = sorted(chain(self._documentos, nuevos), key=lambda d: d["Start_Time"])
+        self._fechas = [documento["Start_Time"] for documento in self._documentos]
+        return len(nuevos)
+
+    def update_many(self, filtro, actualizacion):
+        # Solo actualizaciones con pipeline de una etapa $set, como asegurar_indices_region
+        (operador, campos), = actualizacion[0].items()
+        if len(actualizacion) != 1 or operador != "$set":
+            raise NotImplementedError("Solo se soporta [{'$set': ...}]")
+        modificados = 0
+        for documento in list(self._filtrar(filtro)):
+            for campo, expresion in campos.items():
+                documento[campo] = _evaluar(expresion, documento)
+            modificados += 1
+        return SimpleNamespace(matched_count=modificados, modified_count=modificados)
+
+    def create_index(self, claves, name=None):
+        nombre = name or "_".join(f"{campo}_{tipo}" for campo, tipo in claves)
+        if nombre not in self.indices:
+            self.indices.append(nombre)
+        return nombre
+
+    def count_documents(self, filtro):
+        return sum(1 for _ in self._filtrar(filtro))
+
+    def _filtrar(self, filtro):
+        filtro = dict(filtro)
+        inicio, fin = 0, len(self._documentos)
+        rango = filtro.pop("Start_Time", None)
+        if isinstance(rango, dict):
+            if "$gte" in rango:
+                inicio = bisect_left(self._fechas, rango["$gte"])
+            if "$gt" in rango:
+                inicio = bisect_right(self._fechas, rango["$gt"])
+            if "$lte" in rango:
+                fin = bisect_right(self._fechas, rango["$lte"])
+            if "$lt" in rango:
+                fin = bisect_left(self._fechas, rango["$lt"])
+        elif rango is not None:
+            filtro["Start_Time"] = rango
+        for documento in self._documentos[inicio:fin]:
+            if _coincide(documento, filtro):
+                yield documento
+
+    def find(self, filtro=None, projection=None, batch_size=None):
+        documentos = self._filtrar(filtro or {})
+        if projection:
+            incluidos = [campo for campo, valor in projection.items() if valor and campo != "_id"]
+            con_id = projection.get("_id", 1)
+            documentos = ({**({"_id": d["_id"]} if con_id else {}), **{c: d[c] for c in incluidos if c in d}}
+                          for d in documentos)
+        return CursorMemoria(documentos)
+
+    def find_one(self, filtro=None, projection=None, sort=None):
+        documentos = list(self.find(filtro, projection))
+        for campo, direccion in reversed(sort or []):
+            documentos.sort(key=lambda d: d[campo], reverse=direccion < 0)
+        return documentos[0] if documentos else None
+
+    def aggregate(self, pipeline):
+        primera = pipeline[0] if pipeline else {}
+        if "$match" in primera:
+            documentos = list(self._filtrar(primera["$match"]))
+            pipeline = pipeline[1:]
+        else:
+            documentos = list(self._documentos)
+        return iter(_etapas(documentos, pipeline))
+
+class Neo4jMemoria:
+    # Misma interfaz de lectura que Neo4jConnector sobre registros :Evento en memoria
+    # (EventId, Lat, Lng, Severity, EventType, StartTime, EndTime). El NodeId de cada evento
+    # es su orden de inserción, como id(e) en Neo4j.
+
+    def __init__(self, eventos=()):
+        self._eventos = []
+        self._inicios = []
+        self._nodos = []
+        self._siguiente_nodo = 0
+        self._accidentes = {}  # ID -> (epoch, pares DURANTE)
+        self.insertar(eventos)
+
+    def insertar(self, eventos):
+        eventos = list(eventos)
+        inicio, validas = fechas_a_epoch(evento["StartTime"] for evento in eventos)
+        filas = [(int(inicio[i]), self._siguiente_nodo + i, eventos[i]) for i in range(len(eventos)) if validas[i]]
+        self._siguiente_nodo += len(eventos)
+        filas = sorted(chain(zip(self._inicios, self._nodos, self._eventos), filas), key=lambda fila: fila[:2])
+        self._inicios = [fila[0] for fila in filas]
+        self._nodos = [fila[1] for fila in filas]
+        self._eventos = [fila[2] for fila in filas]
+        return len(eventos)
+
+    def close(self):
+        pass
+
+    def asegurar_indice_fechas(self, esperar=True):
+        return "ONLINE"
+
+    def estado_indice_fechas(self):
+        return "ONLINE"
+
+    def asegurar_indice_ubicacion(self, esperar=True):
+        return {"eventos_actualizados": 0, "estado": "ONLINE"}
+
+    def estado_indice_ubicacion(self):
+        return "ONLINE"
+
+    def asegurar_esquema_asociaciones(self, esperar=True):
+        pass
+
+    def escribir_asociaciones(self, accidentes):
+        # Mismo efecto que CONSULTA_ESCRIBIR_ASOCIACIONES: reemplaza las relaciones de cada accidente
+        por_id = {str(evento.get("EventId")): evento for evento in self._eventos}
+        nodos = relaciones = 0
+        for acc in accidentes:
+            if acc["id"] not in self._accidentes:
+                nodos += 1
+            epoch = self._accidentes.get(acc["id"], (acc["epoch"], None))[0]
+            pares = [dict(par) for par in acc["pares"] if par["evento"] in por_id]
+            self._accidentes[acc["id"]] = (epoch, pares)
+            relaciones += len(pares)
+        return nodos, relaciones
+
+    def contar_asociaciones(self, fecha_inicio, fecha_fin, agrupar="EventType", tipo_clima=None, severidad=None):
+        (inicio, fin), _ = fechas_a_epoch([fecha_inicio, fecha_fin])
+        por_id = {str(evento.get("EventId")): evento for evento in self._eventos}
+        conteo = {}
+        for epoch, pares in self._accidentes.values():
+            if not inicio <= epoch <= fin:
+                continue
+            for par in pares:
+                evento = por_id[par["evento"]]
+                if par["rango"] != 1 or (tipo_clima is not None and evento.get("EventType") != tipo_clima) \
+                        or (severidad is not None and evento.get("Severity") != severidad):
+                    continue
+                if agrupar == "Mes":
+                    valor = int(np.datetime64(epoch, "s").astype("datetime64[M]").astype(np.int64) % 12 + 1)
+                else:
+                    valor = evento.get(agrupar)
+                conteo[valor] = conteo.get(valor, 0) + 1
+        return conteo
+
+    def _posiciones(self, fecha_inicio, fecha_fin, fin_exclusivo=False):
+        (inicio, fin), _ = fechas_a_epoch([fecha_inicio, fecha_fin])
+        desde = bisect_left(self._inicios, inicio)
+        hasta = bisect_left(self._inicios, fin) if fin_exclusivo else bisect_right(self._inicios, fin)
+        return desde, hasta
+
+    def _rango(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        eventos = self._eventos[desde:hasta]
+        if region is not None:
+            eventos = [evento for evento in eventos if region.contiene(evento["Lat"], evento["Lng"])]
+        return eventos
+
+    def iterar_eventos_por_periodo(self, fecha_inicio, fecha_fin, tamano_lote=NEO4J_FETCH_SIZE, consulta=None,
+                                   fin_exclusivo=False, region=None):
+        eventos = self._rango(fecha_inicio, fecha_fin, fin_exclusivo, region)
+        for inicio in range(0, len(eventos), tamano_lote):
+            yield [dict(evento) for evento in eventos[inicio:inicio + tamano_lote]]
+
+    def iterar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, tamano_lote=NEO4J_FETCH_SIZE,
+                              fin_exclusivo=False):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        desde_nodo = -1 if desde_nodo is None else desde_nodo
+        eventos = [dict(evento, NodeId=nodo) for evento, nodo in zip(self._eventos[desde:hasta], self._nodos[desde:hasta])
+                   if nodo > desde_nodo]
+        for inicio in range(0, len(eventos), tamano_lote):
+            yield eventos[inicio:inicio + tamano_lote]
+
+    def contar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, fin_exclusivo=False):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        desde_nodo = -1 if desde_nodo is None else desde_nodo
+        nodos = [nodo for nodo in self._nodos[desde:hasta] if nodo > desde_nodo]
+        return len(nodos), max(nodos, default=None)
+
+    def obtener_eventos_por_periodo(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        return [dict(evento) for evento in self._rango(fecha_inicio, fecha_fin, fin_exclusivo, region)]
+
+    def obtener_lote_eventos(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        return LoteEventos.desde_documentos(self._rango(fecha_inicio, fecha_fin, fin_exclusivo, region))
+
+    def ejecutar(self, query, parameters=None):
+        raise NotImplementedError("Neo4jMemoria no ejecuta Cypher")
@@ -1,7 +1,173 @@
+from itertools import islice
+import numpy as np
 from pymongo import MongoClient
-from app.config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION_NAME
+from app.config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION_NAME, MONGODB_BATCH_SIZE, BINS_CONDICIONES
+from app.databases.records import LoteAccidentes
+from app.databases.regions import CAMPO_UBICACION, Region
+from app.services.sketches import HistogramaFijo
+from app.utils.instrumentation import span, contar
 
-def conectar_mongodb():
-    client = MongoClient(MONGODB_URI)
+# Campos que necesita cada análisis (proyección)
+CAMPOS_JOIN = ["ID", "Start_Lat", "Start_Lng", "Start_Time"]
+CAMPOS_CONDICIONES = ["Weather_Condition", "Precipitation(in)", "Temperature(F)", "Humidity(%)"]
+
+def conectar_mongodb(**opciones_cliente):
+    # opciones_cliente se pasan a MongoClient (tamaño del pool, listeners, ...)
+    client = MongoClient(MONGODB_URI, **opciones_cliente)
     db = client[MONGODB_DB_NAME]
     return db[MONGODB_COLLECTION_NAME]
+
+def _es_snapshot(coleccion):
+    # Un snapshot local (app/databases/snapshot.py) ocupa el lugar de la colección: cada
+    # consulta de este módulo se le delega y se resuelve sobre sus columnas, sin MongoDB.
+    # Se mira la clase: en una Collection de pymongo cualquier atributo es una subcolección.
+    return getattr(type(coleccion), "es_snapshot", False) is True
+
+def consultar_accidentes_por_lotes(coleccion, fecha_inicio, fecha_fin, campos=None, tamano_lote=MONGODB_BATCH_SIZE,
+                                   desde_id=None, fin_exclusivo=False, hasta_id=None, region=None):
+    # Itera el cursor en lotes de tamaño fijo proyectando solo los campos pedidos,
+    # de modo que la memoria usada no depende del largo del período.
+    # Con desde_id solo se leen documentos insertados después de ese _id (lecturas incrementales)
+    # y con hasta_id solo los insertados hasta ese _id inclusive (los ya procesados).
+    # Con fin_exclusivo se excluye fecha_fin (subrangos contiguos sin solaparse).
+    # Con region (app/databases/regions.py) solo se leen los accidentes de la región.
+    if _es_snapshot(coleccion):
+        yield from coleccion.lotes_documentos(fecha_inicio, fecha_fin, campos, tamano_lote, desde_id, fin_exclusivo,
+                                              hasta_id, region)
+        return
+    proyeccion = {campo: 1 for campo in campos} if campos else None
+    if proyeccion is not None and "_id" not in campos:
+        proyeccion["_id"] = 0
+    filtro = {"Start_Time": {"$gte": fecha_inicio, "$lt" if fin_exclusivo else "$lte": fecha_fin}}
+    if desde_id is not None:
+        filtro.setdefault("_id", {})["$gt"] = desde_id
+    if hasta_id is not None:
+        filtro.setdefault("_id", {})["$lte"] = hasta_id
+    if region is not None:
+        filtro.update(region.filtro_mongodb())
+    cursor = coleccion.find(
+        filtro,
+        projection=proyeccion,
+        batch_size=tamano_lote,
+    )
+    documentos = iter(cursor)
+    try:
+        while True:
+            # Solo se mide la lectura del lote; el consumidor trabaja fuera del span
+            with span("fetch.mongodb"):
+                lote = list(islice(documentos, tamano_lote))
+            if not lote:
+                break
+            contar("mongodb.documentos", len(lote))
+            yield lote
+    finally:
+        cursor.close()
+
+def consultar_accidentes_compactos(coleccion, fecha_inicio, fecha_fin, campos=None, tamano_lote=MONGODB_BATCH_SIZE,
+                                   desde_id=None, fin_exclusivo=False, con_ids=False, hasta_id=None, region=None):
+    # Igual que consultar_accidentes_por_lotes pero cada lote se entrega como LoteAccidentes
+    # (arrays tipados); los documentos del lote se descartan apenas se convierten
+    if _es_snapshot(coleccion):
+        yield from coleccion.lotes_compactos(fecha_inicio, fecha_fin, campos or CAMPOS_JOIN, tamano_lote, desde_id,
+                                             fin_exclusivo, con_ids, hasta_id, region)
+        return
+    for lote in consultar_accidentes_por_lotes(coleccion, fecha_inicio, fecha_fin, campos or CAMPOS_JOIN, tamano_lote,
+                                               desde_id, fin_exclusivo, hasta_id, region):
+        with span("parseo.accidentes"):
+            compacto = LoteAccidentes.desde_documentos(lote, con_ids)
+        yield compacto
+
+CAMPOS_NUMERICOS = ["Precipitation(in)", "Temperature(F)", "Humidity(%)"]
+
+def _filtro_periodo(fecha_inicio, fecha_fin, region=None):
+    filtro = {"Start_Time": {"$gte": fecha_inicio, "$lte": fecha_fin}}
+    if region is not None:
+        filtro.update(region.filtro_mongodb())
+    return {"$match": filtro}
+
+def _limites_bucket(histograma):
+    # Límites de $bucket para los bins fijos del histograma: [-inf, inicio) junta los valores
+    # de abajo y [fin, siguiente float) los iguales a fin, que como en np.histogram van en el
+    # último bin; los de arriba caen en default
+    return [float("-inf")] + histograma.limites.tolist() + [float(np.nextafter(histograma.fin, np.inf))]
+
+def _histograma_desde_buckets(histograma, filas):
+    for fila in filas:
+        if fila["_id"] == "encima":
+            histograma.encima += fila["count"]
+        elif fila["_id"] < histograma.inicio:
+            histograma.debajo += fila["count"]
+        else:
+            indice = min(int(np.searchsorted(histograma.limites, fila["_id"])), histograma.num_bins - 1)
+            histograma.conteos[indice] += fila["count"]
+    return histograma
+
+def agregar_condiciones_ambientales(coleccion, fecha_inicio, fecha_fin, campos, bins=BINS_CONDICIONES, region=None):
+    # Cuenta condiciones dentro de MongoDB con una sola pipeline $facet: $group para los
+    # campos categóricos y $bucket para los numéricos (los de bins). Los numéricos usan los
+    # bins fijos de HistogramaFijo, los mismos que la agregación por lotes y RollupCondiciones,
+    # y se devuelven como su conteo() más "Unknown" (sin valor numérico), listos para
+    # graficar_todas_condiciones_mongodb.
+    if _es_snapshot(coleccion):
+        return coleccion.condiciones_ambientales(fecha_inicio, fecha_fin, campos, bins, region)
+    histogramas = {campo: HistogramaFijo(*bins[campo]) for campo in campos if campo in bins}
+
+    facetas = {"total": [{"$count": "n"}]}
+    for i, campo in enumerate(campos):
+        if campo in histogramas:
+            facetas[f"f{i}"] = [
+                {"$match": {campo: {"$type": "number", "$gte": float("-inf")}}},  # Excluye NaN
+                {"$bucket": {"groupBy": f"${campo}", "boundaries": _limites_bucket(histogramas[campo]),
+                             "default": "encima"}},
+            ]
+        else:
+            facetas[f"f{i}"] = [{"$group": {"_id": {"$ifNull": [f"${campo}", "Unknown"]}, "n": {"$sum": 1}}}]
+
+    with span("fetch.mongodb.facet"):
+        resultado = next(coleccion.aggregate([_filtro_periodo(fecha_inicio, fecha_fin, region), {"$facet": facetas}]))
+    total = resultado["total"][0]["n"] if resultado["total"] else 0
+
+    conteos = []
+    for i, campo in enumerate(campos):
+        filas = resultado.get(f"f{i}", [])
+        if campo in histogramas:
+            conteo = _histograma_desde_buckets(histogramas[campo], filas).conteo()
+            desconocidos = total - sum(conteo.values())
+            if desconocidos:
+                conteo["Unknown"] = desconocidos
+        else:
+            conteo = {fila["_id"]: fila["n"] for fila in filas}
+        conteos.append(conteo)
+    return conteos, total
+
+def caja_accidentes(coleccion, fecha_inicio, fecha_fin, region):
+    # Caja que contiene los accidentes de la región en el período (None si no hay ninguno).
+    # Sirve para pedir a Neo4j los eventos de un estado, que no tienen State.
+    if _es_snapshot(coleccion):
+        return coleccion.caja_accidentes(fecha_inicio, fecha_fin, region)
+    grupo = {"_id": None, "lat_min": {"$min": "$Start_Lat"}, "lat_max": {"$max": "$Start_Lat"},
+             "lng_min": {"$min": "$Start_Lng"}, "lng_max": {"$max": "$Start_Lng"}}
+    with span("fetch.mongodb.caja"):
+        fila = next(coleccion.aggregate([_filtro_periodo(fecha_inicio, fecha_fin, region), {"$group": grupo}]), None)
+    if fila is None or fila["lat_min"] is None:
+        return None
+    return Region.de_caja(fila["lat_min"], fila["lng_min"], fila["lat_max"], fila["lng_max"])
+
+def asegurar_indices_region(coleccion):
+    # Guarda Start_Lat/Start_Lng como punto GeoJSON en Ubicacion (solo en los documentos que
+    # no lo tienen, en el servidor) y crea los índices de las consultas por región:
+    # 2dsphere sobre Ubicacion y State, ambos con Start_Time para el rango de fechas.
+    # Los accidentes insertados después deben traer Ubicacion o se vuelve a llamar a esta función.
+    sin_ubicacion = {
+        CAMPO_UBICACION: {"$exists": False},
+        "Start_Lat": {"$type": "number", "$gte": -90, "$lte": 90},
+        "Start_Lng": {"$type": "number", "$gte": -180, "$lte": 180},
+    }
+    with span("mongodb.indices.ubicacion"):
+        resultado = coleccion.update_many(
+            sin_ubicacion, [{"$set": {CAMPO_UBICACION: {"type": "Point", "coordinates": ["$Start_Lng", "$Start_Lat"]}}}])
+    indices = [
+        coleccion.create_index([(CAMPO_UBICACION, "2dsphere"), ("Start_Time", 1)], name="accidentes_ubicacion_fecha"),
+        coleccion.create_index([("State", 1), ("Start_Time", 1)], name="accidentes_estado_fecha"),
+    ]
+    return {"documentos_actualizados": resultado.modified_count, "indices": indices}
@@ -1,23 +1,262 @@
-from neo4j import GraphDatabase
-from app.config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+import time
+from contextlib import contextmanager
+from itertools import chain, islice
+from app.config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, NEO4J_FETCH_SIZE
+from app.databases.records import LoteEventos
+from app.utils.instrumentation import span, contar
+
+INDICE_FECHAS_EVENTO = "evento_starttime"
+INDICE_UBICACION_EVENTO = "evento_ubicacion"
+
+# Esquema de las asociaciones escritas por escribir_asociaciones: ID único de :Accidente
+# (para el MERGE), EventId de :Evento (para ubicar el extremo) y StartTime de :Accidente
+# (para las agregaciones por período)
+ESQUEMA_ASOCIACIONES = [
+    "CREATE CONSTRAINT accidente_id IF NOT EXISTS FOR (a:Accidente) REQUIRE a.ID IS UNIQUE",
+    "CREATE INDEX evento_eventid IF NOT EXISTS FOR (e:Evento) ON (e.EventId)",
+    "CREATE INDEX accidente_starttime IF NOT EXISTS FOR (a:Accidente) ON (a.StartTime)",
+]
+
+# Agrupaciones de contar_asociaciones: nombre -> expresión Cypher
+AGRUPACIONES_ASOCIACIONES = {
+    "EventType": "e.Type",
+    "Severity": "e.Severity",
+    "Mes": "a.StartTime.month",
+}
 
 class Neo4jConnector:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-    
-    def close(self):
-        self.driver.close()
-    
-    def obtener_eventos_por_periodo(self, fecha_inicio, fecha_fin):
-        query = """
+    # Compara valores datetime nativos para poder usar el índice de rango sobre :Evento(StartTime)
+    CONSULTA_EVENTOS_PERIODO = """
+        MATCH (e:Evento)
+        WHERE e.StartTime >= datetime($fecha_inicio) AND e.StartTime <= datetime($fecha_fin)
+        RETURN e.EventId AS EventId, e.LocationLat AS Lat, e.LocationLng AS Lng,
+               e.Severity AS Severity, e.Type AS EventType, toString(e.StartTime) AS StartTime, toString(e.EndTime) AS EndTime
+        """
+
+    # Consulta original: toString() sobre la propiedad impide usar índices (recorre todos los :Evento)
+    CONSULTA_EVENTOS_PERIODO_TEXTO = """
         MATCH (e:Evento)
         WHERE toString(e.StartTime) >= $fecha_inicio AND toString(e.StartTime) <= $fecha_fin
-        RETURN e.EventId AS EventId, e.LocationLat AS Lat, e.LocationLng AS Lng, 
+        RETURN e.EventId AS EventId, e.LocationLat AS Lat, e.LocationLng AS Lng,
                e.Severity AS Severity, e.Type AS EventType, toString(e.StartTime) AS StartTime, toString(e.EndTime) AS EndTime
         """
-        with self.driver.session() as session:
-            return session.run(query, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin).data()
+
+    # Eventos insertados después de un nodo: id(e) crece con la inserción y sirve de marca de
+    # agua para las sincronizaciones incrementales (los ids de nodos borrados pueden reutilizarse)
+    CONSULTA_EVENTOS_NUEVOS = """
+        MATCH (e:Evento)
+        WHERE e.StartTime >= datetime($fecha_inicio) AND e.StartTime <= datetime($fecha_fin) AND id(e) > $desde_nodo
+        RETURN e.EventId AS EventId, e.LocationLat AS Lat, e.LocationLng AS Lng,
+               e.Severity AS Severity, e.Type AS EventType, toString(e.StartTime) AS StartTime, toString(e.EndTime) AS EndTime,
+               id(e) AS NodeId
+        """
+
+    # Solo cuántos eventos nuevos hay y el id del último, sin traerlos
+    CONSULTA_CONTAR_EVENTOS_NUEVOS = """
+        MATCH (e:Evento)
+        WHERE e.StartTime >= datetime($fecha_inicio) AND e.StartTime <= datetime($fecha_fin) AND id(e) > $desde_nodo
+        RETURN count(e) AS cantidad, max(id(e)) AS ultimo
+        """
+
+    # Copia LocationLat/LocationLng a la propiedad point Ubicacion de los eventos que no la tienen
+    CONSULTA_UBICACION_FALTANTE = """
+        MATCH (e:Evento)
+        WHERE e.Ubicacion IS NULL AND e.LocationLat IS NOT NULL AND e.LocationLng IS NOT NULL
+        WITH e LIMIT $tamano_lote
+        SET e.Ubicacion = point({latitude: e.LocationLat, longitude: e.LocationLng})
+        RETURN count(e) AS actualizados
+        """
+
+    # Un lote de accidentes con sus pares: cada accidente se crea si no existe y sus
+    # relaciones DURANTE anteriores se reemplazan, así reescribir un período no duplica pares
+    CONSULTA_ESCRIBIR_ASOCIACIONES = """
+        UNWIND $accidentes AS acc
+        MERGE (a:Accidente {ID: acc.id})
+        ON CREATE SET a.StartTime = datetime({epochSeconds: acc.epoch})
+        WITH a, acc
+        OPTIONAL MATCH (a)-[viejo:DURANTE]->(:Evento)
+        DELETE viejo
+        WITH DISTINCT a, acc
+        UNWIND acc.pares AS par
+        MATCH (e:Evento {EventId: par.evento})
+        CREATE (a)-[:DURANTE {distance_km: par.distancia_km, offset_s: par.desfase_s, rank: par.rango}]->(e)
+        """
+
+    # Accidentes del período asociados (relación de rango 1: el evento más cercano) por grupo
+    CONSULTA_CONTAR_ASOCIACIONES = """
+        MATCH (a:Accidente)-[r:DURANTE]->(e:Evento)
+        WHERE a.StartTime >= datetime($fecha_inicio) AND a.StartTime <= datetime($fecha_fin) AND r.rank = 1
+          AND ($tipo_clima IS NULL OR e.Type = $tipo_clima) AND ($severidad IS NULL OR e.Severity = $severidad)
+        RETURN {grupo} AS valor, count(*) AS cantidad
+        """
+
+    def __init__(self, gestor=None):
+        # Con un GestorConexiones se comparte su driver y sus sesiones se reparten con el
+        # pool común; sin él se crea un driver propio como antes
+        self.gestor = gestor
+        if gestor is not None:
+            self.driver = gestor.driver_neo4j
+        else:
+            from neo4j import GraphDatabase  # El driver importa pandas: solo se carga al conectar
+            self.driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
     
-    def ejecutar(self, query, parameters):
-        with self.driver.session() as session:
-            return session.run(query, parameters)
+    def close(self):
+        if self.gestor is None:
+            self.driver.close()
+
+    @contextmanager
+    def sesion(self, **configuracion):
+        if self.gestor is not None:
+            with self.gestor.sesion_neo4j(**configuracion) as session:
+                yield session
+        else:
+            with self.driver.session(**configuracion) as session:
+                yield session
+
+    def asegurar_indice_fechas(self, esperar=True):
+        # Crea (si no existe) el índice de rango sobre :Evento(StartTime) y devuelve su estado
+        with self.sesion() as session:
+            session.run(
+                f"CREATE INDEX {INDICE_FECHAS_EVENTO} IF NOT EXISTS FOR (e:Evento) ON (e.StartTime)"
+            ).consume()
+            if esperar:
+                session.run("CALL db.awaitIndexes()").consume()
+        return self.estado_indice_fechas()
+
+    def estado_indice_fechas(self):
+        return self._estado_indice(INDICE_FECHAS_EVENTO)
+
+    def asegurar_indice_ubicacion(self, esperar=True, tamano_lote=NEO4J_FETCH_SIZE * 10):
+        # Completa la propiedad Ubicacion (por lotes, para no armar una sola transacción con
+        # todos los eventos) y crea el índice point que usan las consultas por región
+        actualizados = 0
+        with self.sesion() as session:
+            while True:
+                with span("neo4j.indices.ubicacion"):
+                    lote = session.run(self.CONSULTA_UBICACION_FALTANTE, tamano_lote=tamano_lote).single()["actualizados"]
+                actualizados += lote
+                if lote < tamano_lote:
+                    break
+            session.run(
+                f"CREATE POINT INDEX {INDICE_UBICACION_EVENTO} IF NOT EXISTS FOR (e:Evento) ON (e.Ubicacion)"
+            ).consume()
+            if esperar:
+                session.run("CALL db.awaitIndexes()").consume()
+        return {"eventos_actualizados": actualizados, "estado": self.estado_indice_ubicacion()}
+
+    def estado_indice_ubicacion(self):
+        return self._estado_indice(INDICE_UBICACION_EVENTO)
+
+    def asegurar_esquema_asociaciones(self, esperar=True):
+        with self.sesion() as session:
+            for consulta in ESQUEMA_ASOCIACIONES:
+                session.run(consulta).consume()
+            if esperar:
+                session.run("CALL db.awaitIndexes()").consume()
+
+    def escribir_asociaciones(self, accidentes):
+        # accidentes: [{"id", "epoch", "pares": [{"evento", "distancia_km", "desfase_s", "rango"}]}].
+        # Se escriben en una transacción administrada (el driver la reintenta ante errores
+        # transitorios). Devuelve (nodos creados, relaciones creadas).
+        def escribir(tx):
+            contadores = tx.run(self.CONSULTA_ESCRIBIR_ASOCIACIONES, accidentes=accidentes).consume().counters
+            return contadores.nodes_created, contadores.relationships_created
+
+        with self.sesion() as session, span("neo4j.escritura"):
+            return session.execute_write(escribir)
+
+    def contar_asociaciones(self, fecha_inicio, fecha_fin, agrupar="EventType", tipo_clima=None, severidad=None):
+        # Conteo de accidentes asociados por tipo, severidad o mes del accidente, sobre las
+        # relaciones DURANTE ya escritas (sin volver a calcular el join)
+        consulta = self.CONSULTA_CONTAR_ASOCIACIONES.replace("{grupo}", AGRUPACIONES_ASOCIACIONES[agrupar])
+        with self.sesion() as session, span("neo4j.agregacion"):
+            resultado = session.run(consulta, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, tipo_clima=tipo_clima,
+                                    severidad=severidad)
+            return {registro["valor"]: registro["cantidad"] for registro in resultado}
+
+    def _estado_indice(self, nombre):
+        # None si el índice no existe; si existe, su estado ("ONLINE", "POPULATING", ...)
+        with self.sesion() as session:
+            registro = session.run(
+                "SHOW INDEXES YIELD name, state WHERE name = $nombre RETURN state",
+                nombre=nombre,
+            ).single()
+        return registro["state"] if registro else None
+
+    def iterar_eventos_por_periodo(self, fecha_inicio, fecha_fin, tamano_lote=NEO4J_FETCH_SIZE, consulta=None,
+                                   fin_exclusivo=False, region=None, **parametros):
+        # Entrega los eventos en lotes de tamaño fijo a medida que llegan del servidor;
+        # la sesión se mantiene abierta mientras se consume el generador.
+        # Con fin_exclusivo se excluye fecha_fin (subrangos contiguos sin solaparse).
+        # Con region (caja o círculo) solo se leen los eventos cuya Ubicacion cae en ella.
+        # parametros: parámetros adicionales de la consulta.
+        consulta = consulta or self.CONSULTA_EVENTOS_PERIODO
+        if fin_exclusivo:
+            consulta = consulta.replace("<= datetime($fecha_fin)", "< datetime($fecha_fin)")
+        if region is not None:
+            condicion, parametros_region = region.condicion_neo4j()
+            consulta = consulta.replace("RETURN", f"AND {condicion}\n        RETURN", 1)
+            parametros.update(parametros_region)
+        with self.sesion(fetch_size=tamano_lote) as session:
+            with span("fetch.neo4j.consulta"):
+                resultado = session.run(consulta, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, **parametros)
+                claves = resultado.keys()
+            registros = (dict(zip(claves, registro.values())) for registro in resultado)
+            while True:
+                with span("fetch.neo4j"):
+                    lote = list(islice(registros, tamano_lote))
+                if not lote:
+                    break
+                contar("neo4j.eventos", len(lote))
+                yield lote
+
+    def iterar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, tamano_lote=NEO4J_FETCH_SIZE,
+                              fin_exclusivo=False):
+        # Eventos del período insertados después del nodo desde_nodo, con su NodeId
+        return self.iterar_eventos_por_periodo(fecha_inicio, fecha_fin, tamano_lote, self.CONSULTA_EVENTOS_NUEVOS,
+                                               fin_exclusivo, desde_nodo=-1 if desde_nodo is None else desde_nodo)
+
+    def contar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, fin_exclusivo=False):
+        # (cantidad, id de nodo mayor o None) de los eventos que entregaría iterar_eventos_nuevos
+        consulta = self.CONSULTA_CONTAR_EVENTOS_NUEVOS
+        if fin_exclusivo:
+            consulta = consulta.replace("<= datetime($fecha_fin)", "< datetime($fecha_fin)")
+        with self.sesion() as session, span("fetch.neo4j.consulta"):
+            registro = session.run(consulta, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+                                   desde_nodo=-1 if desde_nodo is None else desde_nodo).single()
+        return registro["cantidad"], registro["ultimo"]
+
+    def obtener_eventos_por_periodo(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        eventos = []
+        for lote in self.iterar_eventos_por_periodo(fecha_inicio, fecha_fin, fin_exclusivo=fin_exclusivo, region=region):
+            eventos.extend(lote)
+        return eventos
+
+    def obtener_lote_eventos(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        # Eventos del período como LoteEventos, construido a medida que llegan los registros
+        lotes = self.iterar_eventos_por_periodo(fecha_inicio, fecha_fin, fin_exclusivo=fin_exclusivo, region=region)
+        # Los spans fetch.neo4j quedan anidados: el tiempo propio es solo el de conversión
+        with span("parseo.eventos"):
+            return LoteEventos.desde_documentos(chain.from_iterable(lotes))
+
+    def medir_consultas_periodo(self, fecha_inicio, fecha_fin):
+        # Tiempos (segundos) de la consulta original por texto vs. la consulta temporal nativa
+        tiempos = {}
+        for nombre, consulta in (("texto", self.CONSULTA_EVENTOS_PERIODO_TEXTO),
+                                 ("datetime", self.CONSULTA_EVENTOS_PERIODO)):
+            inicio = time.perf_counter()
+            total = sum(len(lote) for lote in self.iterar_eventos_por_periodo(fecha_inicio, fecha_fin, consulta=consulta))
+            tiempos[nombre] = {"segundos": time.perf_counter() - inicio, "eventos": total}
+        return tiempos
+    
+    def ejecutar(self, query, parameters=None):
+        # Los registros se leen antes de cerrar la sesión; devolver el Result sin
+        # consumir lo dejaba inutilizable fuera del bloque with
+        with self.sesion() as session:
+            return session.run(query, parameters).data()
+
+    def iterar(self, query, parameters=None, fetch_size=NEO4J_FETCH_SIZE):
+        # Versión en streaming: la sesión sigue abierta mientras se consume el generador
+        with self.sesion(fetch_size=fetch_size) as session:
+            for registro in session.run(query, parameters):
+                yield registro.data()
@@ -0,0 +1,210 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pymongo import monitoring
+from app.config import (
+    NEO4J_URI,
+    NEO4J_USER,
+    NEO4J_PASSWORD,
+    MONGODB_BATCH_SIZE,
+    POOL_TAMANO,
+    POOL_CALENTAR,
+    POOL_TIMEOUT_S,
+)
+from app.databases.mongodb import conectar_mongodb
+
+class MetricasPoolMongo(monitoring.ConnectionPoolListener):
+    # Escucha los eventos del pool de pymongo: conexiones creadas, en uso y espera al pedir una
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.creadas = 0
+        self.cerradas = 0
+        self.en_uso = 0
+        self.max_en_uso = 0
+        self.solicitudes = 0
+        self.espera_total_s = 0.0
+        self.espera_max_s = 0.0
+        self.fallos = 0
+
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        espera = time.perf_counter() - getattr(self._local, "inicio", time.perf_counter())
+        with self._lock:
+            self.solicitudes += 1
+            self.en_uso += 1
+            self.max_en_uso = max(self.max_en_uso, self.en_uso)
+            self.espera_total_s += espera
+            self.espera_max_s = max(self.espera_max_s, espera)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.en_uso -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.fallos += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.creadas += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.cerradas += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "creadas": self.creadas,
+                "abiertas": self.creadas - self.cerradas,
+                "en_uso": self.en_uso,
+                "max_en_uso": self.max_en_uso,
+                "solicitudes": self.solicitudes,
+                "espera_media_ms": 1000 * self.espera_total_s / self.solicitudes if self.solicitudes else 0.0,
+                "espera_max_ms": 1000 * self.espera_max_s,
+                "fallos": self.fallos,
+            }
+
+class MetricasPoolNeo4j:
+    # El driver de Neo4j no expone eventos del pool: las sesiones se reparten con un
+    # semáforo del mismo tamaño que el pool y se mide la espera por un cupo libre.
+
+    def __init__(self, tamano):
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(tamano)
+        self.creadas = 0
+        self.en_uso = 0
+        self.max_en_uso = 0
+        self.espera_total_s = 0.0
+        self.espera_max_s = 0.0
+
+    def adquirir(self, timeout):
+        inicio = time.perf_counter()
+        if not self._semaforo.acquire(timeout=timeout):
+            raise TimeoutError(f"No hay sesiones de Neo4j libres después de {timeout} s")
+        espera = time.perf_counter() - inicio
+        with self._lock:
+            self.creadas += 1
+            self.en_uso += 1
+            self.max_en_uso = max(self.max_en_uso, self.en_uso)
+            self.espera_total_s += espera
+            self.espera_max_s = max(self.espera_max_s, espera)
+
+    def liberar(self):
+        with self._lock:
+            self.en_uso -= 1
+        self._semaforo.release()
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "sesiones_creadas": self.creadas,
+                "en_uso": self.en_uso,
+                "max_en_uso": self.max_en_uso,
+                "espera_media_ms": 1000 * self.espera_total_s / self.creadas if self.creadas else 0.0,
+                "espera_max_ms": 1000 * self.espera_max_s,
+            }
+
+class GestorConexiones:
+    # Conexiones compartidas por toda la aplicación: un MongoClient y un driver de Neo4j
+    # con pools dimensionados para los hilos de lectura, calentados al inicio. Entrega
+    # sesiones y cursores como contextos que siguen válidos mientras se consumen.
+
+    def __init__(self, tamano_pool=POOL_TAMANO, timeout=POOL_TIMEOUT_S):
+        self.tamano_pool = tamano_pool
+        self.timeout = timeout
+        self.metricas_mongodb = MetricasPoolMongo()
+        self.metricas_neo4j = MetricasPoolNeo4j(tamano_pool)
+        self.coleccion_mongodb = conectar_mongodb(
+            maxPoolSize=tamano_pool,
+            waitQueueTimeoutMS=int(timeout * 1000),
+            event_listeners=[self.metricas_mongodb],
+        )
+        from neo4j import GraphDatabase  # El driver importa pandas: solo se carga al conectar
+        self.driver_neo4j = GraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USER, NEO4J_PASSWORD),
+            max_connection_pool_size=tamano_pool,
+            connection_acquisition_timeout=timeout,
+        )
+
+    def close(self):
+        self.driver_neo4j.close()
+        self.coleccion_mongodb.database.client.close()
+
+    @contextmanager
+    def sesion_neo4j(self, **configuracion):
+        self.metricas_neo4j.adquirir(self.timeout)
+        try:
+            with self.driver_neo4j.session(**configuracion) as session:
+                yield session
+        finally:
+            self.metricas_neo4j.liberar()
+
+    @contextmanager
+    def cursor_mongodb(self, filtro, proyeccion=None, tamano_lote=MONGODB_BATCH_SIZE):
+        cursor = self.coleccion_mongodb.find(filtro, projection=proyeccion, batch_size=tamano_lote)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def calentar(self, conexiones=POOL_CALENTAR):
+        # Abre `conexiones` conexiones a cada base a la vez para que las primeras
+        # consultas concurrentes no paguen el costo de conectarse. Cada hilo retiene su
+        # conexión hasta que todos tienen la suya; si no, el pool reutilizaría una sola.
+        conexiones = min(conexiones, self.tamano_pool)
+        if conexiones < 1:
+            return self.metricas()
+        self.driver_neo4j.verify_connectivity()
+        barrera_mongodb = threading.Barrier(conexiones)
+        barrera_neo4j = threading.Barrier(conexiones)
+
+        def ping_mongodb():
+            with self.cursor_mongodb({}, {"_id": 1}, tamano_lote=1) as cursor:
+                next(cursor, None)
+                barrera_mongodb.wait(timeout=self.timeout)
+
+        def ping_neo4j():
+            with self.sesion_neo4j() as session:
+                with session.begin_transaction() as tx:
+                    tx.run("RETURN 1").consume()
+                    barrera_neo4j.wait(timeout=self.timeout)
+
+        with ThreadPoolExecutor(max_workers=conexiones) as pool:
+            futuros = [pool.submit(ping_mongodb) for _ in range(conexiones)]
+            futuros += [pool.submit(ping_neo4j) for _ in range(conexiones)]
+            for futuro in futuros:
+                futuro.result()
+        return self.metricas()
+
+    def metricas(self):
+        return {"mongodb": self.metricas_mongodb.resumen(), "neo4j": self.metricas_neo4j.resumen()}
+
+    def resumen(self):
+        mongo = self.metricas_mongodb.resumen()
+        neo4j = self.metricas_neo4j.resumen()
+        return (f"Pool MongoDB: {mongo['creadas']} creadas, {mongo['en_uso']} en uso (máx {mongo['max_en_uso']}), "
+                f"espera media {mongo['espera_media_ms']:.1f} ms | "
+                f"Pool Neo4j: {neo4j['sesiones_creadas']} sesiones, {neo4j['en_uso']} en uso (máx {neo4j['max_en_uso']}), "
+                f"espera media {neo4j['espera_media_ms']:.1f} ms")
@@ -0,0 +1,215 @@
+import numpy as np
+from app.utils.instrumentation import span, contar
+
+def fechas_a_epoch(fechas):
+    # Convierte fechas ISO 8601 (str o datetime) a segundos epoch int64 en UTC.
+    # Las fechas sin zona horaria se asumen UTC; las inválidas se marcan en la máscara.
+    # pandas se importa en el primer parseo, no al importar el módulo.
+    import pandas as pd
+    fechas = list(fechas)
+    with span("parseo.fechas"):
+        serie = pd.to_datetime(pd.Series(fechas, dtype=object), utc=True, format="ISO8601", errors="coerce")
+        segundos = ((serie - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+    contar("fechas.parseadas", len(fechas))
+    validas = ~np.isnan(segundos)
+    epoch = np.zeros(len(segundos), dtype=np.int64)
+    epoch[validas] = np.floor(segundos[validas]).astype(np.int64)
+    return epoch, validas
+
+def _codificar(valores):
+    # Columna categórica como (códigos int16, categorías ordenadas)
+    categorias, codigos = np.unique(np.array([str(valor) for valor in valores], dtype=str), return_inverse=True)
+    return codigos.astype(np.int16), categorias
+
+def _recodificar(partes):
+    # Une columnas (códigos, categorías) de varios lotes en un diccionario común
+    categorias = np.unique(np.concatenate([cats for _, cats in partes])) if partes else np.empty(0, dtype=str)
+    codigos = [np.searchsorted(categorias, cats)[cods].astype(np.int16) for cods, cats in partes]
+    return np.concatenate(codigos) if codigos else np.empty(0, dtype=np.int16), categorias
+
+def _a_texto(epoch):
+    return np.datetime_as_string(epoch.astype("datetime64[s]"), unit="s").tolist()
+
+class LoteAccidentes:
+    # Accidentes de un lote con solo lo que usa el join: coordenadas en radianes (float64),
+    # Start_Time en segundos epoch (int64) y, si se pidió State, el estado codificado como
+    # índice en un diccionario de categorías. Ocupa ~26 bytes por accidente frente a los
+    # cientos de un documento de MongoDB. Los accidentes con fecha inválida se descartan.
+    # Con con_ids se guarda también el ID de cada accidente (para exportar pares).
+    __slots__ = ("coords", "epoch", "estado", "estados", "max_id", "ids")
+
+    def __init__(self, coords, epoch, estado=None, estados=None, max_id=None, ids=None):
+        self.coords = coords
+        self.epoch = epoch
+        self.estado = estado
+        self.estados = estados
+        self.max_id = max_id
+        self.ids = ids
+
+    @classmethod
+    def desde_documentos(cls, documentos, con_ids=False):
+        # Recorre los documentos una sola vez (sirve un cursor o un lote) sin guardarlos
+        lat, lng, fechas, estados, ids = [], [], [], [], []
+        max_id = None
+        con_estado = None
+        for documento in documentos:
+            if con_estado is None:
+                con_estado = "State" in documento
+            lat.append(documento["Start_Lat"])
+            lng.append(documento["Start_Lng"])
+            fechas.append(documento["Start_Time"])
+            ids.append(documento.get("ID"))
+            if con_estado:
+                estados.append(documento.get("State", "Unknown"))
+            _id = documento.get("_id")
+            if _id is not None and (max_id is None or _id > max_id):
+                max_id = _id
+        epoch, validas = fechas_a_epoch(fechas)
+        for idx in np.flatnonzero(~validas):
+            print(f"Formato de fecha inválido en accidente ID {ids[idx] or 'Unknown'}.")
+        coords = np.radians(np.column_stack([np.array(lat, dtype=np.float64), np.array(lng, dtype=np.float64)]))
+        estado = categorias = None
+        if con_estado:
+            estado, categorias = _codificar(estados)
+            estado = estado[validas]
+        ids = np.array([str(i) for i in ids], dtype=str)[validas] if con_ids else None
+        return cls(coords[validas], epoch[validas], estado, categorias, max_id, ids)
+
+    @classmethod
+    def desde_columnas(cls, columnas):
+        return cls(columnas["coords"], columnas["epoch"], columnas.get("estado"), columnas.get("estados"),
+                   ids=columnas.get("ids"))
+
+    @classmethod
+    def concatenar(cls, lotes):
+        lotes = [lote for lote in lotes if len(lote)]
+        if not lotes:
+            return cls(np.empty((0, 2), dtype=np.float64), np.empty(0, dtype=np.int64))
+        estado = categorias = None
+        if all(lote.estado is not None for lote in lotes):
+            estado, categorias = _recodificar([(lote.estado, lote.estados) for lote in lotes])
+        max_ids = [lote.max_id for lote in lotes if lote.max_id is not None]
+        ids = None
+        if all(lote.ids is not None for lote in lotes):
+            ids = np.concatenate([lote.ids for lote in lotes])
+        return cls(np.concatenate([lote.coords for lote in lotes]), np.concatenate([lote.epoch for lote in lotes]),
+                   estado, categorias, max(max_ids) if max_ids else None, ids)
+
+    def columnas(self):
+        columnas = {"coords": self.coords, "epoch": self.epoch}
+        if self.estado is not None:
+            columnas["estado"] = self.estado
+            columnas["estados"] = self.estados
+        if self.ids is not None:
+            columnas["ids"] = self.ids
+        return columnas
+
+    def __len__(self):
+        return len(self.epoch)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.columnas().values())
+
+    def meses(self):
+        # Mes (1-12, UTC) de cada accidente
+        return (self.epoch.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) % 12 + 1).astype(np.int8)
+
+    def estados_texto(self, indices=None):
+        codigos = self.estado if indices is None else self.estado[indices]
+        return self.estados[codigos]
+
+    def registros(self):
+        # Documentos equivalentes, para el join por fuerza bruta
+        grados = np.degrees(self.coords).tolist()
+        registros = [{"Start_Lat": lat, "Start_Lng": lng, "Start_Time": fecha}
+                     for (lat, lng), fecha in zip(grados, _a_texto(self.epoch))]
+        if self.estado is not None:
+            for registro, estado in zip(registros, self.estados_texto().tolist()):
+                registro["State"] = estado
+        return registros
+
+class LoteEventos:
+    # Eventos climáticos con coordenadas en radianes, inicio/fin en segundos epoch y
+    # EventType/Severity codificados con diccionario. Los eventos con fechas inválidas
+    # se descartan al construir el lote.
+    __slots__ = ("ids", "coords", "inicio", "fin", "tipo", "tipos", "severidad", "severidades")
+
+    def __init__(self, ids, coords, inicio, fin, tipo, tipos, severidad, severidades):
+        self.ids = ids
+        self.coords = coords
+        self.inicio = inicio
+        self.fin = fin
+        self.tipo = tipo
+        self.tipos = tipos
+        self.severidad = severidad
+        self.severidades = severidades
+
+    @classmethod
+    def desde_documentos(cls, eventos):
+        ids, lat, lng, inicios, fines, tipos, severidades = [], [], [], [], [], [], []
+        for evento in eventos:
+            ids.append(str(evento.get("EventId")))
+            lat.append(evento["Lat"])
+            lng.append(evento["Lng"])
+            inicios.append(evento["StartTime"])
+            fines.append(evento["EndTime"])
+            tipos.append(evento.get("EventType"))
+            severidades.append(evento.get("Severity"))
+        inicio, inicio_valido = fechas_a_epoch(inicios)
+        fin, fin_valido = fechas_a_epoch(fines)
+        validas = inicio_valido & fin_valido
+        for idx in np.flatnonzero(~validas):
+            print(f"Formato de fecha inválido en evento: {inicios[idx]}")
+        coords = np.radians(np.column_stack([np.array(lat, dtype=np.float64), np.array(lng, dtype=np.float64)]))
+        tipo, categorias_tipo = _codificar(tipos)
+        severidad, categorias_severidad = _codificar(severidades)
+        return cls(np.array(ids, dtype=str)[validas], coords[validas], inicio[validas], fin[validas],
+                   tipo[validas], categorias_tipo, severidad[validas], categorias_severidad)
+
+    @classmethod
+    def desde_columnas(cls, columnas):
+        return cls(*(columnas[campo] for campo in cls.__slots__))
+
+    @classmethod
+    def concatenar(cls, lotes):
+        lotes = list(lotes)
+        if not lotes:
+            return cls.desde_documentos([])
+        tipo, tipos = _recodificar([(lote.tipo, lote.tipos) for lote in lotes])
+        severidad, severidades = _recodificar([(lote.severidad, lote.severidades) for lote in lotes])
+        return cls(np.concatenate([lote.ids for lote in lotes]), np.concatenate([lote.coords for lote in lotes]),
+                   np.concatenate([lote.inicio for lote in lotes]), np.concatenate([lote.fin for lote in lotes]),
+                   tipo, tipos, severidad, severidades)
+
+    def columnas(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def __len__(self):
+        return len(self.inicio)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.columnas().values())
+
+    def columna(self, categoria):
+        # Valores de EventType o Severity de cada evento
+        if categoria == "EventType":
+            return self.tipos[self.tipo]
+        if categoria == "Severity":
+            return self.severidades[self.severidad]
+        raise ValueError(f"Categoría desconocida: {categoria}")
+
+    def contar(self, categoria):
+        codigos, categorias = (self.tipo, self.tipos) if categoria == "EventType" else (self.severidad, self.severidades)
+        cantidades = np.bincount(codigos, minlength=len(categorias))
+        return {valor: int(cantidad) for valor, cantidad in zip(categorias.tolist(), cantidades) if cantidad}
+
+    def registros(self):
+        # Documentos equivalentes, para el join por fuerza bruta
+        grados = np.degrees(self.coords).tolist()
+        return [{"EventId": evento_id, "Lat": lat, "Lng": lng, "StartTime": inicio + "Z", "EndTime": fin + "Z",
+                 "EventType": tipo, "Severity": severidad}
+                for evento_id, (lat, lng), inicio, fin, tipo, severidad in zip(
+                    self.ids.tolist(), grados, _a_texto(self.inicio), _a_texto(self.fin),
+                    self.columna("EventType").tolist(), self.columna("Severity").tolist())]
@@ -0,0 +1,146 @@
+import math
+import numpy as np
+from app.services.data_processing import RADIO_TIERRA_KM, haversine_km
+
+# Propiedad/campo con la ubicación como punto: GeoJSON en MongoDB (índice 2dsphere) y
+# point() WGS-84 en Neo4j (índice point)
+CAMPO_UBICACION = "Ubicacion"
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+
+class Region:
+    # Región de un análisis: caja de latitud/longitud, estado (State de US-Accidents) o
+    # círculo (centro y radio en km). Se traduce al filtro de MongoDB y a la condición
+    # Cypher que se agregan a las consultas por período, para que cada base devuelva solo
+    # las filas de la región usando sus índices espaciales.
+
+    def __init__(self, tipo, caja=None, estado=None, centro=None, radio_km=None):
+        self.tipo = tipo
+        self.caja = caja          # (lat_min, lng_min, lat_max, lng_max)
+        self.estado = estado
+        self.centro = centro      # (lat, lng)
+        self.radio_km = radio_km
+
+    @classmethod
+    def de_caja(cls, lat_min, lng_min, lat_max, lng_max):
+        if not (-90 <= lat_min <= lat_max <= 90 and -180 <= lng_min <= lng_max <= 180):
+            raise ValueError("La caja debe ser lat_min,lng_min,lat_max,lng_max con mínimos <= máximos")
+        return cls("caja", caja=(float(lat_min), float(lng_min), float(lat_max), float(lng_max)))
+
+    @classmethod
+    def de_estado(cls, estado):
+        if not estado:
+            raise ValueError("Falta el código de estado (e.g., CA)")
+        return cls("estado", estado=estado.upper())
+
+    @classmethod
+    def de_circulo(cls, lat, lng, radio_km):
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radio_km <= 0:
+            raise ValueError("El círculo debe ser lat,lng dentro de rango y radio_km > 0")
+        return cls("circulo", centro=(float(lat), float(lng)), radio_km=float(radio_km))
+
+    @classmethod
+    def desde_texto(cls, texto):
+        # "caja:lat_min,lng_min,lat_max,lng_max", "estado:CA" o "circulo:lat,lng,radio_km"
+        tipo, _, valores = texto.partition(":")
+        if tipo == "estado":
+            return cls.de_estado(valores)
+        try:
+            numeros = [float(valor) for valor in valores.split(",")]
+        except ValueError:
+            raise ValueError(f"Región inválida: {texto}")
+        if tipo == "caja" and len(numeros) == 4:
+            return cls.de_caja(*numeros)
+        if tipo == "circulo" and len(numeros) == 3:
+            return cls.de_circulo(*numeros)
+        raise ValueError(f"Región inválida: {texto} (caja:lat_min,lng_min,lat_max,lng_max, estado:CA o "
+                         "circulo:lat,lng,radio_km)")
+
+    def clave(self):
+        # Texto estable que identifica la región (claves de caché, nombres de archivo)
+        if self.tipo == "estado":
+            return f"estado:{self.estado}"
+        numeros = self.caja if self.tipo == "caja" else self.centro + (self.radio_km,)
+        return f"{self.tipo}:" + ",".join(f"{numero:g}" for numero in numeros)
+
+    def __repr__(self):
+        return f"Region({self.clave()})"
+
+    def ampliada(self, km):
+        # Región que además cubre todo punto a menos de km de esta (la de los eventos que
+        # pueden asociarse con accidentes de adentro). Un estado no tiene forma propia:
+        # se amplía la caja de sus accidentes (ver caja_accidentes en mongodb.py).
+        if self.tipo == "circulo":
+            return Region.de_circulo(*self.centro, self.radio_km + km)
+        if self.tipo != "caja":
+            raise ValueError("Solo se amplían cajas y círculos")
+        lat_min, lng_min, lat_max, lng_max = self.caja
+        delta_lat = km / KM_POR_GRADO
+        lat_min, lat_max = max(lat_min - delta_lat, -90.0), min(lat_max + delta_lat, 90.0)
+        # La longitud se amplía según el paralelo más cercano al polo, donde un grado es más corto
+        coseno = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+        if coseno * KM_POR_GRADO * 360 <= 2 * km:
+            return Region.de_caja(lat_min, -180.0, lat_max, 180.0)
+        delta_lng = km / (KM_POR_GRADO * coseno)
+        return Region.de_caja(lat_min, max(lng_min - delta_lng, -180.0), lat_max, min(lng_max + delta_lng, 180.0))
+
+    def filtro_mongodb(self):
+        # Condiciones sobre los accidentes para agregar al filtro por Start_Time
+        if self.tipo == "estado":
+            return {"State": self.estado}
+        if self.tipo == "circulo":
+            lat, lng = self.centro
+            return {CAMPO_UBICACION: {"$geoWithin": {"$centerSphere": [[lng, lat], self.radio_km / RADIO_TIERRA_KM]}}}
+        # Los bordes de un polígono GeoJSON son geodésicas, no paralelos: el polígono se arma
+        # un poco más grande que la caja (con vértices cada grado) para que el índice
+        # preseleccione y el rango exacto de Start_Lat/Start_Lng recorte
+        lat_min, lng_min, lat_max, lng_max = self.caja
+        sur, norte = max(lat_min - 0.01, -90.0), min(lat_max + 0.01, 90.0)
+        oeste, este = max(lng_min - 0.01, -180.0), min(lng_max + 0.01, 180.0)
+        pasos = max(int(math.ceil(este - oeste)), 1)
+        longitudes = [oeste + (este - oeste) * i / pasos for i in range(pasos + 1)]
+        anillo = [[lng, sur] for lng in longitudes] + [[lng, norte] for lng in reversed(longitudes)]
+        anillo.append(anillo[0])
+        return {
+            CAMPO_UBICACION: {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [anillo]}}},
+            "Start_Lat": {"$gte": lat_min, "$lte": lat_max},
+            "Start_Lng": {"$gte": lng_min, "$lte": lng_max},
+        }
+
+    def condicion_neo4j(self):
+        # (condición Cypher sobre e.Ubicacion, parámetros) para el índice point de :Evento
+        if self.tipo == "caja":
+            lat_min, lng_min, lat_max, lng_max = self.caja
+            return ("point.withinBBox(e.Ubicacion, point({latitude: $region_lat_min, longitude: $region_lng_min}), "
+                    "point({latitude: $region_lat_max, longitude: $region_lng_max}))",
+                    {"region_lat_min": lat_min, "region_lng_min": lng_min,
+                     "region_lat_max": lat_max, "region_lng_max": lng_max})
+        if self.tipo == "circulo":
+            lat, lng = self.centro
+            return ("point.distance(e.Ubicacion, point({latitude: $region_lat, longitude: $region_lng})) "
+                    "<= $region_radio_m",
+                    {"region_lat": lat, "region_lng": lng, "region_radio_m": self.radio_km * 1000})
+        raise ValueError("Los eventos no tienen estado: usar la caja de los accidentes del estado")
+
+    def contiene(self, lat, lng):
+        # Misma condición evaluada en Python (bases en memoria)
+        if self.tipo == "caja":
+            lat_min, lng_min, lat_max, lng_max = self.caja
+            return lat_min <= lat <= lat_max and lng_min <= lng <= lng_max
+        if self.tipo == "circulo":
+            lat0, lng0 = (math.radians(valor) for valor in self.centro)
+            lat1, lng1 = math.radians(lat), math.radians(lng)
+            a = math.sin((lat1 - lat0) / 2) ** 2 + math.cos(lat0) * math.cos(lat1) * math.sin((lng1 - lng0) / 2) ** 2
+            return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(min(a, 1.0))) <= self.radio_km
+        raise ValueError("Los eventos no tienen estado: usar la caja de los accidentes del estado")
+
+    def contiene_coords(self, coords):
+        # Misma condición vectorizada sobre coordenadas (n, 2) en radianes (snapshots locales)
+        if self.tipo == "caja":
+            lat_min, lng_min, lat_max, lng_max = self.caja
+            grados = np.degrees(coords)
+            return ((grados[:, 0] >= lat_min) & (grados[:, 0] <= lat_max)
+                    & (grados[:, 1] >= lng_min) & (grados[:, 1] <= lng_max))
+        if self.tipo == "circulo":
+            lat0, lng0 = np.radians(self.centro)
+            return haversine_km(coords[:, 0], coords[:, 1], lat0, lng0) <= self.radio_km
+        raise ValueError("Los eventos no tienen estado: usar la caja de los accidentes del estado")
@@ -0,0 +1,399 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+import numpy as np
+from bson import ObjectId
+from app.config import SNAPSHOT_DIR, SNAPSHOT_FILAS_POR_BLOQUE, MONGODB_BATCH_SIZE, NEO4J_FETCH_SIZE, BINS_CONDICIONES
+from app.databases.mongodb import CAMPOS_JOIN, CAMPOS_NUMERICOS, consultar_accidentes_por_lotes
+from app.databases.records import LoteAccidentes, LoteEventos, fechas_a_epoch, _codificar, _a_texto
+from app.databases.regions import Region
+from app.services.sketches import HistogramaFijo
+from app.utils.instrumentation import span, contar
+
+# Snapshot local de la colección Accidents y de los nodos :Evento: una carpeta por tabla con
+# un .npy por columna, todas ordenadas por fecha (Start_Time / StartTime en segundos epoch),
+# y un manifest.json con el período, las filas y las categorías de las columnas codificadas.
+# Las columnas se abren con mmap: un período es una búsqueda binaria sobre la fecha y sus
+# filas son vistas de los archivos, sin copiar ni leer lo que no se usa.
+
+VERSION = 1
+MANIFIESTO = "manifest.json"
+PERIODO_COMPLETO = ("1900-01-01T00:00:00Z", "2099-12-31T23:59:59Z")
+
+CATEGORICOS = ["State", "Weather_Condition"]
+CAMPOS_SNAPSHOT = ["_id"] + CAMPOS_JOIN + CATEGORICOS + CAMPOS_NUMERICOS
+
+# Campo -> archivo .npy de cada tabla
+ARCHIVOS_ACCIDENTES = {"epoch": "epoch", "coords": "coords", "_id": "oid", "ID": "ids", "State": "estado",
+                       "Weather_Condition": "clima", "Precipitation(in)": "precipitacion",
+                       "Temperature(F)": "temperatura", "Humidity(%)": "humedad"}
+ARCHIVOS_EVENTOS = {"inicio": "inicio", "fin": "fin", "coords": "coords", "ids": "ids", "tipo": "tipo",
+                    "severidad": "severidad"}
+
+def _epoch(fecha):
+    # Fecha ISO 8601 (con o sin hora, con Z o sin zona) a segundos epoch, sin cargar pandas
+    return int(np.datetime64(fecha.rstrip("Z"), "s").astype(np.int64))
+
+def _numero(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    return np.nan
+
+def _objectid(binario):
+    # numpy quita los bytes nulos del final de cada valor S12
+    return ObjectId(binario.ljust(12, b"\0"))
+
+def _columnas_accidentes(documentos):
+    # Columnas de un lote de documentos de MongoDB; los accidentes con fecha inválida se descartan
+    epoch, validas = fechas_a_epoch(documento.get("Start_Time") for documento in documentos)
+    for idx in np.flatnonzero(~validas):
+        print(f"Formato de fecha inválido en accidente ID {documentos[idx].get('ID', 'Unknown')}.")
+    lat = np.array([documento.get("Start_Lat") for documento in documentos], dtype=np.float64)
+    lng = np.array([documento.get("Start_Lng") for documento in documentos], dtype=np.float64)
+    columnas = {
+        "epoch": epoch,
+        "coords": np.radians(np.column_stack([lat, lng])),
+        "_id": np.array([documento["_id"].binary for documento in documentos], dtype="S12"),
+        "ID": np.array([str(documento.get("ID")) for documento in documentos], dtype=str),
+    }
+    for campo in CAMPOS_NUMERICOS:
+        columnas[campo] = np.array([_numero(documento.get(campo)) for documento in documentos], dtype=np.float64)
+    columnas = {campo: valores[validas] for campo, valores in columnas.items()}
+    # Como $ifNull en la agregación: ausente o null cuenta como "Unknown"
+    categoricas = {}
+    for campo in CATEGORICOS:
+        codigos, categorias = _codificar(documento.get(campo) if documento.get(campo) is not None else "Unknown"
+                                         for documento in documentos)
+        categoricas[campo] = (codigos[validas], categorias)
+    return columnas, categoricas
+
+def _columnas_eventos(registros):
+    lote = LoteEventos.desde_documentos(registros)
+    columnas = {"inicio": lote.inicio, "fin": lote.fin, "coords": lote.coords, "ids": lote.ids}
+    return columnas, {"tipo": (lote.tipo, lote.tipos), "severidad": (lote.severidad, lote.severidades)}
+
+class _TablaTemporal:
+    # Columnas de una tabla escritas lote a lote en archivos temporales, así la memoria no
+    # depende del total de filas. Al cerrar se ordenan por la columna clave y cada una queda
+    # en su .npy; las categóricas se recodifican contra un diccionario común ordenado.
+
+    def __init__(self, directorio, archivos):
+        self.directorio = directorio
+        self.archivos = archivos
+        self.partes = {campo: [] for campo in archivos}
+        self.categorias = {}  # campo -> {valor: código provisorio}
+        self.lotes = 0
+        os.makedirs(os.path.join(directorio, "partes"), exist_ok=True)
+
+    def agregar(self, columnas, categoricas):
+        columnas = dict(columnas)
+        for campo, (codigos, valores) in categoricas.items():
+            diccionario = self.categorias.setdefault(campo, {})
+            mapa = np.array([diccionario.setdefault(valor, len(diccionario)) for valor in valores.tolist()],
+                            dtype=np.int32)
+            columnas[campo] = mapa[codigos] if len(codigos) else np.empty(0, dtype=np.int32)
+        for campo, valores in columnas.items():
+            ruta = os.path.join(self.directorio, "partes", f"{self.archivos[campo]}_{self.lotes}.npy")
+            np.save(ruta, valores)
+            self.partes[campo].append(ruta)
+        self.lotes += 1
+
+    def cerrar(self, clave):
+        with span("snapshot.ordenar"):
+            orden = np.argsort(np.concatenate([np.load(ruta) for ruta in self.partes[clave]]), kind="stable")
+        filas = len(orden)
+        categorias = {}
+        for campo, archivo in self.archivos.items():
+            partes = [np.load(ruta, mmap_mode="r") for ruta in self.partes[campo]]
+            recodificar = None
+            if campo in self.categorias:
+                valores = sorted(self.categorias[campo])
+                recodificar = np.empty(len(valores), dtype=np.int16)
+                for codigo, valor in enumerate(valores):
+                    recodificar[self.categorias[campo][valor]] = codigo
+                categorias[campo] = valores
+            tipo = np.int16 if recodificar is not None else np.result_type(*partes)
+            forma = (filas,) + partes[0].shape[1:]
+            ruta = os.path.join(self.directorio, archivo + ".npy")
+            if not filas:
+                np.save(ruta, np.empty(forma, dtype=tipo))
+                continue
+            # Primero las partes una tras otra (orden de lectura) y después en el orden de la clave
+            crudo = np.lib.format.open_memmap(os.path.join(self.directorio, "partes", archivo + ".npy"), "w+",
+                                              tipo if recodificar is None else np.int32, forma)
+            posicion = 0
+            for parte in partes:
+                crudo[posicion:posicion + len(parte)] = parte
+                posicion += len(parte)
+            destino = np.lib.format.open_memmap(ruta, "w+", tipo, forma)
+            with span("snapshot.escribir"):
+                for inicio in range(0, filas, SNAPSHOT_FILAS_POR_BLOQUE):
+                    bloque = crudo[orden[inicio:inicio + SNAPSHOT_FILAS_POR_BLOQUE]]
+                    destino[inicio:inicio + len(bloque)] = bloque if recodificar is None else recodificar[bloque]
+            destino.flush()
+            del crudo, destino, partes
+        shutil.rmtree(os.path.join(self.directorio, "partes"))
+        return {"filas": filas, "columnas": {campo: archivo + ".npy" for campo, archivo in self.archivos.items()},
+                "categorias": categorias}
+
+def crear_snapshot(coleccion, neo4j, directorio=SNAPSHOT_DIR, fecha_inicio=PERIODO_COMPLETO[0],
+                   fecha_fin=PERIODO_COMPLETO[1]):
+    # Vuelca los accidentes y eventos del período (todos por defecto) en directorio. Se escribe
+    # en una carpeta temporal que reemplaza a la anterior al terminar: un snapshot a medio
+    # escribir nunca queda en directorio.
+    if os.path.isdir(directorio) and os.listdir(directorio) and not os.path.exists(os.path.join(directorio, MANIFIESTO)):
+        raise ValueError(f"{directorio} no está vacío y no es un snapshot")
+    inicio = time.perf_counter()
+    temporal = directorio.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+
+    accidentes = _TablaTemporal(os.path.join(temporal, "accidentes"), ARCHIVOS_ACCIDENTES)
+    for lote in consultar_accidentes_por_lotes(coleccion, fecha_inicio, fecha_fin, CAMPOS_SNAPSHOT):
+        with span("snapshot.accidentes"):
+            accidentes.agregar(*_columnas_accidentes(lote))
+    if not accidentes.lotes:
+        accidentes.agregar(*_columnas_accidentes([]))
+
+    eventos = _TablaTemporal(os.path.join(temporal, "eventos"), ARCHIVOS_EVENTOS)
+    for lote in neo4j.iterar_eventos_por_periodo(fecha_inicio, fecha_fin):
+        with span("snapshot.eventos"):
+            eventos.agregar(*_columnas_eventos(lote))
+    if not eventos.lotes:
+        eventos.agregar(*_columnas_eventos([]))
+
+    manifiesto = {
+        "version": VERSION,
+        "creado": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "periodo": [fecha_inicio, fecha_fin],
+        "accidentes": accidentes.cerrar("epoch"),
+        "eventos": eventos.cerrar("inicio"),
+    }
+    with open(os.path.join(temporal, MANIFIESTO), "w", encoding="utf-8") as archivo:
+        json.dump(manifiesto, archivo, indent=2, ensure_ascii=False)
+    shutil.rmtree(directorio, ignore_errors=True)
+    os.replace(temporal, directorio)
+    manifiesto["segundos"] = time.perf_counter() - inicio
+    manifiesto["bytes"] = sum(os.path.getsize(os.path.join(raiz, nombre))
+                              for raiz, _, nombres in os.walk(directorio) for nombre in nombres)
+    return manifiesto
+
+def abrir_snapshot(directorio=SNAPSHOT_DIR):
+    # (accidentes, eventos) del snapshot, para usar en lugar de conectar_mongodb() y Neo4jConnector()
+    ruta = os.path.join(directorio, MANIFIESTO)
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No hay un snapshot en {directorio} (crearlo con python app/cli.py snapshot)")
+    with open(ruta, encoding="utf-8") as archivo:
+        manifiesto = json.load(archivo)
+    if manifiesto.get("version") != VERSION:
+        raise ValueError(f"Versión de snapshot no soportada: {manifiesto.get('version')}")
+    return SnapshotAccidentes(directorio, manifiesto), SnapshotEventos(directorio, manifiesto)
+
+class _TablaSnapshot:
+    # Columnas de una tabla del snapshot abiertas con mmap (solo lectura) y ordenadas por clave
+
+    def __init__(self, directorio, manifiesto, tabla, clave):
+        datos = manifiesto[tabla]
+        self.directorio = directorio
+        self.periodo = tuple(manifiesto["periodo"])
+        self.filas = datos["filas"]
+        # Un archivo sin filas no se puede mapear
+        self.columnas = {campo: np.load(os.path.join(directorio, tabla, archivo),
+                                        mmap_mode="r" if self.filas else None)
+                         for campo, archivo in datos["columnas"].items()}
+        self.categorias = {campo: np.array(valores, dtype=str) for campo, valores in datos["categorias"].items()}
+        self.clave = self.columnas[clave]
+
+    def close(self):
+        pass
+
+    def _posiciones(self, fecha_inicio, fecha_fin, fin_exclusivo=False):
+        # Filas [desde, hasta) del período: dos búsquedas binarias sobre la columna ordenada
+        inicio, fin = _epoch(fecha_inicio), _epoch(fecha_fin)
+        if inicio < _epoch(self.periodo[0]) or fin > _epoch(self.periodo[1]):
+            raise ValueError(f"El snapshot cubre de {self.periodo[0]} a {self.periodo[1]}; "
+                             f"se pidió de {fecha_inicio} a {fecha_fin}")
+        desde = int(np.searchsorted(self.clave, inicio, "left"))
+        hasta = int(np.searchsorted(self.clave, fin, "left" if fin_exclusivo else "right"))
+        return desde, hasta
+
+    def _filas(self, desde, hasta, mascara=None):
+        # Rebanada (vista del archivo) si no hay filtro; si no, índices de las filas que lo cumplen
+        return slice(desde, hasta) if mascara is None else np.flatnonzero(mascara) + desde
+
+    def _columna(self, campo, filas):
+        # np.asarray deja la vista como ndarray común sin copiarla
+        if campo not in self.columnas:
+            raise ValueError(f"El snapshot no tiene el campo {campo}")
+        return np.asarray(self.columnas[campo][filas])
+
+class SnapshotAccidentes(_TablaSnapshot):
+    # Reemplaza a la colección de MongoDB: las funciones de mongodb.py le delegan sus consultas
+    # (ver es_snapshot), que se resuelven sobre las columnas sin armar documentos salvo que se pidan
+    es_snapshot = True
+
+    def __init__(self, directorio, manifiesto):
+        super().__init__(directorio, manifiesto, "accidentes", "epoch")
+
+    def _mascara(self, desde, hasta, desde_id=None, hasta_id=None, region=None):
+        # Filas de [desde, hasta) que cumplen los filtros por _id y región (None: todas)
+        mascara = None
+        filtros = []
+        if desde_id is not None:
+            filtros.append(lambda: self.columnas["_id"][desde:hasta] > desde_id.binary)
+        if hasta_id is not None:
+            filtros.append(lambda: self.columnas["_id"][desde:hasta] <= hasta_id.binary)
+        if region is not None:
+            filtros.append(lambda: self._en_region(slice(desde, hasta), region))
+        for filtro in filtros:
+            mascara = filtro() if mascara is None else mascara & filtro()
+        return mascara
+
+    def _en_region(self, filas, region):
+        if region.tipo == "estado":
+            estados = self.categorias["State"]
+            codigo = int(np.searchsorted(estados, region.estado))
+            if codigo == len(estados) or estados[codigo] != region.estado:
+                return np.zeros(len(self._columna("epoch", filas)), dtype=bool)
+            return self._columna("State", filas) == codigo
+        return region.contiene_coords(self._columna("coords", filas))
+
+    def _tramos(self, fecha_inicio, fecha_fin, tamano_lote, desde_id=None, fin_exclusivo=False, hasta_id=None,
+                region=None):
+        # Filas del período en lotes de tamano_lote (antes de filtrar), omitiendo los que quedan vacíos
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        for inicio in range(desde, hasta, tamano_lote):
+            fin = min(inicio + tamano_lote, hasta)
+            mascara = self._mascara(inicio, fin, desde_id, hasta_id, region)
+            if mascara is not None and not mascara.any():
+                continue
+            yield self._filas(inicio, fin, mascara)
+
+    def lotes_compactos(self, fecha_inicio, fecha_fin, campos, tamano_lote=MONGODB_BATCH_SIZE, desde_id=None,
+                        fin_exclusivo=False, con_ids=False, hasta_id=None, region=None):
+        # Como consultar_accidentes_compactos; sin filtros por _id ni región los arrays son vistas
+        for filas in self._tramos(fecha_inicio, fecha_fin, tamano_lote, desde_id, fin_exclusivo, hasta_id, region):
+            with span("fetch.snapshot"):
+                lote = LoteAccidentes(self._columna("coords", filas), self._columna("epoch", filas))
+                if "State" in campos:
+                    lote.estado, lote.estados = self._columna("State", filas), self.categorias["State"]
+                if "_id" in campos:
+                    lote.max_id = _objectid(max(self._columna("_id", filas).tolist()))
+                if con_ids:
+                    lote.ids = self._columna("ID", filas)
+            contar("snapshot.accidentes", len(lote))
+            yield lote
+
+    def _valores(self, campo, filas):
+        if campo == "_id":
+            return [_objectid(binario) for binario in self._columna("_id", filas).tolist()]
+        if campo in ("Start_Lat", "Start_Lng"):
+            return np.degrees(self._columna("coords", filas)[:, int(campo == "Start_Lng")]).tolist()
+        if campo == "Start_Time":
+            return _a_texto(self._columna("epoch", filas))
+        if campo in self.categorias:
+            return self.categorias[campo][self._columna(campo, filas)].tolist()
+        valores = self._columna(campo, filas)
+        if campo in CAMPOS_NUMERICOS:
+            return [None if valor != valor else valor for valor in valores.tolist()]
+        return valores.tolist()
+
+    def lotes_documentos(self, fecha_inicio, fecha_fin, campos=None, tamano_lote=MONGODB_BATCH_SIZE, desde_id=None,
+                         fin_exclusivo=False, hasta_id=None, region=None):
+        # Como consultar_accidentes_por_lotes: documentos con los campos pedidos (los valores
+        # ausentes no se incluyen, como en MongoDB)
+        campos = campos or CAMPOS_SNAPSHOT
+        for filas in self._tramos(fecha_inicio, fecha_fin, tamano_lote, desde_id, fin_exclusivo, hasta_id, region):
+            with span("fetch.snapshot"):
+                columnas = [self._valores(campo, filas) for campo in campos]
+                lote = [{campo: valor for campo, valor in zip(campos, fila) if valor is not None}
+                        for fila in zip(*columnas)]
+            contar("snapshot.accidentes", len(lote))
+            yield lote
+
+    def _filas_periodo(self, fecha_inicio, fecha_fin, region=None):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin)
+        return self._filas(desde, hasta, self._mascara(desde, hasta, region=region))
+
+    def condiciones_ambientales(self, fecha_inicio, fecha_fin, campos, bins=BINS_CONDICIONES, region=None):
+        # Mismo resultado que agregar_condiciones_ambientales: bincount sobre los códigos de
+        # los campos categóricos y los mismos bins fijos (HistogramaFijo) para los numéricos
+        with span("agregacion.snapshot"):
+            filas = self._filas_periodo(fecha_inicio, fecha_fin, region)
+            total = len(self._columna("epoch", filas))
+            conteos = []
+            for campo in campos:
+                valores = self._columna(campo, filas)
+                if campo in bins:
+                    conteo = HistogramaFijo(*bins[campo]).actualizar(valores).conteo()
+                    desconocidos = total - sum(conteo.values())
+                    if desconocidos:
+                        conteo["Unknown"] = desconocidos
+                else:
+                    cantidades = np.bincount(valores, minlength=len(self.categorias[campo]))
+                    conteo = {valor: int(cantidad) for valor, cantidad in zip(self.categorias[campo].tolist(), cantidades)
+                              if cantidad}
+                conteos.append(conteo)
+        contar("snapshot.accidentes", total)
+        return conteos, total
+
+    def caja_accidentes(self, fecha_inicio, fecha_fin, region):
+        coords = self._columna("coords", self._filas_periodo(fecha_inicio, fecha_fin, region))
+        if not len(coords):
+            return None
+        grados = np.degrees(coords)
+        lat_min, lng_min = np.clip(grados.min(axis=0), [-90, -180], [90, 180]).tolist()
+        lat_max, lng_max = np.clip(grados.max(axis=0), [-90, -180], [90, 180]).tolist()
+        return Region.de_caja(lat_min, lng_min, lat_max, lng_max)
+
+class SnapshotEventos(_TablaSnapshot):
+    # Reemplaza a Neo4jConnector en las lecturas de eventos por período
+
+    def __init__(self, directorio, manifiesto):
+        super().__init__(directorio, manifiesto, "eventos", "inicio")
+
+    def obtener_lote_eventos(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        with span("fetch.snapshot"):
+            mascara = None if region is None else region.contiene_coords(self._columna("coords", slice(desde, hasta)))
+            lote = self._lote(self._filas(desde, hasta, mascara))
+        contar("snapshot.eventos", len(lote))
+        return lote
+
+    def _lote(self, filas):
+        return LoteEventos(self._columna("ids", filas), self._columna("coords", filas),
+                           self._columna("inicio", filas), self._columna("fin", filas),
+                           self._columna("tipo", filas), self.categorias["tipo"],
+                           self._columna("severidad", filas), self.categorias["severidad"])
+
+    def iterar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, tamano_lote=NEO4J_FETCH_SIZE,
+                              fin_exclusivo=False):
+        # Como Neo4jConnector.iterar_eventos_nuevos, con la fila como NodeId. El snapshot no
+        # cambia: después de la primera lectura de un período no hay eventos nuevos.
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        if desde_nodo is not None:
+            desde = max(desde, desde_nodo + 1)
+        for inicio in range(desde, hasta, tamano_lote):
+            registros = self._lote(slice(inicio, min(inicio + tamano_lote, hasta))).registros()
+            yield [dict(registro, NodeId=inicio + i) for i, registro in enumerate(registros)]
+
+    def contar_eventos_nuevos(self, fecha_inicio, fecha_fin, desde_nodo=None, fin_exclusivo=False):
+        desde, hasta = self._posiciones(fecha_inicio, fecha_fin, fin_exclusivo)
+        if desde_nodo is not None:
+            desde = max(desde, desde_nodo + 1)
+        return (hasta - desde, hasta - 1) if hasta > desde else (0, None)
+
+    def iterar_eventos_por_periodo(self, fecha_inicio, fecha_fin, tamano_lote=NEO4J_FETCH_SIZE, consulta=None,
+                                   fin_exclusivo=False, region=None):
+        lote = self.obtener_lote_eventos(fecha_inicio, fecha_fin, fin_exclusivo, region)
+        for inicio in range(0, len(lote), tamano_lote):
+            parte = slice(inicio, inicio + tamano_lote)
+            yield LoteEventos(*(columna[parte] if campo in ARCHIVOS_EVENTOS else columna
+                                for campo, columna in lote.columnas().items())).registros()
+
+    def obtener_eventos_por_periodo(self, fecha_inicio, fecha_fin, fin_exclusivo=False, region=None):
+        eventos = []
+        for lote in self.iterar_eventos_por_periodo(fecha_inicio, fecha_fin, fin_exclusivo=fin_exclusivo, region=region):
+            eventos.extend(lote)
+        return eventos
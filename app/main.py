@@ -1,23 +1,198 @@
 import sys
 import os
-import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.databases.mongodb import conectar_mongodb
+from app.databases.mongodb import (
+    consultar_accidentes_por_lotes,
+    consultar_accidentes_compactos,
+    agregar_condiciones_ambientales,
+    caja_accidentes,
+    CAMPOS_JOIN,
+    CAMPOS_CONDICIONES
+)
 from app.databases.neo4j import Neo4jConnector
+from app.databases.pool import GestorConexiones
+from app.databases.fetching import LectorConcurrente, periodo_siguiente
+from app.databases.records import LoteAccidentes, LoteEventos
+from app.config import (
+    MODO_JOIN,
+    AGREGACION_EN_SERVIDOR,
+    CACHE_HABILITADA,
+    MONGODB_BATCH_SIZE,
+    DISTANCIA_MAXIMA_KM,
+    JOIN_WORKERS,
+    LECTURA_CONCURRENTE,
+    PRECARGAR_PERIODO_SIGUIENTE,
+    CUBO_POR_ESTADO,
+    EXPORT_FORMATO,
+    BINS_CONDICIONES
+)
 from app.services.data_processing import (
-    filtrar_accidentes_por_clima_optimizado,
-    filtrar_por_tipo_clima,
-    filtrar_por_severidad_clima,
-    contar_accidentes_por_categoria,
+    calcular_join_periodo,
     contar_condiciones_ambientales_mongodb
 )
-from app.services.plotting import (
-    graficar_combinado,
-    graficar_todas_condiciones_mongodb,
-    graficar_accidentes_mensuales,
-    graficar_neo4j
-)
+from app.services.cache import CacheResultados, CacheJoins
+from app.services.rollups import RollupMensual
+from app.services.sync import leer_eventos_nuevos
+from app.services.sketches import EstadisticasCampo, columna_numerica
+from app.utils.instrumentation import accion, span
+
+# matplotlib (app.services.plotting), scikit-learn y pyarrow se importan en las funciones
+# que los usan: calcular datos o exportar no carga el código de los gráficos
+
+# Campos de los accidentes para el join; con State el cubo de conteos se desglosa por estado
+CAMPOS_JOIN_PERIODO = CAMPOS_JOIN + ["State"] if CUBO_POR_ESTADO else CAMPOS_JOIN
+
+# Definir todas las condiciones a analizar
+CONDICIONES_MONGODB = {
+    "Weather_Condition": {
+        "titulo": "Number of Accidents by Weather Condition",
+        "etiqueta_x": "Weather Condition",
+        "etiqueta_y": "Number of Accidents"
+    },
+    "Precipitation(in)": {
+        "titulo": "Number of Accidents by Precipitation",
+        "etiqueta_x": "Precipitation (in)",
+        "etiqueta_y": "Number of Accidents"
+    },
+    "Temperature(F)": {
+        "titulo": "Number of Accidents by Temperature",
+        "etiqueta_x": "Temperature (F)",
+        "etiqueta_y": "Number of Accidents"
+    },
+    "Humidity(%)": {
+        "titulo": "Number of Accidents by Humidity",
+        "etiqueta_x": "Humidity (%)",
+        "etiqueta_y": "Number of Accidents"
+    }
+}
+
+def _consulta_region(consulta, region):
+    # Las consultas por región se guardan en la caché aparte de las nacionales
+    return consulta if region is None else f"{consulta}@{region.clave()}"
+
+def region_eventos(coleccion_mongodb, fecha_inicio, fecha_fin, region, margen_km=0):
+    # Región de los eventos: la de los accidentes ampliada en margen_km, porque un evento de
+    # afuera puede ser el más cercano a un accidente de adentro. Un estado se reemplaza por la
+    # caja de sus accidentes del período; None si el estado no tiene accidentes.
+    if region.tipo == "estado":
+        region = caja_accidentes(coleccion_mongodb, fecha_inicio, fecha_fin, region)
+        if region is None:
+            return None
+    return region.ampliada(margen_km) if margen_km else region
+
+def obtener_eventos(neo4j, fecha_inicio, fecha_fin, cache=None, region=None):
+    # Eventos del período como LoteEventos (neo4j puede ser el conector o el lector concurrente).
+    # region ya debe ser una caja o un círculo (ver region_eventos).
+    leer = lambda: neo4j.obtener_lote_eventos(fecha_inicio, fecha_fin, region=region)
+    if cache is None:
+        return leer()
+    columnas = cache.obtener_columnas_o_calcular("neo4j", _consulta_region("lote_eventos", region), fecha_inicio,
+                                                 fecha_fin, lambda: leer().columnas())
+    return LoteEventos.desde_columnas(columnas)
+
+def obtener_eventos_region(neo4j, coleccion_mongodb, fecha_inicio, fecha_fin, region, margen_km=0, cache=None):
+    if region is None:
+        return obtener_eventos(neo4j, fecha_inicio, fecha_fin, cache)
+    with span("fetch.region_eventos"):
+        region = region_eventos(coleccion_mongodb, fecha_inicio, fecha_fin, region, margen_km)
+    if region is None:
+        return LoteEventos.desde_documentos([])
+    return obtener_eventos(neo4j, fecha_inicio, fecha_fin, cache, region)
+
+def obtener_lotes_accidentes(coleccion_mongodb, fecha_inicio, fecha_fin, campos, cache=None, lector=None, region=None):
+    if lector is not None:
+        generar_lotes = lambda: lector.consultar_accidentes_por_lotes(fecha_inicio, fecha_fin, campos, region=region)
+    else:
+        generar_lotes = lambda: consultar_accidentes_por_lotes(coleccion_mongodb, fecha_inicio, fecha_fin, campos,
+                                                               region=region)
+    if cache is None:
+        return generar_lotes()
+    consulta = _consulta_region("accidentes:" + ",".join(campos), region)
+    if lector is not None and not cache.contiene("mongodb", consulta, fecha_inicio, fecha_fin):
+        # Empezar a leer ya, para que MongoDB y Neo4j se lean a la vez
+        lotes = generar_lotes()
+        generar_lotes = lambda: lotes
+    return cache.obtener_lotes_o_calcular("mongodb", consulta, fecha_inicio, fecha_fin, generar_lotes, MONGODB_BATCH_SIZE)
+
+def obtener_lotes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, campos, cache=None, lector=None, region=None):
+    # Accidentes del período como LoteAccidentes, para el join
+    if lector is not None:
+        generar_lotes = lambda: lector.consultar_accidentes_por_lotes(fecha_inicio, fecha_fin, campos, compacto=True,
+                                                                      region=region)
+    else:
+        generar_lotes = lambda: consultar_accidentes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, campos,
+                                                               region=region)
+    if cache is None:
+        return generar_lotes()
+    consulta = _consulta_region("lote_accidentes:" + ",".join(campos), region)
+    if lector is not None and not cache.contiene("mongodb", consulta, fecha_inicio, fecha_fin):
+        # Empezar a leer ya, para que MongoDB y Neo4j se lean a la vez
+        lotes = generar_lotes()
+        generar_lotes = lambda: lotes
+    return cache.obtener_lotes_compactos_o_calcular("mongodb", consulta, fecha_inicio, fecha_fin, generar_lotes,
+                                                    LoteAccidentes)
+
+def precargar_periodo_siguiente(lector, fecha_inicio, fecha_fin, cache=None):
+    # Leer en segundo plano el período adyacente mientras se muestra el gráfico
+    if lector is None or not PRECARGAR_PERIODO_SIGUIENTE:
+        return
+    inicio, fin = periodo_siguiente(fecha_inicio, fecha_fin)
+    if cache is not None and cache.contiene("mongodb", "lote_accidentes:" + ",".join(CAMPOS_JOIN_PERIODO), inicio, fin):
+        return
+    lector.precargar(inicio, fin, CAMPOS_JOIN_PERIODO, compacto=True)
+
+def obtener_conteos_condiciones(coleccion_mongodb, fecha_inicio, fecha_fin, campos, cache=None, region=None):
+    if cache is None:
+        return agregar_condiciones_ambientales(coleccion_mongodb, fecha_inicio, fecha_fin, campos, region=region)
+
+    # Los conteos se guardan como filas (Campo, Valor, Inicio, Fin, Cantidad)
+    def calcular():
+        conteos, total = agregar_condiciones_ambientales(coleccion_mongodb, fecha_inicio, fecha_fin, campos,
+                                                         region=region)
+        filas = [{"Campo": "__total__", "Cantidad": total}]
+        for campo, conteo in zip(campos, conteos):
+            for clave, cantidad in conteo.items():
+                if isinstance(clave, tuple):
+                    filas.append({"Campo": campo, "Inicio": clave[0], "Fin": clave[1], "Cantidad": cantidad})
+                else:
+                    filas.append({"Campo": campo, "Valor": clave, "Cantidad": cantidad})
+        return filas
+
+    # Los bins forman parte de la consulta: si cambia BINS_CONDICIONES no se reutilizan conteos viejos
+    consulta = f"condiciones:{','.join(campos)}:{sorted(BINS_CONDICIONES.items())}"
+    filas = cache.obtener_o_calcular("mongodb", _consulta_region(consulta, region), fecha_inicio, fecha_fin, calcular)
+    conteos = {campo: {} for campo in campos}
+    total = 0
+    for fila in filas:
+        if fila["Campo"] == "__total__":
+            total = fila["Cantidad"]
+        elif "Inicio" in fila:
+            conteos[fila["Campo"]][(fila["Inicio"], fila["Fin"])] = fila["Cantidad"]
+        else:
+            conteos[fila["Campo"]][fila["Valor"]] = fila["Cantidad"]
+    return [conteos[campo] for campo in campos], total
+
+def obtener_join(coleccion_mongodb, neo4j, fecha_inicio, fecha_fin, cache=None, cache_joins=None, lector=None,
+                 region=None):
+    # Con region solo se leen los accidentes de la región y los eventos a menos de
+    # DISTANCIA_MAXIMA_KM de ella, los únicos que pueden asociarse con esos accidentes
+    def calcular():
+        # Los accidentes se piden primero: con lector concurrente se leen mientras se consulta Neo4j
+        lotes = obtener_lotes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, CAMPOS_JOIN_PERIODO, cache, lector,
+                                        region)
+        eventos = obtener_eventos_region(lector or neo4j, coleccion_mongodb, fecha_inicio, fecha_fin, region,
+                                         DISTANCIA_MAXIMA_KM, cache)
+        return calcular_join_periodo(lotes, eventos, DISTANCIA_MAXIMA_KM, MODO_JOIN, JOIN_WORKERS)
+    if cache_joins is None:
+        return calcular()
+    return cache_joins.obtener_o_calcular(fecha_inicio, fecha_fin, DISTANCIA_MAXIMA_KM,
+                                          _consulta_region(MODO_JOIN, region), calcular)
+
+def _periodo_texto(fecha_inicio, fecha_fin, region=None):
+    # Período sin hora, con la región si la hay
+    periodo = f"{fecha_inicio.split('T')[0]} to {fecha_fin.split('T')[0]}"
+    return periodo if region is None else f"{periodo} ({region.clave()})"
 
 def mostrar_menu():
     print("\n===== Menú de Análisis de Accidentes =====")
@@ -29,13 +204,16 @@ def mostrar_menu():
     print("6. Visualizar datos de MongoDB")
     print("7. Visualizar datos de Neo4j")
     print("8. Salir")
+    print("9. Estadísticas / limpiar caché de resultados")
+    print("10. Exportar pares accidente-evento del período (Parquet/Arrow)")
+    print("11. Guardar pares accidente-evento del período en Neo4j")
     print("==========================================")
 
 def seleccionar_opcion():
     while True:
         mostrar_menu()
         opcion = input("Selecciona una opción: ")
-        if opcion in ['1', '2', '3', '4', '5', '6', '7', '8']:
+        if opcion in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11']:
             return opcion
         else:
             print("Opción inválida. Intenta nuevamente.")
@@ -112,6 +290,7 @@ def obtener_fecha_manual(anio, fecha_inicio=False):
                 fecha = f"{anio}-{int(mes):02d}-{int(dia):02d}T00:00:00Z"
             elif hora == "":
                 fecha = f"{anio}-{int(mes):02d}-{int(dia):02d}T23:59:59Z"
+            import pandas as pd
             pd.to_datetime(fecha)
             return fecha
         except:
@@ -127,80 +306,87 @@ def opcion_filtrar_severidad_clima():
     print(f"Filtrando por severidad del clima: {severidad}")
     return severidad
 
-def opcion_visualizar_graficos(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j):
+def datos_graficos_combinados(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j, cache=None,
+                              cache_joins=None, lector=None, region=None):
+    # Argumentos de graficar_combinado para el período y los filtros
+    # Relacionar accidentes de MongoDB con eventos climáticos de Neo4j (reutiliza el join del período)
+    join = obtener_join(coleccion_mongodb, neo4j, fecha_inicio, fecha_fin, cache, cache_joins, lector, region)
+    print(f"Se encontraron {join.total_accidentes} accidentes y {join.total_eventos} eventos climáticos")
+
+    # Conteos con los filtros seleccionados como cortes del cubo tipo x severidad x mes del join
+    with span("agregacion.conteos"):
+        cubo = join.cubo()
+        conteo_tipo = cubo.contar("EventType", tipo_clima, severidad)
+        conteo_severidad = cubo.contar("Severity", tipo_clima, severidad)
+        total_resultados = cubo.total(tipo_clima, severidad)
+
+    periodo = _periodo_texto(fecha_inicio, fecha_fin, region)
+    return {"count_type": conteo_tipo, "count_severity": conteo_severidad, "period": periodo,
+            "total_accidents": total_resultados}
+
+def datos_combinados_grafo(fecha_inicio, fecha_fin, tipo_clima, severidad, neo4j):
+    # Igual que datos_graficos_combinados pero contando en Neo4j las relaciones DURANTE ya
+    # escritas (opción 11), sin leer MongoDB ni recalcular el join
+    conteo_tipo = neo4j.contar_asociaciones(fecha_inicio, fecha_fin, "EventType", tipo_clima, severidad)
+    conteo_severidad = neo4j.contar_asociaciones(fecha_inicio, fecha_fin, "Severity", tipo_clima, severidad)
+    total_resultados = sum(conteo_tipo.values())
+    print(f"Se encontraron {total_resultados} accidentes asociados en Neo4j")
+    return {"count_type": conteo_tipo, "count_severity": conteo_severidad,
+            "period": _periodo_texto(fecha_inicio, fecha_fin), "total_accidents": total_resultados}
+
+def opcion_visualizar_graficos(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j, cache=None,
+                               cache_joins=None, lector=None):
     if not fecha_inicio or not fecha_fin:
         print("Por favor, selecciona primero un período de análisis (Opción 1).")
         return
     print("\nBuscando datos para el período seleccionado...")
-
-    # Extraer eventos climáticos de Neo4j
-    eventos = neo4j.obtener_eventos_por_periodo(fecha_inicio, fecha_fin)
-
-    # Extraer accidentes de MongoDB
-    accidentes = list(coleccion_mongodb.find({
-        "Start_Time": {"$gte": fecha_inicio, "$lte": fecha_fin}
-    }))
-
-    print(f"Se encontraron {len(accidentes)} accidentes y {len(eventos)} eventos climáticos")
-
-    # Relacionar accidentes con eventos climáticos
-    resultados = filtrar_accidentes_por_clima_optimizado(accidentes, eventos)
-
-    # Aplicar filtros adicionales si se han seleccionado
-    if tipo_clima:
-        resultados = filtrar_por_tipo_clima(resultados, tipo_clima)
-
-    if severidad:
-        resultados = filtrar_por_severidad_clima(resultados, severidad)
-
-    # Obtener los conteos
-    conteo_tipo = contar_accidentes_por_categoria(resultados, "EventType")
-    conteo_severidad = contar_accidentes_por_categoria(resultados, "Severity")
-
-    # Formatear período sin hora
-    periodo = f"{fecha_inicio.split('T')[0]} to {fecha_fin.split('T')[0]}"
+    datos = datos_graficos_combinados(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j, cache,
+                                      cache_joins, lector)
+    precargar_periodo_siguiente(lector, fecha_inicio, fecha_fin, cache)
 
     # Llamar a la función de graficación en plotting.py con exportación
-    graficar_combinado(conteo_tipo, conteo_severidad, period=periodo, total_accidents=len(resultados), export=True)
-
-def opcion_visualizar_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb):
-    if not fecha_inicio or not fecha_fin:
-        print("Por favor, selecciona primero un período de análisis (Opción 1).")
-        return
-    print("\nBuscando datos para el período seleccionado...")
-
-    # Extraer accidentes de MongoDB
-    accidentes = list(coleccion_mongodb.find({
-        "Start_Time": {"$gte": fecha_inicio, "$lte": fecha_fin}
-    }))
-
-    print(f"Se encontraron {len(accidentes)} accidentes en MongoDB")
-
-    # Definir todas las condiciones a analizar
-    condiciones = {
-        "Weather_Condition": {
-            "titulo": "Number of Accidents by Weather Condition",
-            "etiqueta_x": "Weather Condition",
-            "etiqueta_y": "Number of Accidents"
-        },
-        "Precipitation(in)": {
-            "titulo": "Number of Accidents by Precipitation",
-            "etiqueta_x": "Precipitation (in)",
-            "etiqueta_y": "Number of Accidents"
-        },
-        "Temperature(F)": {
-            "titulo": "Number of Accidents by Temperature",
-            "etiqueta_x": "Temperature (F)",
-            "etiqueta_y": "Number of Accidents"
-        },
-        "Humidity(%)": {
-            "titulo": "Number of Accidents by Humidity",
-            "etiqueta_x": "Humidity (%)",
-            "etiqueta_y": "Number of Accidents"
-        }
-    }
-
-    # Contar accidentes por cada condición
+    from app.services.plotting import graficar_combinado
+    graficar_combinado(**datos, export=True)
+
+def datos_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb, cache=None, lector=None, region=None):
+    # Argumentos de graficar_todas_condiciones_mongodb para el período
+    condiciones = CONDICIONES_MONGODB
+    if AGREGACION_EN_SERVIDOR:
+        # Contar cada condición dentro de MongoDB; solo viajan los conteos finales
+        lista_conteos, total_accidentes = obtener_conteos_condiciones(
+            coleccion_mongodb, fecha_inicio, fecha_fin, list(condiciones), cache, region)
+        conteos_por_campo = dict(zip(condiciones, lista_conteos))
+    else:
+        # Extraer accidentes de MongoDB por lotes y contar cada condición; los campos numéricos
+        # se acumulan lote a lote en histogramas de bins fijos (BINS_CONDICIONES)
+        conteos_por_campo = {campo: {} for campo in condiciones if campo not in BINS_CONDICIONES}
+        estadisticas = {campo: EstadisticasCampo(*BINS_CONDICIONES[campo]) for campo in condiciones
+                        if campo in BINS_CONDICIONES}
+        total_accidentes = 0
+        for lote in obtener_lotes_accidentes(coleccion_mongodb, fecha_inicio, fecha_fin, CAMPOS_CONDICIONES, cache,
+                                            lector, region):
+            total_accidentes += len(lote)
+            with span("agregacion.condiciones"):
+                for campo, conteo in conteos_por_campo.items():
+                    contar_condiciones_ambientales_mongodb(lote, campo, conteo)
+                for campo, estadisticas_campo in estadisticas.items():
+                    estadisticas_campo.actualizar(columna_numerica(lote, campo))
+        conteos_por_campo.update({campo: _conteo_numerico(estadisticas_campo, total_accidentes)
+                                  for campo, estadisticas_campo in estadisticas.items()})
+
+    print(f"Se encontraron {total_accidentes} accidentes en MongoDB")
+    return _datos_condiciones(conteos_por_campo, total_accidentes, _periodo_texto(fecha_inicio, fecha_fin, region))
+
+def _conteo_numerico(estadisticas_campo, total_accidentes):
+    # Bins fijos más "Unknown" (accidentes sin valor numérico), igual que agregar_condiciones_ambientales
+    conteo = estadisticas_campo.conteo()
+    desconocidos = total_accidentes - sum(conteo.values())
+    if desconocidos:
+        conteo["Unknown"] = desconocidos
+    return conteo
+
+def _datos_condiciones(conteos_por_campo, total_accidentes, periodo, cuantiles=None):
+    condiciones = CONDICIONES_MONGODB
     conteos = []
     titulos = []
     etiquetas_x = []
@@ -208,19 +394,132 @@ def opcion_visualizar_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb):
     campos = []
 
     for campo, info in condiciones.items():
-        conteo = contar_condiciones_ambientales_mongodb(accidentes, campo)
-        conteos.append(conteo)
+        conteos.append(conteos_por_campo[campo])
         titulos.append(info["titulo"])
         etiquetas_x.append(info["etiqueta_x"])
         etiquetas_y.append(info["etiqueta_y"])
         campos.append(campo)
 
-    periodo = f"{fecha_inicio.split('T')[0]} to {fecha_fin.split('T')[0]}"
+    datos = {"counts": conteos, "titles": titulos, "x_labels": etiquetas_x, "y_labels": etiquetas_y, "fields": campos,
+             "period": periodo, "total_accidents": total_accidentes}
+    if cuantiles is not None:
+        datos["quantiles"] = cuantiles
+    return datos
+
+def datos_condiciones_anuales(anios, coleccion_mongodb, rollup_condiciones):
+    # Argumentos de graficar_todas_condiciones_mongodb para uno o varios años completos, desde
+    # los resúmenes mensuales materializados: solo se leen los accidentes nuevos de cada año
+    # y la distribución de varios años se arma fusionando los meses guardados
+    anios = sorted({str(anio) for anio in anios})
+    for anio in anios:
+        marca = rollup_condiciones.marca_de_agua(anio)
+        lotes_nuevos = consultar_accidentes_por_lotes(coleccion_mongodb, f"{anio}-01-01T00:00:00Z",
+                                                      f"{anio}-12-31T23:59:59Z", ["_id", "Start_Time"] + CAMPOS_CONDICIONES,
+                                                      desde_id=marca)
+        with span("rollup.condiciones"):
+            nuevos = rollup_condiciones.actualizar(anio, lotes_nuevos)
+        if nuevos:
+            print(f"Se procesaron {nuevos} accidentes nuevos en {anio}")
+    with span("agregacion.rollup"):
+        total, conteos_por_campo, estadisticas = rollup_condiciones.combinar(anios)
+    conteos_por_campo.update({campo: _conteo_numerico(estadisticas_campo, total)
+                              for campo, estadisticas_campo in estadisticas.items()})
+    for campo in CONDICIONES_MONGODB:
+        conteos_por_campo.setdefault(campo, {})
+    cuantiles = {campo: estadisticas_campo.cuantiles() for campo, estadisticas_campo in estadisticas.items()}
+    print(f"Se encontraron {total} accidentes en {', '.join(anios)}")
+    periodo = anios[0] if len(anios) == 1 else f"{anios[0]}-{anios[-1]}"
+    return _datos_condiciones(conteos_por_campo, total, periodo, cuantiles)
+
+def opcion_visualizar_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb, cache=None, lector=None):
+    if not fecha_inicio or not fecha_fin:
+        print("Por favor, selecciona primero un período de análisis (Opción 1).")
+        return
+    print("\nBuscando datos para el período seleccionado...")
+    datos = datos_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb, cache, lector)
 
     # Graficar todas las condiciones en un solo plot
-    graficar_todas_condiciones_mongodb(conteos, titulos, etiquetas_x, etiquetas_y, campos, period=periodo, total_accidents=len(accidentes))
+    from app.services.plotting import graficar_todas_condiciones_mongodb
+    graficar_todas_condiciones_mongodb(**datos)
 
-def opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j):
+def datos_accidentes_mensuales(anio_seleccionado, tipo_analisis, categoria_seleccionada, coleccion_mongodb, neo4j, rollup,
+                               cache=None, lector=None):
+    # Argumentos de graficar_accidentes_mensuales; tipo_analisis '1' = condición climática, '2' = severidad
+    tipo_categoria = 'Weather Condition' if tipo_analisis == '1' else 'Severidad'
+    print(f"\nObteniendo datos para el año {anio_seleccionado}...")
+    # Definir el rango de fechas
+    fecha_inicio = f"{anio_seleccionado}-01-01T00:00:00Z"
+    fecha_fin = f"{anio_seleccionado}-12-31T23:59:59Z"
+    eventos_anio = []
+
+    def eventos():
+        # Todos los eventos del año, leídos una sola vez y solo si hay algo que unir
+        if not eventos_anio:
+            eventos_anio.append(obtener_eventos(lector or neo4j, fecha_inicio, fecha_fin, cache))
+        return eventos_anio[0]
+
+    # Eventos insertados desde la última actualización (también los que llegan con fechas
+    # viejas): los meses que alcanzan se reconstruyen con los accidentes ya contados
+    marca_eventos = rollup.marca_eventos(anio_seleccionado, DISTANCIA_MAXIMA_KM, MODO_JOIN)
+    marca = rollup.marca_de_agua(anio_seleccionado, DISTANCIA_MAXIMA_KM, MODO_JOIN)
+    with span("rollup.eventos_nuevos"):
+        if marca is None:
+            # Sin accidentes contados no hay meses que corregir: alcanza con el id del último evento
+            cantidad, ultimo = neo4j.contar_eventos_nuevos(fecha_inicio, fecha_fin, marca_eventos)
+            eventos_nuevos = LoteEventos.desde_documentos([])
+        else:
+            eventos_nuevos, ultimo = leer_eventos_nuevos(neo4j, fecha_inicio, fecha_fin, marca_eventos)
+            cantidad = len(eventos_nuevos)
+    if cantidad:
+        if cache is not None:
+            cache.descartar("neo4j", "lote_eventos", fecha_inicio, fecha_fin)  # Ya no incluye todos los eventos
+        rollup.registrar_eventos_nuevos(anio_seleccionado, eventos_nuevos, ultimo, DISTANCIA_MAXIMA_KM, MODO_JOIN)
+    pendientes = rollup.meses_pendientes(anio_seleccionado, DISTANCIA_MAXIMA_KM, MODO_JOIN)
+    for mes in pendientes:
+        # Límites de texto como los del año, así cada accidente cae en el mismo mes que al contarlo
+        inicio_mes = fecha_inicio if mes == 1 else f"{anio_seleccionado}-{mes:02d}-01"
+        fin_mes = fecha_fin if mes == 12 else f"{anio_seleccionado}-{mes + 1:02d}-01"
+        lotes_mes = consultar_accidentes_compactos(coleccion_mongodb, inicio_mes, fin_mes, ["_id"] + CAMPOS_JOIN,
+                                                   fin_exclusivo=mes != 12, hasta_id=marca)
+        with span("rollup.reconstruir_mes"):
+            rollup.reconstruir_mes(anio_seleccionado, mes, lotes_mes, eventos(), DISTANCIA_MAXIMA_KM, MODO_JOIN,
+                                   JOIN_WORKERS)
+    if pendientes:
+        print(f"Eventos nuevos en {anio_seleccionado}: se recalcularon los meses {', '.join(map(str, pendientes))}")
+
+    # Actualizar los conteos materializados solo con los accidentes nuevos del año
+    lotes_nuevos = consultar_accidentes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, ["_id"] + CAMPOS_JOIN,
+                                                  desde_id=marca)
+    with span("rollup.actualizar"):
+        nuevos = rollup.actualizar(anio_seleccionado, lotes_nuevos, eventos, DISTANCIA_MAXIMA_KM, MODO_JOIN,
+                                   JOIN_WORKERS)
+    if nuevos:
+        print(f"Se procesaron {nuevos} accidentes nuevos en {anio_seleccionado}")
+    # Contar por mes desde los conteos materializados
+    with span("agregacion.rollup"):
+        if tipo_analisis == '1':
+            conteo_mensual = rollup.conteo_mensual(
+                anio_seleccionado, tipo_clima=None if categoria_seleccionada == 'All' else categoria_seleccionada)
+        else:
+            conteo_mensual = rollup.conteo_mensual(anio_seleccionado, severidad=categoria_seleccionada)
+    total_filtrados = sum(conteo_mensual.values())
+    print(f"Se encontraron {total_filtrados} accidentes en {anio_seleccionado} para {tipo_categoria}: {categoria_seleccionada}")
+    return {"year": anio_seleccionado, "monthly_count": conteo_mensual, "selected_category": categoria_seleccionada,
+            "category_type": tipo_categoria, "total_accidents": total_filtrados}
+
+def datos_mensuales_grafo(anio_seleccionado, tipo_analisis, categoria_seleccionada, neo4j):
+    # Igual que datos_accidentes_mensuales pero desde las relaciones DURANTE escritas en Neo4j
+    tipo_categoria = 'Weather Condition' if tipo_analisis == '1' else 'Severidad'
+    tipo_clima = None if tipo_analisis != '1' or categoria_seleccionada == 'All' else categoria_seleccionada
+    severidad = categoria_seleccionada if tipo_analisis == '2' else None
+    conteo_mensual = neo4j.contar_asociaciones(f"{anio_seleccionado}-01-01T00:00:00Z",
+                                               f"{anio_seleccionado}-12-31T23:59:59Z", "Mes", tipo_clima, severidad)
+    total_filtrados = sum(conteo_mensual.values())
+    print(f"Se encontraron {total_filtrados} accidentes en {anio_seleccionado} para {tipo_categoria}: {categoria_seleccionada}")
+    return {"year": anio_seleccionado, "monthly_count": conteo_mensual, "selected_category": categoria_seleccionada,
+            "category_type": tipo_categoria, "total_accidents": total_filtrados}
+
+def opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j, rollup, cache=None, lector=None):
     print("\n--- Generación de Gráfico de Accidentes Mensuales ---")
     # Submenú para seleccionar el año
     anios = ['2016', '2017', '2018', '2019', '2020', '2021', '2022']
@@ -240,17 +539,6 @@ def opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j):
     if tipo_analisis not in ['1', '2']:
         print("Opción inválida.")
         return
-    print(f"\nObteniendo datos para el año {anio_seleccionado}...")
-    # Definir el rango de fechas
-    fecha_inicio = f"{anio_seleccionado}-01-01T00:00:00Z"
-    fecha_fin = f"{anio_seleccionado}-12-31T23:59:59Z"
-    # Obtener accidentes de MongoDB para el año seleccionado
-    accidentes = list(coleccion_mongodb.find({
-        "Start_Time": {"$gte": fecha_inicio, "$lte": fecha_fin}
-    }))
-    eventos = neo4j.obtener_eventos_por_periodo(fecha_inicio, fecha_fin)
-    #eventos = procesar_eventos(eventos)
-    print(f"Se encontraron {len(accidentes)} accidentes y {len(eventos)} eventos climáticos en {anio_seleccionado}")
     if tipo_analisis == '1':
         # Opciones de condiciones climáticas
         condiciones_climaticas = ['Snow', 'Rain', 'Cold', 'Fog', 'Storm', 'Precipitation', 'All']
@@ -261,20 +549,7 @@ def opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j):
         if opcion_condicion not in [str(i) for i in range(1, len(condiciones_climaticas) + 1)]:
             print("Opción inválida.")
             return
-        condicion_seleccionada = condiciones_climaticas[int(opcion_condicion) - 1]
-        print(f"\nGenerando gráfico de accidentes por condición climática en {anio_seleccionado}...")
-        # Filtrar accidentes por condición climática seleccionada
-        accidentes_filtrados = filtrar_accidentes_por_clima_optimizado(accidentes, eventos)
-        if condicion_seleccionada != 'All':
-            accidentes_filtrados = filtrar_por_tipo_clima(accidentes_filtrados, condicion_seleccionada)
-        print(f"Se encontraron {len(accidentes_filtrados)} accidentes en {anio_seleccionado}")
-        # Contar accidentes por mes
-        conteo_mensual = {}
-        for acc in accidentes_filtrados:
-            mes = int(acc['Accidente']["Start_Time"][5:7])  # Extraer el mes de la fecha
-            conteo_mensual[mes] = conteo_mensual.get(mes, 0) + 1
-        # Generar gráfico
-        graficar_accidentes_mensuales(anio_seleccionado, conteo_mensual, condicion_seleccionada, 'Weather Condition', len(accidentes_filtrados))
+        categoria_seleccionada = condiciones_climaticas[int(opcion_condicion) - 1]
     else:
         # Opciones de severidad
         severidades = ['1', '2', '3', '4']
@@ -285,46 +560,131 @@ def opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j):
         if opcion_severidad not in [str(i) for i in range(1, len(severidades) + 1)]:
             print("Opción inválida.")
             return
-        severidad_seleccionada = severidades[int(opcion_severidad) - 1]
-        print(f"Generando gráfico de accidentes por severidad en {anio_seleccionado}...")
-        # Filtrar accidentes por severidad seleccionada
-        accidentes_filtrados = filtrar_accidentes_por_clima_optimizado(accidentes, eventos)
-        resultados = filtrar_por_severidad_clima(accidentes_filtrados, severidad_seleccionada)
-        # Contar accidentes por mes
-        conteo_mensual = {}
-        for acc in resultados:
-            mes = int(acc['Accidente']["Start_Time"][5:7])  # Extraer el mes de la fecha
-            conteo_mensual[mes] = conteo_mensual.get(mes, 0) + 1
-        # Generar gráfico
-        graficar_accidentes_mensuales(anio_seleccionado, conteo_mensual, severidad_seleccionada, 'Severidad', len(resultados))
-
-def opcion_visualizar_neo4j(fecha_inicio, fecha_fin, neo4j):
+        categoria_seleccionada = severidades[int(opcion_severidad) - 1]
+
+    datos = datos_accidentes_mensuales(anio_seleccionado, tipo_analisis, categoria_seleccionada, coleccion_mongodb, neo4j,
+                                       rollup, cache, lector)
+    # Generar gráfico
+    from app.services.plotting import graficar_accidentes_mensuales
+    graficar_accidentes_mensuales(**datos)
+
+def datos_neo4j(fecha_inicio, fecha_fin, neo4j, cache=None, lector=None, region=None, coleccion_mongodb=None):
+    # Argumentos de graficar_neo4j para el período. Con un estado como región se cuentan los
+    # eventos dentro de la caja de sus accidentes (hace falta coleccion_mongodb).
+    if region is not None and region.tipo == "estado" and coleccion_mongodb is None:
+        raise ValueError("Los eventos por estado necesitan la colección de accidentes")
+    eventos = obtener_eventos_region(lector or neo4j, coleccion_mongodb, fecha_inicio, fecha_fin, region, cache=cache)
+    total_eventos = len(eventos)
+    print(f"Se encontraron {total_eventos} eventos climáticos en Neo4j")
+
+    with span("agregacion.eventos"):
+        count_type = eventos.contar("EventType")
+        count_severity = eventos.contar("Severity")
+
+    period_str = _periodo_texto(fecha_inicio, fecha_fin, region)
+    return {"count_type": count_type, "count_severity": count_severity, "period": period_str,
+            "total_events": total_eventos}
+
+def opcion_visualizar_neo4j(fecha_inicio, fecha_fin, neo4j, cache=None, lector=None):
     if not fecha_inicio or not fecha_fin:
         print("Por favor, selecciona primero un período de análisis (Opción 1).")
         return
     print("\nBuscando datos de Neo4j para el período seleccionado...")
+    from app.services.plotting import graficar_neo4j
+    graficar_neo4j(**datos_neo4j(fecha_inicio, fecha_fin, neo4j, cache, lector))
+
+def meses_periodo(fecha_inicio, fecha_fin):
+    # (año, mes) de cada mes que toca el período
+    anio, mes = int(fecha_inicio[:4]), int(fecha_inicio[5:7])
+    ultimo = (int(fecha_fin[:4]), int(fecha_fin[5:7]))
+    meses = []
+    while (anio, mes) <= ultimo:
+        meses.append((anio, mes))
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return meses
+
+def exportar_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache=None, lector=None,
+                                  reemplazar=False, formato=EXPORT_FORMATO, k=1):
+    # Accidentes leídos por lotes (con ID) y asociados con los eventos del período a medida
+    # que llegan; el período completo nunca está en memoria
+    from app.services.exporting import EscritorParticionado, exportar_asociaciones
+    eventos = obtener_eventos(lector or neo4j, fecha_inicio, fecha_fin, cache)
+    lotes = consultar_accidentes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, CAMPOS_JOIN, con_ids=True)
+    with EscritorParticionado(formato=formato) as escritor:
+        if reemplazar:
+            escritor.reemplazar(meses_periodo(fecha_inicio, fecha_fin))
+        exportar_asociaciones(lotes, eventos, escritor, DISTANCIA_MAXIMA_KM, k)
+    return escritor
+
+def opcion_exportar_asociaciones(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache=None, lector=None):
+    if not fecha_inicio or not fecha_fin:
+        print("Por favor, selecciona primero un período de análisis (Opción 1).")
+        return
+    print("Las particiones año/mes del período ya exportadas pueden reemplazarse (se borran meses completos).")
+    reemplazar = input("¿Reemplazar las particiones existentes? (s/n): ").strip().lower() == 's'
+    try:
+        escritor = exportar_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector,
+                                                 reemplazar)
+    except ImportError as e:
+        print(e)
+        return
+    print(f"Se exportaron {escritor.filas} pares en {len(escritor.archivos)} archivos bajo {escritor.directorio}")
+
+def escribir_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache=None, lector=None, k=1):
+    # Pares accidente-evento del período escritos en Neo4j como relaciones DURANTE; los
+    # accidentes se leen, asocian y escriben por lotes
+    from app.services.graph import escribir_asociaciones_grafo
+    neo4j.asegurar_esquema_asociaciones()
+    eventos = obtener_eventos(lector or neo4j, fecha_inicio, fecha_fin, cache)
+    lotes = consultar_accidentes_compactos(coleccion_mongodb, fecha_inicio, fecha_fin, CAMPOS_JOIN, con_ids=True)
+    with span("escritura.grafo"):
+        return escribir_asociaciones_grafo(lotes, eventos, neo4j, DISTANCIA_MAXIMA_KM, k)
+
+def opcion_escribir_asociaciones(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache=None, lector=None):
+    if not fecha_inicio or not fecha_fin:
+        print("Por favor, selecciona primero un período de análisis (Opción 1).")
+        return
+    resumen = escribir_asociaciones_periodo(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector)
+    print(f"Se escribieron {resumen['relaciones']} relaciones DURANTE de {resumen['accidentes']} accidentes "
+          f"en {resumen['transacciones']} transacciones ({resumen['relaciones_por_s']:.0f} relaciones/s)")
 
-    eventos = neo4j.obtener_eventos_por_periodo(fecha_inicio, fecha_fin)
-    total_eventos = len(eventos)
-    print(f"Se encontraron {total_eventos} eventos climáticos en Neo4j")
-
-    count_type = {}
-    count_severity = {}
-    for evento in eventos:
-        tipo = evento.get("EventType", "Unknown")
-        severidad = evento.get("Severity", "Unknown")
-        count_type[tipo] = count_type.get(tipo, 0) + 1
-        count_severity[severidad] = count_severity.get(severidad, 0) + 1
-
-    period_str = f"{fecha_inicio.split('T')[0]} to {fecha_fin.split('T')[0]}"
-    graficar_neo4j(count_type, count_severity, period=period_str, total_events=total_eventos)
+def opcion_cache(cache, cache_joins=None, rollup=None):
+    if cache is None:
+        print("La caché de resultados está deshabilitada (CACHE_HABILITADA en config.py).")
+        return
+    print(f"\n{cache.resumen()}")
+    print("1. Invalidar toda la caché")
+    print("2. Invalidar solo MongoDB")
+    print("3. Invalidar solo Neo4j")
+    print("4. Volver")
+    opcion = input("Selecciona una opción (1-4): ")
+    fuentes = {'1': None, '2': "mongodb", '3': "neo4j"}
+    if opcion in fuentes:
+        eliminados = cache.invalidar(fuentes[opcion])
+        if cache_joins is not None:
+            cache_joins.invalidar()  # Los joins en memoria dependen de los datos invalidados
+        if rollup is not None and fuentes[opcion] is None:
+            rollup.invalidar()  # Reconstruir los conteos mensuales en la próxima consulta
+        print(f"Se eliminaron {eliminados} resultados de la caché.")
 
 def main():
-    # Conexión a MongoDB
-    coleccion_mongodb = conectar_mongodb()
-
-    # Conexión a Neo4j
-    neo4j = Neo4jConnector()
+    # Conexiones compartidas a MongoDB y Neo4j, con los pools abiertos desde el inicio
+    gestor = GestorConexiones()
+    try:
+        gestor.calentar()
+    except Exception as e:
+        print(f"No se pudieron precalentar las conexiones: {e}")
+    coleccion_mongodb = gestor.coleccion_mongodb
+    neo4j = Neo4jConnector(gestor)
+
+    # Caché persistente de resultados por período
+    cache = CacheResultados() if CACHE_HABILITADA else None
+    # Joins ya calculados, reutilizados al cambiar filtros
+    cache_joins = CacheJoins()
+    # Conteos mensuales materializados por año
+    rollup = RollupMensual()
+    # Lectura concurrente de ambas fuentes por subrangos mensuales
+    lector = LectorConcurrente(coleccion_mongodb, neo4j) if LECTURA_CONCURRENTE else None
 
     # Variables para filtros
     fecha_inicio = None
@@ -341,16 +701,35 @@ def main():
         elif opcion == '3':
             severidad = opcion_filtrar_severidad_clima()
         elif opcion == '4':
-            opcion_visualizar_graficos(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j)
+            with accion("opcion_4"):
+                opcion_visualizar_graficos(fecha_inicio, fecha_fin, tipo_clima, severidad, coleccion_mongodb, neo4j,
+                                           cache, cache_joins, lector)
         elif opcion == '5':
-            opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j)
+            with accion("opcion_5"):
+                opcion_graficar_accidentes_anuales(coleccion_mongodb, neo4j, rollup, cache, lector)
         elif opcion == '6':
-            opcion_visualizar_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb)
+            with accion("opcion_6"):
+                opcion_visualizar_mongodb(fecha_inicio, fecha_fin, coleccion_mongodb, cache, lector)
         elif opcion == '7':
-            opcion_visualizar_neo4j(fecha_inicio, fecha_fin, neo4j)
+            with accion("opcion_7"):
+                opcion_visualizar_neo4j(fecha_inicio, fecha_fin, neo4j, cache, lector)
         elif opcion == '8':
+            if cache is not None:
+                print(cache.resumen())
+            if lector is not None:
+                lector.close()
+            print(gestor.resumen())
+            gestor.close()
             print("Saliendo del programa.")
             break
+        elif opcion == '9':
+            opcion_cache(cache, cache_joins, rollup)
+        elif opcion == '10':
+            with accion("opcion_10"):
+                opcion_exportar_asociaciones(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector)
+        elif opcion == '11':
+            with accion("opcion_11"):
+                opcion_escribir_asociaciones(fecha_inicio, fecha_fin, coleccion_mongodb, neo4j, cache, lector)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from urllib.parse import parse_qs, urlsplit
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import (
+    CACHE_HABILITADA,
+    LECTURA_CONCURRENTE,
+    MONGODB_BATCH_SIZE,
+    SERVICIO_HOST,
+    SERVICIO_PUERTO,
+    SERVICIO_MAX_CONCURRENTES,
+    SNAPSHOT_DIR
+)
+from app.databases.neo4j import Neo4jConnector
+from app.databases.pool import GestorConexiones
+from app.databases.fetching import LectorConcurrente, normalizar_fecha
+from app.databases.memory import ColeccionMemoria, Neo4jMemoria
+from app.databases.regions import Region
+from app.databases.snapshot import abrir_snapshot
+from app.services.cache import CacheResultados, CacheJoins
+from app.services.rollups import RollupMensual
+from app.services.synthetic import generar_accidentes, generar_eventos
+from app.utils.serialization import a_json, condiciones_a_json
+from app.main import datos_graficos_combinados, datos_mongodb, datos_neo4j, datos_accidentes_mensuales
+
+def _periodo(parametros):
+    if "inicio" not in parametros or "fin" not in parametros:
+        raise ValueError("Faltan los parámetros inicio y fin")
+    inicio = normalizar_fecha(parametros["inicio"])
+    fin = normalizar_fecha(parametros["fin"], fin=True)
+    if inicio > fin:
+        raise ValueError("inicio debe ser anterior a fin")
+    return inicio, fin
+
+def _region(parametros):
+    # caja=lat_min,lng_min,lat_max,lng_max, estado=CA o circulo=lat,lng,radio_km (a lo sumo uno)
+    tipos = [tipo for tipo in ("caja", "estado", "circulo") if tipo in parametros]
+    if len(tipos) > 1:
+        raise ValueError("Usar solo uno de caja, estado o circulo")
+    return Region.desde_texto(f"{tipos[0]}:{parametros[tipos[0]]}") if tipos else None
+
+class ServicioAnalisis:
+    # Los análisis de main.py sobre conexiones, lector y cachés compartidos por todas las
+    # solicitudes. Los joins de cada período (con sus BallTree ya consultados) quedan en
+    # CacheJoins; las lecturas de MongoDB/Neo4j en CacheResultados.
+
+    def __init__(self, coleccion_mongodb, neo4j, gestor=None, cache=None, cache_joins=None, rollup=None, lector=None,
+                 max_concurrentes=SERVICIO_MAX_CONCURRENTES):
+        self.coleccion = coleccion_mongodb
+        self.neo4j = neo4j
+        self.gestor = gestor
+        self.cache = cache
+        self.cache_joins = cache_joins if cache_joins is not None else CacheJoins()
+        self.rollup = rollup if rollup is not None else RollupMensual()
+        self.lector = lector
+        self.inicio = time.time()
+        self.solicitudes = 0
+        self.errores = 0
+        self._cupos = threading.BoundedSemaphore(max_concurrentes)
+        self._lock = threading.Lock()
+        self._locks_anio = {}
+
+    def close(self):
+        if self.lector is not None:
+            self.lector.close()
+        if self.gestor is not None:
+            self.gestor.close()
+        else:
+            self.neo4j.close()
+
+    def registrar(self, error=False):
+        with self._lock:
+            self.solicitudes += 1
+            self.errores += int(error)
+
+    def _lock_anio(self, anio):
+        # La marca de agua del rollup se lee y avanza dentro del mismo lock, así dos
+        # solicitudes del mismo año no suman dos veces los accidentes nuevos
+        with self._lock:
+            return self._locks_anio.setdefault(anio, threading.Lock())
+
+    def eventos(self, fecha_inicio, fecha_fin, region=None):
+        with self._cupos:
+            return datos_neo4j(fecha_inicio, fecha_fin, self.neo4j, self.cache, self.lector, region, self.coleccion)
+
+    def combinado(self, fecha_inicio, fecha_fin, tipo_clima=None, severidad=None, region=None):
+        with self._cupos:
+            return datos_graficos_combinados(fecha_inicio, fecha_fin, tipo_clima, severidad, self.coleccion,
+                                             self.neo4j, self.cache, self.cache_joins, self.lector, region)
+
+    def mensual(self, anio, tipo_analisis, categoria):
+        with self._cupos, self._lock_anio(anio):
+            return datos_accidentes_mensuales(anio, tipo_analisis, categoria, self.coleccion, self.neo4j, self.rollup,
+                                              self.cache, self.lector)
+
+    def condiciones(self, fecha_inicio, fecha_fin, region=None):
+        with self._cupos:
+            datos = datos_mongodb(fecha_inicio, fecha_fin, self.coleccion, self.cache, self.lector, region)
+        return condiciones_a_json(datos)
+
+    def salud(self):
+        estado = {"estado": "ok", "segundos_activo": round(time.time() - self.inicio, 1),
+                  "solicitudes": self.solicitudes, "errores": self.errores,
+                  "cache_joins": self.cache_joins.estadisticas()}
+        if self.cache is not None:
+            estado["cache"] = self.cache.estadisticas()
+        if self.gestor is not None:
+            estado["pools"] = self.gestor.resumen()
+        return estado
+
+# Endpoints: ruta -> función(servicio, parámetros de la URL)
+def _endpoint_salud(servicio, parametros):
+    return servicio.salud()
+
+def _endpoint_eventos(servicio, parametros):
+    return servicio.eventos(*_periodo(parametros), _region(parametros))
+
+def _endpoint_combinado(servicio, parametros):
+    return servicio.combinado(*_periodo(parametros), parametros.get("tipo_clima"), parametros.get("severidad"),
+                              _region(parametros))
+
+def _endpoint_mensual(servicio, parametros):
+    anio = parametros.get("anio", "")
+    if not (anio.isdigit() and len(anio) == 4):
+        raise ValueError("anio debe ser un año AAAA")
+    tipo = parametros.get("tipo", "clima")
+    if tipo not in ("clima", "severidad"):
+        raise ValueError("tipo debe ser clima o severidad")
+    categoria = parametros.get("categoria", "All" if tipo == "clima" else None)
+    if categoria is None:
+        raise ValueError("Falta la categoria (severidad 1-4)")
+    return servicio.mensual(anio, '1' if tipo == "clima" else '2', categoria)
+
+def _endpoint_condiciones(servicio, parametros):
+    return servicio.condiciones(*_periodo(parametros), _region(parametros))
+
+ENDPOINTS = {
+    "/salud": _endpoint_salud,
+    "/eventos": _endpoint_eventos,
+    "/combinado": _endpoint_combinado,
+    "/mensual": _endpoint_mensual,
+    "/condiciones": _endpoint_condiciones,
+}
+
+class ManejadorAnalisis(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Conexiones keep-alive
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parametros = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+        endpoint = ENDPOINTS.get(url.path.rstrip("/") or "/")
+        servicio = self.server.servicio
+        if endpoint is None:
+            self._responder(404, {"error": f"Ruta desconocida: {url.path}", "rutas": sorted(ENDPOINTS)})
+            return
+        try:
+            inicio = time.perf_counter()
+            datos = endpoint(servicio, parametros)
+            datos = dict(a_json(datos), segundos=round(time.perf_counter() - inicio, 4))
+        except ValueError as e:
+            servicio.registrar(error=True)
+            self._responder(400, {"error": str(e)})
+            return
+        except Exception as e:
+            servicio.registrar(error=True)
+            self.log_error("Error en %s: %r", url.path, e)
+            self._responder(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        servicio.registrar()
+        self._responder(200, datos)
+
+    def _responder(self, estado, datos):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        if not self.server.silencioso:
+            super().log_message(formato, *args)
+
+class ServidorAnalisis(ThreadingHTTPServer):
+    # Un hilo por solicitud; todos comparten el mismo ServicioAnalisis
+    daemon_threads = True
+
+    def __init__(self, direccion, servicio, silencioso=False):
+        super().__init__(direccion, ManejadorAnalisis)
+        self.servicio = servicio
+        self.silencioso = silencioso
+
+def servicio_sintetico(num_accidentes, anio=2017, semilla=0, eventos_por_accidente=0.1, directorio=None):
+    # Servicio sobre ColeccionMemoria/Neo4jMemoria con datos de app/services/synthetic.py.
+    # Caché y rollup van a un directorio propio para no mezclarse con los de las bases reales.
+    directorio = directorio or tempfile.mkdtemp(prefix="servicio_sintetico_")
+    coleccion = ColeccionMemoria(chain.from_iterable(
+        generar_accidentes(num_accidentes, anio, semilla, MONGODB_BATCH_SIZE)))
+    neo4j = Neo4jMemoria(generar_eventos(max(int(num_accidentes * eventos_por_accidente), 1), anio, semilla))
+    cache = CacheResultados(os.path.join(directorio, "cache")) if CACHE_HABILITADA else None
+    rollup = RollupMensual(os.path.join(directorio, "rollups", "mensual.json"))
+    lector = LectorConcurrente(coleccion, neo4j) if LECTURA_CONCURRENTE else None
+    return ServicioAnalisis(coleccion, neo4j, cache=cache, rollup=rollup, lector=lector)
+
+def servicio_bases():
+    # Servicio sobre MongoDB y Neo4j con los pools abiertos desde el inicio
+    gestor = GestorConexiones()
+    try:
+        gestor.calentar()
+    except Exception as e:
+        print(f"No se pudieron precalentar las conexiones: {e}")
+    coleccion_mongodb = gestor.coleccion_mongodb
+    neo4j = Neo4jConnector(gestor)
+    cache = CacheResultados() if CACHE_HABILITADA else None
+    lector = LectorConcurrente(coleccion_mongodb, neo4j) if LECTURA_CONCURRENTE else None
+    return ServicioAnalisis(coleccion_mongodb, neo4j, gestor=gestor, cache=cache, lector=lector)
+
+def servicio_snapshot(directorio=SNAPSHOT_DIR):
+    # Servicio sobre un snapshot local: sin bases, caché de resultados ni lector concurrente
+    # (las columnas se leen con mmap); el rollup se guarda dentro del snapshot
+    accidentes, eventos = abrir_snapshot(directorio)
+    rollup = RollupMensual(os.path.join(directorio, "rollups", "mensual.json"))
+    return ServicioAnalisis(accidentes, eventos, rollup=rollup)
+
+def _periodo_argumento(texto):
+    inicio, _, fin = texto.partition(":")
+    if not fin:
+        raise argparse.ArgumentTypeError("El período debe tener la forma AAAA-MM-DD:AAAA-MM-DD")
+    return inicio, fin
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP/JSON con los análisis de accidentes y clima.")
+    parser.add_argument("--host", default=SERVICIO_HOST)
+    parser.add_argument("--puerto", type=int, default=SERVICIO_PUERTO)
+    parser.add_argument("--precalentar", nargs="+", type=_periodo_argumento, default=[],
+                        help="Períodos AAAA-MM-DD:AAAA-MM-DD cuyo join se calcula al iniciar")
+    parser.add_argument("--sinteticos", type=int, default=None, metavar="N",
+                        help="Usar bases en memoria con N accidentes sintéticos en lugar de MongoDB/Neo4j")
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR, default=None, metavar="DIR",
+                        help="Usar un snapshot local (python app/cli.py snapshot) en lugar de MongoDB/Neo4j")
+    parser.add_argument("--anio", type=int, default=2017, help="Año de los datos sintéticos")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--silencioso", action="store_true", help="No registrar cada solicitud")
+    args = parser.parse_args(argv)
+
+    if args.sinteticos is not None:
+        print(f"Generando {args.sinteticos} accidentes sintéticos de {args.anio}...")
+        servicio = servicio_sintetico(args.sinteticos, args.anio, args.semilla)
+    elif args.snapshot:
+        servicio = servicio_snapshot(args.snapshot)
+    else:
+        servicio = servicio_bases()
+
+    for inicio, fin in args.precalentar:
+        print(f"Precalentando {inicio} a {fin}...")
+        servicio.combinado(normalizar_fecha(inicio), normalizar_fecha(fin, fin=True))
+
+    servidor = ServidorAnalisis((args.host, args.puerto), servicio, args.silencioso)
+    print(f"Servicio escuchando en http://{args.host}:{servidor.server_address[1]} "
+          f"({', '.join(sorted(ENDPOINTS))})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.close()
+
+if __name__ == "__main__":
+    main()
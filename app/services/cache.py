@@ -0,0 +1,306 @@
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.config import CACHE_DIR, CACHE_MAX_BYTES, JOIN_CACHE_MAX_BYTES
+
+_NULOS = "__nulos__"  # Prefijo de las máscaras de valores ausentes
+
+def _es_numero(valor):
+    return isinstance(valor, (int, float, np.integer, np.floating)) and not isinstance(valor, bool)
+
+def _largo(columnas):
+    return len(next(iter(columnas.values()))) if columnas else 0
+
+def registros_a_columnas(registros):
+    # Convierte una lista de dicts en arrays NumPy tipados por columna (sin pickle).
+    # Los valores ausentes o None se guardan en una máscara aparte para restaurarlos.
+    claves = []
+    for registro in registros:
+        for clave in registro:
+            if clave not in claves:
+                claves.append(clave)
+
+    columnas = {}
+    for clave in claves:
+        valores = [registro.get(clave) for registro in registros]
+        nulos = np.array([valor is None for valor in valores], dtype=bool)
+        presentes = [valor for valor in valores if valor is not None]
+        if presentes and all(_es_numero(valor) for valor in presentes):
+            if all(isinstance(valor, (int, np.integer)) for valor in presentes):
+                columna = np.array([0 if valor is None else valor for valor in valores], dtype=np.int64)
+            else:
+                columna = np.array([np.nan if valor is None else valor for valor in valores], dtype=np.float64)
+        else:
+            columna = np.array(["" if valor is None else str(valor) for valor in valores], dtype=str)
+        columnas[clave] = columna
+        if nulos.any():
+            columnas[_NULOS + clave] = nulos
+    return columnas
+
+def columnas_a_registros(columnas):
+    claves = [clave for clave in columnas if not clave.startswith(_NULOS)]
+    listas = {clave: columnas[clave].tolist() for clave in claves}
+    nulos = {clave: columnas[_NULOS + clave] for clave in claves if _NULOS + clave in columnas}
+    total = _largo(listas)
+    registros = []
+    for i in range(total):
+        registro = {}
+        for clave in claves:
+            if clave in nulos and nulos[clave][i]:
+                continue
+            registro[clave] = listas[clave][i]
+        registros.append(registro)
+    return registros
+
+def _concatenar_columnas(partes):
+    # Une columnas de varios lotes; las columnas ausentes en un lote se rellenan como nulas
+    claves = []
+    for parte in partes:
+        for clave in parte:
+            if not clave.startswith(_NULOS) and clave not in claves:
+                claves.append(clave)
+
+    columnas = {}
+    for clave in claves:
+        arrays = [parte.get(clave) for parte in partes]
+        presentes = [array for array in arrays if array is not None]
+        numerica = all(array.dtype.kind in "if" for array in presentes)
+        tipo = np.result_type(*presentes) if numerica else np.dtype(str)
+        columnas[clave] = np.concatenate([
+            array.astype(tipo) if array is not None else np.zeros(_largo(parte), dtype=tipo)
+            for array, parte in zip(arrays, partes)
+        ])
+        nulos = np.concatenate([
+            parte.get(_NULOS + clave, np.zeros(_largo(parte), dtype=bool)) if clave in parte
+            else np.ones(_largo(parte), dtype=bool)
+            for parte in partes
+        ])
+        if nulos.any():
+            columnas[_NULOS + clave] = nulos
+    return columnas
+
+class CacheResultados:
+    # Caché persistente de resultados por (fuente, consulta, período) en archivos .npz
+    # columnares. El orden de uso se registra en la fecha de modificación de cada archivo
+    # y, al superar el tamaño máximo, se eliminan primero los menos usados (LRU).
+
+    def __init__(self, directorio=CACHE_DIR, tamano_maximo=CACHE_MAX_BYTES):
+        self.directorio = directorio
+        self.tamano_maximo = tamano_maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self.evictados = 0
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, fuente, consulta, fecha_inicio, fecha_fin):
+        clave = f"{fuente}|{consulta}|{fecha_inicio}|{fecha_fin}"
+        resumen = hashlib.sha1(clave.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.directorio, f"{fuente}__{resumen}.npz")
+
+    def _leer(self, ruta):
+        try:
+            with np.load(ruta, allow_pickle=False) as datos:
+                columnas = {clave: datos[clave] for clave in datos.files}
+        except (OSError, ValueError):
+            return None  # Archivo ausente, evictado o corrupto
+        os.utime(ruta)  # Marcar como usado recientemente
+        return columnas
+
+    def _escribir(self, ruta, columnas):
+        # Temporal propio de cada hilo/proceso: varias escrituras de la misma clave no se pisan
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(temporal, **columnas)
+        os.replace(temporal, ruta)
+        self._evictar()
+
+    def _evictar(self):
+        archivos = []
+        for ruta in glob.glob(os.path.join(self.directorio, "*.npz")):
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.tamano_maximo:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tamano
+            self.evictados += 1
+
+    def contiene(self, fuente, consulta, fecha_inicio, fecha_fin):
+        return os.path.exists(self._ruta(fuente, consulta, fecha_inicio, fecha_fin))
+
+    def obtener(self, fuente, consulta, fecha_inicio, fecha_fin):
+        columnas = self._leer(self._ruta(fuente, consulta, fecha_inicio, fecha_fin))
+        if columnas is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return columnas_a_registros(columnas)
+
+    def guardar(self, fuente, consulta, fecha_inicio, fecha_fin, registros):
+        self._escribir(self._ruta(fuente, consulta, fecha_inicio, fecha_fin), registros_a_columnas(registros))
+
+    def obtener_o_calcular(self, fuente, consulta, fecha_inicio, fecha_fin, calcular):
+        registros = self.obtener(fuente, consulta, fecha_inicio, fecha_fin)
+        if registros is None:
+            registros = calcular()
+            self.guardar(fuente, consulta, fecha_inicio, fecha_fin, registros)
+        return registros
+
+    def obtener_lotes_o_calcular(self, fuente, consulta, fecha_inicio, fecha_fin, generar_lotes, tamano_lote):
+        # Versión por lotes: en un acierto entrega lotes desde el archivo; en un fallo
+        # entrega los lotes del generador y guarda sus columnas al terminar.
+        ruta = self._ruta(fuente, consulta, fecha_inicio, fecha_fin)
+        columnas = self._leer(ruta)
+        if columnas is not None:
+            self.aciertos += 1
+            total = _largo(columnas)
+            for inicio in range(0, total, tamano_lote):
+                yield columnas_a_registros({clave: col[inicio:inicio + tamano_lote] for clave, col in columnas.items()})
+            return
+
+        self.fallos += 1
+        partes = []
+        for lote in generar_lotes():
+            partes.append(registros_a_columnas(lote))
+            yield lote
+        # Solo se guarda si el generador se consumió completo
+        self._escribir(ruta, _concatenar_columnas(partes) if partes else {})
+
+    def obtener_columnas_o_calcular(self, fuente, consulta, fecha_inicio, fecha_fin, calcular):
+        # Para resultados que ya son columnares (LoteEventos.columnas()): se guardan tal cual
+        ruta = self._ruta(fuente, consulta, fecha_inicio, fecha_fin)
+        columnas = self._leer(ruta)
+        if columnas is not None:
+            self.aciertos += 1
+            return columnas
+        self.fallos += 1
+        columnas = calcular()
+        self._escribir(ruta, columnas)
+        return columnas
+
+    def obtener_lotes_compactos_o_calcular(self, fuente, consulta, fecha_inicio, fecha_fin, generar_lotes, clase):
+        # Lotes tipados (LoteAccidentes): en un acierto el período completo sale como un
+        # solo lote; en un fallo se guardan los lotes concatenados al terminar el generador
+        ruta = self._ruta(fuente, consulta, fecha_inicio, fecha_fin)
+        columnas = self._leer(ruta)
+        if columnas is not None:
+            self.aciertos += 1
+            yield clase.desde_columnas(columnas)
+            return
+
+        self.fallos += 1
+        lotes = []
+        for lote in generar_lotes():
+            lotes.append(lote)
+            yield lote
+        self._escribir(ruta, clase.concatenar(lotes).columnas())
+
+    def descartar(self, fuente, consulta, fecha_inicio, fecha_fin):
+        # Elimina un resultado que quedó desactualizado (p. ej. llegaron eventos nuevos del período)
+        try:
+            os.remove(self._ruta(fuente, consulta, fecha_inicio, fecha_fin))
+            return True
+        except OSError:
+            return False
+
+    def invalidar(self, fuente=None):
+        patron = f"{fuente}__*.npz" if fuente else "*.npz"
+        eliminados = 0
+        for ruta in glob.glob(os.path.join(self.directorio, patron)):
+            try:
+                os.remove(ruta)
+                eliminados += 1
+            except OSError:
+                pass
+        return eliminados
+
+    def estadisticas(self):
+        archivos = glob.glob(os.path.join(self.directorio, "*.npz"))
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "evictados": self.evictados,
+            "archivos": len(archivos),
+            "bytes": sum(os.path.getsize(ruta) for ruta in archivos if os.path.exists(ruta)),
+        }
+
+    def resumen(self):
+        stats = self.estadisticas()
+        return (f"Caché: {stats['aciertos']} aciertos, {stats['fallos']} fallos "
+                f"({stats['tasa_aciertos']:.0%}), {stats['archivos']} archivos, "
+                f"{stats['bytes'] / 1e6:.1f} MB, {stats['evictados']} evictados")
+
+class CacheJoins:
+    # Caché en memoria de joins por (período, distancia, modo). Cada entrada es un
+    # ResultadoJoin; se eliminan los menos usados cuando se supera el tamaño máximo.
+    # Es segura entre hilos: si varios piden a la vez la misma clave, solo uno calcula
+    # el join y los demás esperan su resultado.
+
+    def __init__(self, tamano_maximo=JOIN_CACHE_MAX_BYTES):
+        self.tamano_maximo = tamano_maximo
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._en_curso = {}  # clave -> threading.Event del cálculo pendiente
+
+    def bytes_usados(self):
+        with self._lock:
+            return sum(entrada.nbytes for entrada in self.entradas.values())
+
+    def _buscar(self, clave):
+        # Llamar con el lock tomado
+        if clave in self.entradas:
+            self.aciertos += 1
+            self.entradas.move_to_end(clave)
+            return self.entradas[clave]
+        return None
+
+    def obtener_o_calcular(self, fecha_inicio, fecha_fin, distancia_maxima_km, modo, calcular):
+        clave = (fecha_inicio, fecha_fin, distancia_maxima_km, modo)
+        while True:
+            with self._lock:
+                resultado = self._buscar(clave)
+                if resultado is not None:
+                    return resultado
+                pendiente = self._en_curso.get(clave)
+                if pendiente is None:
+                    pendiente = self._en_curso[clave] = threading.Event()
+                    self.fallos += 1
+                    break
+            # Otro hilo está calculando la misma clave; si falla o se evicta, se reintenta
+            pendiente.wait()
+
+        try:
+            resultado = calcular()
+            with self._lock:
+                self.entradas[clave] = resultado
+                while len(self.entradas) > 1 and sum(e.nbytes for e in self.entradas.values()) > self.tamano_maximo:
+                    self.entradas.popitem(last=False)
+            return resultado
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            pendiente.set()
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self.entradas),
+                    "bytes": sum(entrada.nbytes for entrada in self.entradas.values()),
+                    "en_curso": len(self._en_curso)}
+
+    def invalidar(self):
+        with self._lock:
+            self.entradas.clear()
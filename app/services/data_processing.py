@@ -1,8 +1,8 @@
 from datetime import datetime, timezone
 from math import radians, cos, sin, asin, sqrt
-from sklearn.neighbors import BallTree
 import numpy as np
-from dateutil import parser
+from app.databases.records import fechas_a_epoch, LoteAccidentes, LoteEventos
+from app.utils.instrumentation import span, contar, medido
 
 def calcular_distancia(lat1, lon1, lat2, lon2):
     # Convertir de grados a radianes
@@ -10,7 +10,7 @@ def calcular_distancia(lat1, lon1, lat2, lon2):
 
     # Fórmula de Haversine
     dlon = lon2 - lon1
-    dlat = lat2 - lon1
+    dlat = lat2 - lat1
     a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
     c = 2 * asin(sqrt(a))
     r = 6371  # Radio de la Tierra en kilómetros
@@ -62,61 +62,487 @@ def filtrar_accidentes_por_clima(accidentes, eventos):
 
     return resultados
 
+RADIO_TIERRA_KM = 6371.0
+TAMANO_LOTE_JOIN = 50000  # Accidentes por consulta masiva al BallTree
+
+def construir_balltree(coords):
+    # scikit-learn se importa al construir el primer árbol y no al importar el módulo,
+    # así los comandos que no hacen joins arrancan sin cargarlo
+    from sklearn.neighbors import BallTree
+    return BallTree(coords, metric='haversine')
+
+def preparar_accidentes(accidentes):
+    # Coordenadas en radianes, fechas epoch e índices originales de los accidentes válidos
+    if isinstance(accidentes, LoteAccidentes):
+        return accidentes.coords, accidentes.epoch, np.arange(len(accidentes))
+    coords = np.radians(np.array([[a["Start_Lat"], a["Start_Lng"]] for a in accidentes], dtype=np.float64).reshape(-1, 2))
+    epoch, validas = fechas_a_epoch(a["Start_Time"] for a in accidentes)
+    for idx in np.flatnonzero(~validas):
+        print(f"Formato de fecha inválido en accidente ID {accidentes[idx].get('ID', 'Unknown')}.")
+    indices = np.flatnonzero(validas)
+    return coords[indices], epoch[indices], indices
+
+def preparar_eventos(eventos):
+    # Coordenadas en radianes, inicio/fin epoch e índices originales de los eventos válidos
+    if isinstance(eventos, LoteEventos):
+        return eventos.coords, eventos.inicio, eventos.fin, np.arange(len(eventos))
+    coords = np.radians(np.array([[e["Lat"], e["Lng"]] for e in eventos], dtype=np.float64).reshape(-1, 2))
+    inicio, inicio_valido = fechas_a_epoch(e["StartTime"] for e in eventos)
+    fin, fin_valido = fechas_a_epoch(e["EndTime"] for e in eventos)
+    validas = inicio_valido & fin_valido
+    for idx in np.flatnonzero(~validas):
+        print(f"Formato de fecha inválido en evento: {eventos[idx]['StartTime']}")
+    indices = np.flatnonzero(validas)
+    return coords[indices], inicio[indices], fin[indices], indices
+
+def rangos_por_accidente(idx_acc):
+    # Posición (0, 1, ...) de cada par dentro de su accidente; los pares van agrupados por accidente
+    posiciones = np.arange(len(idx_acc))
+    primero = np.ones(len(idx_acc), dtype=bool)
+    primero[1:] = idx_acc[1:] != idx_acc[:-1]
+    return posiciones - np.maximum.accumulate(np.where(primero, posiciones, 0))
+
+def asociar_eventos_cercanos(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin, distancia_maxima_km=1000, k=1,
+                             tamano_lote=TAMANO_LOTE_JOIN, tree=None):
+    # Para cada accidente, los k eventos más cercanos cuya ventana de tiempo lo contiene.
+    # Una consulta masiva de radio por lote de accidentes; los pares que pasan el filtro de
+    # tiempo se ordenan por (accidente, distancia, evento), así que los empates se resuelven
+    # por índice de evento igual que en el join por fuerza bruta y en el de intervalos.
+    # Devuelve (idx_accidente, idx_evento, distancia_km, desfase_s) ordenados por accidente y
+    # distancia; desfase_s son los segundos desde el inicio del evento hasta el accidente.
+    vacio = np.empty(0, dtype=np.int64)
+    if len(acc_coords) == 0 or len(evt_coords) == 0 or k < 1:
+        return vacio, vacio, np.empty(0, dtype=np.float64), vacio
+
+    if tree is None:
+        with span("join.balltree.construir"):
+            tree = construir_balltree(evt_coords)
+    radio = distancia_maxima_km / RADIO_TIERRA_KM  # Convertir distancia a radianes
+
+    partes = []
+    for inicio_lote in range(0, len(acc_coords), tamano_lote):
+        fin_lote = min(inicio_lote + tamano_lote, len(acc_coords))
+        with span("join.balltree.consulta"):
+            vecinos = tree.query_radius(acc_coords[inicio_lote:fin_lote], r=radio)
+        largos = np.fromiter((len(v) for v in vecinos), dtype=np.int64, count=len(vecinos))
+        contar("join.pares_candidatos", largos.sum())
+        if largos.sum() == 0:
+            continue
+
+        # Pares candidatos (accidente, evento) del lote
+        cand_acc = np.repeat(np.arange(inicio_lote, fin_lote, dtype=np.int64), largos)
+        cand_evt = np.concatenate(vecinos).astype(np.int64, copy=False)
+
+        # Filtrar pares por rango de tiempo
+        with span("join.filtro_tiempo"):
+            t = acc_epoch[cand_acc]
+            en_rango = (evt_inicio[cand_evt] <= t) & (t <= evt_fin[cand_evt])
+            cand_acc = cand_acc[en_rango]
+            cand_evt = cand_evt[en_rango]
+        if len(cand_acc) == 0:
+            continue
+
+        # Distancia exacta de los pares válidos y los k más cercanos de cada accidente
+        with span("join.cercanos"):
+            distancias = haversine_km(acc_coords[cand_acc, 0], acc_coords[cand_acc, 1],
+                                      evt_coords[cand_evt, 0], evt_coords[cand_evt, 1])
+            dentro = distancias <= distancia_maxima_km
+            cand_acc, cand_evt, distancias = cand_acc[dentro], cand_evt[dentro], distancias[dentro]
+            orden = np.lexsort((cand_evt, distancias, cand_acc))
+            cand_acc, cand_evt, distancias = cand_acc[orden], cand_evt[orden], distancias[orden]
+            mantener = rangos_por_accidente(cand_acc) < k
+            cand_acc, cand_evt, distancias = cand_acc[mantener], cand_evt[mantener], distancias[mantener]
+        partes.append((cand_acc, cand_evt, distancias, acc_epoch[cand_acc] - evt_inicio[cand_evt]))
+
+    if not partes:
+        return vacio, vacio, np.empty(0, dtype=np.float64), vacio
+    return tuple(np.concatenate(columna) for columna in zip(*partes))
+
+def asociar_por_lotes(lotes_accidentes, eventos, distancia_maxima_km=1000, k=1):
+    # Para cada lote de accidentes (LoteAccidentes o documentos, convertidos con ids) entrega
+    # (lote, idx_acc, idx_evt, distancias, desfases, rangos) con sus k eventos válidos más
+    # cercanos. El BallTree de los eventos se construye una sola vez y solo un lote de
+    # accidentes está en memoria a la vez.
+    evt_coords, evt_inicio, evt_fin, _ = preparar_eventos(eventos)
+    tree = None
+    if len(evt_coords):
+        with span("join.balltree.construir"):
+            tree = construir_balltree(evt_coords)
+    for lote in lotes_accidentes:
+        if not isinstance(lote, LoteAccidentes):
+            lote = LoteAccidentes.desde_documentos(lote, con_ids=True)
+        if tree is None or not len(lote):
+            continue
+        idx_acc, idx_evt, distancias, desfases = asociar_eventos_cercanos(
+            lote.coords, lote.epoch, evt_coords, evt_inicio, evt_fin, distancia_maxima_km, k, tree=tree)
+        yield lote, idx_acc, idx_evt, distancias, desfases, rangos_por_accidente(idx_acc) + 1
+
+def unir_accidentes_eventos_lote(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                 distancia_maxima_km=1000, tamano_lote=TAMANO_LOTE_JOIN, tree=None):
+    # Join espacio-temporal vectorizado con el BallTree. Devuelve (idx_accidente, idx_evento)
+    # con el evento válido más cercano de cada accidente (antes se tomaba el primero que
+    # devolvía el árbol, que depende de su orden interno).
+    idx_acc, idx_evt, _, _ = asociar_eventos_cercanos(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                      distancia_maxima_km, 1, tamano_lote, tree)
+    return idx_acc, idx_evt
+
+def unir_accidentes_eventos(accidentes, eventos, distancia_maxima_km=1000):
+    # Devuelve los índices (en las listas originales) de los pares accidente-evento asociados
+    acc_coords, acc_epoch, acc_indices = preparar_accidentes(accidentes)
+    evt_coords, evt_inicio, evt_fin, evt_indices = preparar_eventos(eventos)
+    idx_acc, idx_evt = unir_accidentes_eventos_lote(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                    distancia_maxima_km)
+    return acc_indices[idx_acc], evt_indices[idx_evt]
+
+def construir_resultados(accidentes, eventos, idx_acc, idx_evt):
+    return [{"Accidente": accidentes[i], "Evento": eventos[j]} for i, j in zip(idx_acc.tolist(), idx_evt.tolist())]
+
 def filtrar_accidentes_por_clima_optimizado(accidentes, eventos, distancia_maxima_km=1000):
-    # Preparar datos de accidentes
-    accidentes_coords = np.radians([[accidente["Start_Lat"], accidente["Start_Lng"]] for accidente in accidentes])
-    
-    # Al preparar las fechas de los accidentes
-    accidentes_fechas = []
-    for accidente in accidentes:
-        acc_fecha = datetime.fromisoformat(accidente["Start_Time"].replace(" ", "T"))
-        if acc_fecha.tzinfo is None:
-            acc_fecha = acc_fecha.replace(tzinfo=timezone.utc)
-        accidentes_fechas.append(acc_fecha)
-
-    # Preparar datos de eventos
-    eventos_coords = np.radians([[evento["Lat"], evento["Lng"]] for evento in eventos])
-    
-    # Al preparar las fechas de los eventos
-    eventos_fechas_inicio = []
-    eventos_fechas_fin = []
-    for evento in eventos:
-        try:
-            evento_inicio = parser.isoparse(evento["StartTime"])
-            if evento_inicio.tzinfo is None:
-                evento_inicio = evento_inicio.replace(tzinfo=timezone.utc)
-            eventos_fechas_inicio.append(evento_inicio)
-        except ValueError:
-            print(f"Formato de fecha inválido en evento: {evento['StartTime']}")
-        
-        evento_fin = parser.isoparse(evento["EndTime"])
-        if evento_fin.tzinfo is None:
-            evento_fin = evento_fin.replace(tzinfo=timezone.utc)
-        eventos_fechas_fin.append(evento_fin)
+    idx_acc, idx_evt = unir_accidentes_eventos(accidentes, eventos, distancia_maxima_km)
+    return construir_resultados(accidentes, eventos, idx_acc, idx_evt)
 
-    # Construir BallTree para eventos
-    tree = BallTree(eventos_coords, metric='haversine')
+def filtrar_accidentes_por_clima_cercanos(accidentes, eventos, distancia_maxima_km=1000, k=1):
+    # Hasta k eventos por accidente, del más cercano al más lejano. Cada par incluye la
+    # distancia (km), los segundos desde el inicio del evento y su rango (1 = más cercano).
+    acc_coords, acc_epoch, acc_indices = preparar_accidentes(accidentes)
+    evt_coords, evt_inicio, evt_fin, evt_indices = preparar_eventos(eventos)
+    idx_acc, idx_evt, distancias, desfases = asociar_eventos_cercanos(acc_coords, acc_epoch, evt_coords, evt_inicio,
+                                                                      evt_fin, distancia_maxima_km, k)
+    rangos = rangos_por_accidente(idx_acc) + 1
+    return [{"Accidente": accidentes[i], "Evento": eventos[j], "Distancia_km": distancia, "Desfase_s": desfase,
+             "Rango": rango}
+            for i, j, distancia, desfase, rango in zip(acc_indices[idx_acc].tolist(), evt_indices[idx_evt].tolist(),
+                                                       distancias.tolist(), desfases.tolist(), rangos.tolist())]
 
-    resultados = []
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Distancia de Haversine vectorizada; coordenadas en radianes
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
 
-    for idx, (acc_coord, acc_fecha) in enumerate(zip(accidentes_coords, accidentes_fechas)):
-        # Encontrar índices de eventos cercanos
-        radio = distancia_maxima_km / 6371.0  # Convertir distancia a radianes
-        indices_cercanos = tree.query_radius([acc_coord], r=radio)[0]
+MAX_CELDAS_DISTANCIA = 4_000_000  # Tamaño máximo de la matriz accidentes x eventos activos
 
-        # Filtrar eventos por rango de tiempo
-        for i in indices_cercanos:
-            evento_inicio = eventos_fechas_inicio[i]
-            evento_fin = eventos_fechas_fin[i]
+def unir_accidentes_eventos_intervalos(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                       distancia_maxima_km=1000):
+    # Join por barrido temporal: accidentes y eventos se ordenan por tiempo y se mantiene
+    # el conjunto de eventos activos. Los cortes (inicio y fin + 1 de cada evento) dividen
+    # la línea de tiempo en segmentos donde el conjunto activo no cambia, así que la
+    # comprobación espacial se hace por segmento solo contra los eventos activos.
+    # Devuelve (idx_accidente, idx_evento) con el evento activo más cercano de cada accidente.
+    vacio = np.empty(0, dtype=np.int64)
+    if len(acc_coords) == 0 or len(evt_coords) == 0:
+        return vacio, vacio
 
-            if evento_inicio <= acc_fecha <= evento_fin:
-                resultados.append({
-                    "Accidente": accidentes[idx],
-                    "Evento": eventos[i]
-                })
-                break  # Si se encuentra un evento correspondiente, salir del bucle
+    orden_acc = np.argsort(acc_epoch, kind="stable")
+    t_acc = acc_epoch[orden_acc]
+    # Eventos con fin anterior al inicio no pueden contener ningún accidente; se excluyen
+    # del barrido porque se quitarían del conjunto activo antes de haber entrado
+    validos = np.flatnonzero(evt_fin >= evt_inicio)
+    orden_inicio = validos[np.argsort(evt_inicio[validos], kind="stable")]
+    orden_fin = validos[np.argsort(evt_fin[validos], kind="stable")]
+    inicios = evt_inicio[orden_inicio]
+    fines = evt_fin[orden_fin]
 
-    return resultados
+    cortes = np.unique(np.concatenate([evt_inicio[validos], evt_fin[validos] + 1]))
+    segmento = np.searchsorted(cortes, t_acc, side="right") - 1
+    # Límites de los grupos de accidentes que comparten segmento
+    limites = np.flatnonzero(np.diff(segmento)) + 1
+    grupos_ini = np.concatenate([[0], limites])
+    grupos_fin = np.concatenate([limites, [len(t_acc)]])
+
+    activos = set()
+    p_inicio = 0
+    p_fin = 0
+    partes_acc = []
+    partes_evt = []
+    for g_ini, g_fin in zip(grupos_ini.tolist(), grupos_fin.tolist()):
+        if segmento[g_ini] < 0:
+            continue  # Antes del primer evento
+        t_seg = cortes[segmento[g_ini]]
+
+        # Avanzar el barrido hasta el inicio del segmento
+        while p_inicio < len(inicios) and inicios[p_inicio] <= t_seg:
+            activos.add(int(orden_inicio[p_inicio]))
+            p_inicio += 1
+        while p_fin < len(fines) and fines[p_fin] < t_seg:
+            activos.discard(int(orden_fin[p_fin]))
+            p_fin += 1
+        if not activos:
+            continue
+
+        # Ordenado para que los empates de distancia se resuelvan igual en cualquier partición
+        evt_activos = np.sort(np.fromiter(activos, dtype=np.int64, count=len(activos)))
+        evt_lat = evt_coords[evt_activos, 0]
+        evt_lng = evt_coords[evt_activos, 1]
+        paso = max(1, MAX_CELDAS_DISTANCIA // len(evt_activos))
+        for b_ini in range(g_ini, g_fin, paso):
+            acc_bloque = orden_acc[b_ini:min(b_ini + paso, g_fin)]
+            contar("join.pares_candidatos", len(acc_bloque) * len(evt_activos))
+            distancias = haversine_km(acc_coords[acc_bloque, 0][:, None], acc_coords[acc_bloque, 1][:, None],
+                                      evt_lat[None, :], evt_lng[None, :])
+            distancias[distancias > distancia_maxima_km] = np.inf
+            mas_cercano = np.argmin(distancias, axis=1)
+            con_evento = np.isfinite(distancias[np.arange(len(acc_bloque)), mas_cercano])
+            partes_acc.append(acc_bloque[con_evento])
+            partes_evt.append(evt_activos[mas_cercano[con_evento]])
+
+    if not partes_acc:
+        return vacio, vacio
+    idx_acc = np.concatenate(partes_acc)
+    idx_evt = np.concatenate(partes_evt)
+    orden = np.argsort(idx_acc, kind="stable")
+    return idx_acc[orden], idx_evt[orden]
+
+def filtrar_accidentes_por_clima_intervalos(accidentes, eventos, distancia_maxima_km=1000):
+    acc_coords, acc_epoch, acc_indices = preparar_accidentes(accidentes)
+    evt_coords, evt_inicio, evt_fin, evt_indices = preparar_eventos(eventos)
+    idx_acc, idx_evt = unir_accidentes_eventos_intervalos(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                          distancia_maxima_km)
+    return construir_resultados(accidentes, eventos, acc_indices[idx_acc], evt_indices[idx_evt])
+
+# Modos de join seleccionables (ver MODO_JOIN en config.py)
+MODOS_JOIN = {
+    "fuerza_bruta": filtrar_accidentes_por_clima,
+    "balltree": filtrar_accidentes_por_clima_optimizado,
+    "intervalos": filtrar_accidentes_por_clima_intervalos,
+}
+
+def filtrar_accidentes_por_clima_modo(accidentes, eventos, modo="balltree"):
+    if modo not in MODOS_JOIN:
+        raise ValueError(f"Modo de join desconocido: {modo}. Opciones: {', '.join(MODOS_JOIN)}")
+    return MODOS_JOIN[modo](accidentes, eventos)
+
+def unir_accidentes_eventos_por_lotes(lotes_accidentes, eventos, distancia_maxima_km=1000, modo="balltree",
+                                      num_workers=1):
+    # Join en streaming: los eventos se preparan una sola vez y cada lote de accidentes
+    # se une por separado. Entrega (lote, idx_accidente, idx_evento) a medida que se procesan.
+    # Con num_workers > 1 cada lote se reparte entre procesos (ver parallel.JoinParalelo).
+    # Acepta listas de documentos o LoteAccidentes/LoteEventos.
+    if modo not in MODOS_JOIN:
+        raise ValueError(f"Modo de join desconocido: {modo}. Opciones: {', '.join(MODOS_JOIN)}")
+    with span("join.preparar_eventos"):
+        evt_coords, evt_inicio, evt_fin, evt_indices = preparar_eventos(eventos)
+    if num_workers != 1 and modo != "fuerza_bruta" and len(evt_coords):
+        from app.services.parallel import JoinParalelo
+        with JoinParalelo(evt_coords, evt_inicio, evt_fin, distancia_maxima_km, modo, num_workers) as join:
+            for lote in lotes_accidentes:
+                with span("join.lote", modo=modo, workers=join.num_workers):
+                    acc_coords, acc_epoch, acc_indices = preparar_accidentes(lote)
+                    idx_acc, idx_evt = join.unir(acc_coords, acc_epoch)
+                contar("join.accidentes", len(lote))
+                yield lote, acc_indices[idx_acc], evt_indices[idx_evt]
+        return
+    tree = None
+    if modo == "balltree" and len(evt_coords):
+        with span("join.balltree.construir"):
+            tree = construir_balltree(evt_coords)
+    if modo == "fuerza_bruta" and isinstance(eventos, LoteEventos):
+        eventos = eventos.registros()
+    posicion_evento = {id(evento): i for i, evento in enumerate(eventos)} if modo == "fuerza_bruta" else None
+
+    for lote in lotes_accidentes:
+        contar("join.accidentes", len(lote))
+        if modo == "fuerza_bruta":
+            with span("join.lote", modo=modo):
+                documentos = lote.registros() if isinstance(lote, LoteAccidentes) else lote
+                posicion_accidente = {id(accidente): i for i, accidente in enumerate(documentos)}
+                contar("join.pares_candidatos", len(documentos) * len(eventos))
+                resultados = filtrar_accidentes_por_clima(documentos, eventos)
+                idx_acc = np.array([posicion_accidente[id(r["Accidente"])] for r in resultados], dtype=np.int64)
+                idx_evt = np.array([posicion_evento[id(r["Evento"])] for r in resultados], dtype=np.int64)
+            yield lote, idx_acc, idx_evt
+            continue
+        with span("join.lote", modo=modo):
+            acc_coords, acc_epoch, acc_indices = preparar_accidentes(lote)
+            if modo == "intervalos":
+                idx_acc, idx_evt = unir_accidentes_eventos_intervalos(acc_coords, acc_epoch, evt_coords, evt_inicio,
+                                                                      evt_fin, distancia_maxima_km)
+            else:
+                idx_acc, idx_evt = unir_accidentes_eventos_lote(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                                distancia_maxima_km, tree=tree)
+        yield lote, acc_indices[idx_acc], evt_indices[idx_evt]
+
+def filtrar_accidentes_por_clima_por_lotes(lotes_accidentes, eventos, distancia_maxima_km=1000, modo="balltree"):
+    # Igual que unir_accidentes_eventos_por_lotes pero entrega (lote, resultados) como dicts
+    for lote, idx_acc, idx_evt in unir_accidentes_eventos_por_lotes(lotes_accidentes, eventos, distancia_maxima_km, modo):
+        yield lote, construir_resultados(lote, eventos, idx_acc, idx_evt)
+
+class CuboConteos:
+    # Conteos de pares accidente-evento por (EventType, Severity, mes, State) calculados en
+    # una sola pasada con bincount sobre códigos de categoría. Los conteos por tipo, por
+    # severidad o por mes, con o sin filtros, son sumas sobre ejes de este arreglo.
+    __slots__ = ("conteos", "tipos", "severidades", "estados")
+
+    EJES = {"EventType": 0, "Severity": 1, "Mes": 2, "State": 3}
+
+    def __init__(self, conteos, tipos, severidades, estados):
+        self.conteos = conteos
+        self.tipos = tipos
+        self.severidades = severidades
+        self.estados = estados
+
+    @classmethod
+    def desde_codigos(cls, tipo, severidad, mes, tipos, severidades, estado=None, estados=None):
+        # Códigos enteros por par (posición en tipos/severidades/estados); mes de 1 a 12
+        if estado is None:
+            estado = np.zeros(len(tipo), dtype=np.int64)
+            estados = np.array(["All"])
+        forma = (len(tipos), len(severidades), 13, len(estados))
+        plano = np.ravel_multi_index((tipo, severidad, mes.astype(np.int64), estado), forma)
+        conteos = np.bincount(plano, minlength=int(np.prod(forma))).reshape(forma)
+        return cls(conteos, tipos, severidades, estados)
+
+    def _categorias(self, eje):
+        return (self.tipos, self.severidades, np.arange(13), self.estados)[eje]
+
+    def seleccionar(self, tipo_clima=None, severidad=None, mes=None, estado=None):
+        # Subcubo con los filtros aplicados; un valor que no aparece deja el eje vacío
+        cubo = self.conteos
+        for eje, valor in enumerate((tipo_clima, severidad, mes, estado)):
+            if valor:
+                posiciones = np.flatnonzero(self._categorias(eje) == valor)
+                cubo = np.take(cubo, posiciones, axis=eje)
+        return cubo
+
+    def contar(self, categoria, tipo_clima=None, severidad=None, mes=None, estado=None):
+        eje = self.EJES[categoria]
+        filtros = (tipo_clima, severidad, mes, estado)
+        categorias = self._categorias(eje)
+        if filtros[eje]:
+            categorias = categorias[categorias == filtros[eje]]
+        cubo = self.seleccionar(*filtros)
+        cantidades = cubo.sum(axis=tuple(i for i in range(cubo.ndim) if i != eje))
+        return {categoria.item(): int(cantidad) for categoria, cantidad in zip(categorias, cantidades) if cantidad}
+
+    def contar_por_mes(self, tipo_clima=None, severidad=None, estado=None):
+        return self.contar("Mes", tipo_clima, severidad, None, estado)
+
+    def total(self, tipo_clima=None, severidad=None, mes=None, estado=None):
+        return int(self.seleccionar(tipo_clima, severidad, mes, estado).sum())
+
+    def celdas(self):
+        # (tipo, severidad, mes, estado, cantidad) de cada celda no vacía
+        for i, j, mes, k in zip(*np.nonzero(self.conteos)):
+            yield self.tipos[i].item(), self.severidades[j].item(), int(mes), self.estados[k].item(), \
+                int(self.conteos[i, j, mes, k])
+
+class ResultadoJoin:
+    # Pares accidente-evento de un período guardados como arrays compactos: por cada par,
+    # el mes del accidente, el índice del evento y opcionalmente el código del estado;
+    # por cada evento, su tipo y severidad. Los filtros de tipo/severidad y los conteos
+    # son máscaras sobre estos arrays o cortes del cubo de conteos.
+    __slots__ = ("mes", "evento", "evt_tipo", "evt_severidad", "estado", "estados", "total_accidentes",
+                 "total_eventos", "_cubo")
+
+    def __init__(self, mes, evento, evt_tipo, evt_severidad, total_accidentes, total_eventos, estado=None, estados=None):
+        self.mes = mes
+        self.evento = evento
+        self.evt_tipo = evt_tipo
+        self.evt_severidad = evt_severidad
+        self.estado = estado
+        self.estados = estados
+        self.total_accidentes = total_accidentes
+        self.total_eventos = total_eventos
+        self._cubo = None
+
+    def __len__(self):
+        return len(self.evento)
+
+    @property
+    def nbytes(self):
+        total = self.mes.nbytes + self.evento.nbytes + self.evt_tipo.nbytes + self.evt_severidad.nbytes
+        if self.estado is not None:
+            total += self.estado.nbytes + self.estados.nbytes
+        return total
+
+    def cubo(self):
+        # Se calcula una vez por join y se reutiliza para cualquier combinación de filtros
+        if self._cubo is None:
+            with span("agregacion.cubo"):
+                tipos, codigo_tipo = np.unique(self.evt_tipo, return_inverse=True)
+                severidades, codigo_severidad = np.unique(self.evt_severidad, return_inverse=True)
+                self._cubo = CuboConteos.desde_codigos(codigo_tipo[self.evento], codigo_severidad[self.evento],
+                                                       self.mes, tipos, severidades, self.estado, self.estados)
+        return self._cubo
+
+    def columna(self, categoria):
+        if categoria == "EventType":
+            return self.evt_tipo[self.evento]
+        if categoria == "Severity":
+            return self.evt_severidad[self.evento]
+        raise ValueError(f"Categoría desconocida: {categoria}")
+
+    def mascara(self, tipo_clima=None, severidad=None):
+        mascara = np.ones(len(self.evento), dtype=bool)
+        if tipo_clima:
+            mascara &= self.evt_tipo[self.evento] == tipo_clima
+        if severidad:
+            mascara &= self.evt_severidad[self.evento] == severidad
+        return mascara
+
+    def contar(self, categoria, mascara=None):
+        if mascara is None:
+            return self.cubo().contar(categoria)
+        valores = self.columna(categoria)[mascara]
+        claves, cantidades = np.unique(valores, return_counts=True)
+        return dict(zip(claves.tolist(), cantidades.tolist()))
+
+    def contar_por_mes(self, mascara=None):
+        if mascara is None:
+            return self.cubo().contar_por_mes()
+        cantidades = np.bincount(self.mes[mascara], minlength=13)
+        return {mes: int(cantidades[mes]) for mes in range(1, 13) if cantidades[mes]}
+
+@medido("join")
+def calcular_join_periodo(lotes_accidentes, eventos, distancia_maxima_km=1000, modo="balltree", num_workers=1):
+    # Los lotes pueden ser listas de documentos o LoteAccidentes, y los eventos una lista o
+    # un LoteEventos. Si los accidentes traen State, se guarda también el estado de cada par.
+    meses = []
+    indices_evento = []
+    estados = []
+    con_estado = None
+    total_accidentes = 0
+    for lote, idx_acc, idx_evt in unir_accidentes_eventos_por_lotes(lotes_accidentes, eventos, distancia_maxima_km, modo,
+                                                                    num_workers):
+        total_accidentes += len(lote)
+        compacto = isinstance(lote, LoteAccidentes)
+        if con_estado is None and len(lote):
+            con_estado = lote.estado is not None if compacto else "State" in lote[0]
+        # Extraer el mes de la fecha del accidente
+        if compacto:
+            meses.append(lote.meses()[idx_acc])
+        else:
+            meses.append(np.fromiter((int(lote[i]["Start_Time"][5:7]) for i in idx_acc.tolist()),
+                                     dtype=np.int8, count=len(idx_acc)))
+        indices_evento.append(idx_evt.astype(np.int32))
+        if con_estado:
+            if compacto:
+                estados.append(lote.estados_texto(idx_acc))
+            else:
+                estados.append(np.array([str(lote[i].get("State", "Unknown")) for i in idx_acc.tolist()], dtype=str))
+    estado = categorias_estado = None
+    if con_estado:
+        valores = np.concatenate(estados) if estados else np.empty(0, dtype=str)
+        categorias_estado, estado = np.unique(valores, return_inverse=True)
+        estado = estado.astype(np.int16)
+    if isinstance(eventos, LoteEventos):
+        evt_tipo = eventos.columna("EventType")
+        evt_severidad = eventos.columna("Severity")
+    else:
+        evt_tipo = np.array([str(evento.get("EventType")) for evento in eventos], dtype=str)
+        evt_severidad = np.array([str(evento.get("Severity")) for evento in eventos], dtype=str)
+    contar("join.pares", sum(len(indices) for indices in indices_evento))
+    return ResultadoJoin(
+        mes=np.concatenate(meses) if meses else np.empty(0, dtype=np.int8),
+        evento=np.concatenate(indices_evento) if indices_evento else np.empty(0, dtype=np.int32),
+        evt_tipo=evt_tipo,
+        evt_severidad=evt_severidad,
+        total_accidentes=total_accidentes,
+        total_eventos=len(eventos),
+        estado=estado,
+        estados=categorias_estado,
+    )
 
 def filtrar_por_tipo_clima(resultados, tipo_clima):
     return [resultado for resultado in resultados if resultado["Evento"]["EventType"] == tipo_clima]
@@ -124,16 +550,25 @@ def filtrar_por_tipo_clima(resultados, tipo_clima):
 def filtrar_por_severidad_clima(resultados, severidad):
     return [resultado for resultado in resultados if resultado["Evento"]["Severity"] == severidad]
 
-def contar_accidentes_por_categoria(resultados, categoria):
-    conteo = {}
+def contar_accidentes_por_categoria(resultados, categoria, conteo=None):
+    # Si se entrega un conteo previo se acumula sobre él (procesamiento por lotes)
+    conteo = {} if conteo is None else conteo
     for resultado in resultados:
         clave = resultado["Evento"][categoria]
         conteo[clave] = conteo.get(clave, 0) + 1
     return conteo
 
-def contar_condiciones_ambientales_mongodb(accidentes, condicion):
-    conteo = {}
+def contar_accidentes_por_mes(resultados, conteo=None):
+    conteo = {} if conteo is None else conteo
+    for resultado in resultados:
+        mes = int(resultado["Accidente"]["Start_Time"][5:7])  # Extraer el mes de la fecha
+        conteo[mes] = conteo.get(mes, 0) + 1
+    return conteo
+
+def contar_condiciones_ambientales_mongodb(accidentes, condicion, conteo=None):
+    conteo = {} if conteo is None else conteo
     for accidente in accidentes:
-        clave = accidente.get(condicion, "Unknown")
+        clave = accidente.get(condicion)
+        clave = "Unknown" if clave is None else clave  # null cuenta como ausente, igual que $ifNull
         conteo[clave] = conteo.get(clave, 0) + 1
     return conteo
@@ -0,0 +1,158 @@
+import os
+import shutil
+import uuid
+import numpy as np
+from app.config import ASOCIACIONES_DIR, EXPORT_FORMATO, EXPORT_FILAS_POR_GRUPO
+from app.databases.records import LoteEventos
+from app.services.data_processing import asociar_por_lotes
+from app.utils.instrumentation import span, contar
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # Dependencia opcional: solo la necesita la exportación columnar
+    pa = None
+
+FORMATOS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+def _esquema():
+    tiempo = pa.timestamp("s", tz="UTC")
+    return pa.schema([
+        ("ID", pa.string()),
+        ("EventId", pa.string()),
+        ("Start_Time", tiempo),
+        ("Start_Lat", pa.float64()),
+        ("Start_Lng", pa.float64()),
+        ("EventStartTime", tiempo),
+        ("EventEndTime", tiempo),
+        ("EventLat", pa.float64()),
+        ("EventLng", pa.float64()),
+        ("EventType", pa.dictionary(pa.int16(), pa.string())),
+        ("Severity", pa.dictionary(pa.int16(), pa.string())),
+        ("Distance_km", pa.float64()),
+        ("Offset_s", pa.int64()),
+        ("Rank", pa.int8()),
+    ])
+
+def _particion(anio, mes):
+    return os.path.join(f"year={anio}", f"month={mes:02d}")
+
+class EscritorParticionado:
+    # Escribe filas en archivos Parquet o Arrow IPC particionados por año/mes (estilo Hive:
+    # year=2017/month=03/). Las filas se acumulan por partición y se escriben como un grupo
+    # al llegar a filas_por_grupo, así que la memoria depende del tamaño del grupo y no del
+    # período. Cada ejecución agrega un archivo nuevo por partición (part-<id>), de modo que
+    # exportar otro período o más datos no reescribe lo ya exportado.
+
+    def __init__(self, directorio=ASOCIACIONES_DIR, formato=EXPORT_FORMATO, filas_por_grupo=EXPORT_FILAS_POR_GRUPO):
+        if pa is None:
+            raise ImportError("La exportación columnar requiere pyarrow (pip install pyarrow)")
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato de exportación desconocido: {formato}. Opciones: {', '.join(FORMATOS)}")
+        self.directorio = directorio
+        self.formato = formato
+        self.filas_por_grupo = filas_por_grupo
+        self.esquema = _esquema()
+        self.parte = uuid.uuid4().hex[:12]
+        self.filas = 0
+        self.archivos = []
+        self._pendientes = {}  # (año, mes) -> lista de tablas sin escribir
+        self._escritores = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reemplazar(self, particiones):
+        # Elimina las particiones (año, mes) indicadas antes de volver a exportarlas
+        for anio, mes in particiones:
+            shutil.rmtree(os.path.join(self.directorio, _particion(anio, mes)), ignore_errors=True)
+
+    def _escritor(self, clave):
+        if clave not in self._escritores:
+            carpeta = os.path.join(self.directorio, _particion(*clave))
+            os.makedirs(carpeta, exist_ok=True)
+            ruta = os.path.join(carpeta, f"part-{self.parte}{FORMATOS[self.formato]}")
+            if self.formato == "parquet":
+                self._escritores[clave] = pq.ParquetWriter(ruta, self.esquema, compression="zstd")
+            else:
+                self._escritores[clave] = ipc.new_file(ruta, self.esquema)
+            self.archivos.append(ruta)
+        return self._escritores[clave]
+
+    def _volcar(self, clave):
+        tablas = self._pendientes.pop(clave, [])
+        if not tablas:
+            return
+        with span("exportacion.columnar", formato=self.formato):
+            tabla = pa.concat_tables(tablas).unify_dictionaries().combine_chunks()
+            escritor = self._escritor(clave)
+            if self.formato == "parquet":
+                escritor.write_table(tabla, row_group_size=self.filas_por_grupo)
+            else:
+                escritor.write_table(tabla, max_chunksize=self.filas_por_grupo)
+
+    def escribir(self, columnas, anio, mes):
+        # columnas: arrays con las claves del esquema; anio/mes por fila
+        if len(anio) == 0:
+            return
+        tabla = pa.Table.from_pydict({campo.name: columnas[campo.name] for campo in self.esquema}, schema=self.esquema)
+        clave_fila = anio.astype(np.int64) * 100 + mes
+        orden = np.argsort(clave_fila, kind="stable")
+        claves, inicios = np.unique(clave_fila[orden], return_index=True)
+        limites = list(inicios[1:]) + [len(orden)]
+        for clave, inicio, fin in zip(claves.tolist(), inicios.tolist(), limites):
+            clave = (clave // 100, clave % 100)
+            self._pendientes.setdefault(clave, []).append(tabla.take(pa.array(orden[inicio:fin])))
+            if sum(len(t) for t in self._pendientes[clave]) >= self.filas_por_grupo:
+                self._volcar(clave)
+        self.filas += len(anio)
+        contar("exportacion.filas", len(anio))
+
+    def close(self):
+        for clave in list(self._pendientes):
+            self._volcar(clave)
+        for escritor in self._escritores.values():
+            escritor.close()
+        self._escritores.clear()
+
+def columnas_asociacion(lote, eventos, idx_acc, idx_evt, distancias, desfases, rangos):
+    # Filas de pares accidente-evento con las columnas del esquema de exportación (arrays
+    # NumPy o Arrow)
+    acc_grados = np.degrees(lote.coords[idx_acc])
+    evt_grados = np.degrees(eventos.coords[idx_evt])
+    return {
+        "ID": lote.ids[idx_acc] if lote.ids is not None else np.full(len(idx_acc), None, dtype=object),
+        "EventId": eventos.ids[idx_evt],
+        "Start_Time": lote.epoch[idx_acc].astype("datetime64[s]"),
+        "Start_Lat": acc_grados[:, 0],
+        "Start_Lng": acc_grados[:, 1],
+        "EventStartTime": eventos.inicio[idx_evt].astype("datetime64[s]"),
+        "EventEndTime": eventos.fin[idx_evt].astype("datetime64[s]"),
+        "EventLat": evt_grados[:, 0],
+        "EventLng": evt_grados[:, 1],
+        # Columnas categóricas: los códigos del LoteEventos se escriben como diccionario Arrow
+        "EventType": pa.DictionaryArray.from_arrays(eventos.tipo[idx_evt], eventos.tipos),
+        "Severity": pa.DictionaryArray.from_arrays(eventos.severidad[idx_evt], eventos.severidades),
+        "Distance_km": distancias,
+        "Offset_s": desfases,
+        "Rank": rangos.astype(np.int8),
+    }
+
+def exportar_asociaciones(lotes_accidentes, eventos, escritor, distancia_maxima_km=1000, k=1):
+    # Asocia cada lote de accidentes (LoteAccidentes, idealmente con ids) con sus k eventos
+    # válidos más cercanos y escribe los pares a medida que se calculan
+    if not isinstance(eventos, LoteEventos):
+        eventos = LoteEventos.desde_documentos(eventos)
+    total = 0
+    for lote, idx_acc, idx_evt, distancias, desfases, rangos in asociar_por_lotes(lotes_accidentes, eventos,
+                                                                                  distancia_maxima_km, k):
+        fechas = lote.epoch[idx_acc].astype("datetime64[s]")
+        anio = fechas.astype("datetime64[Y]").astype(np.int64) + 1970
+        mes = fechas.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        escritor.escribir(columnas_asociacion(lote, eventos, idx_acc, idx_evt, distancias, desfases, rangos), anio, mes)
+        total += len(idx_acc)
+    return total
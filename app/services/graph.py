@@ -0,0 +1,81 @@
+import time
+import numpy as np
+from app.config import NEO4J_ESCRITURA_LOTE
+from app.databases.records import LoteEventos
+from app.services.data_processing import asociar_por_lotes
+from app.utils.instrumentation import contar
+
+class EscritorGrafo:
+    # Escribe pares accidente-evento en Neo4j como (:Accidente)-[:DURANTE]->(:Evento). Los
+    # pares se agrupan por accidente y se envían en transacciones UNWIND de unas
+    # relaciones_por_lote relaciones (todas las de un accidente van en la misma).
+
+    def __init__(self, neo4j, relaciones_por_lote=NEO4J_ESCRITURA_LOTE):
+        self.neo4j = neo4j
+        self.relaciones_por_lote = relaciones_por_lote
+        self.accidentes = 0
+        self.relaciones = 0
+        self.nodos = 0
+        self.lotes = 0
+        self.segundos = 0.0
+        self._pendientes = []
+        self._pares_pendientes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def escribir(self, lote, eventos, idx_acc, idx_evt, distancias, desfases, rangos):
+        # Mismos argumentos que entrega asociar_por_lotes; idx_acc viene ordenado por accidente
+        if not len(idx_acc):
+            return
+        cortes = np.flatnonzero(np.diff(idx_acc)) + 1
+        evento_ids = eventos.ids[idx_evt].tolist()
+        distancias, desfases, rangos = distancias.tolist(), desfases.tolist(), rangos.tolist()
+        for inicio, fin in zip([0] + cortes.tolist(), cortes.tolist() + [len(idx_acc)]):
+            i = int(idx_acc[inicio])
+            self._pendientes.append({
+                "id": str(lote.ids[i]),
+                "epoch": int(lote.epoch[i]),
+                "pares": [{"evento": evento_ids[j], "distancia_km": distancias[j], "desfase_s": desfases[j],
+                           "rango": rangos[j]} for j in range(inicio, fin)],
+            })
+            self._pares_pendientes += fin - inicio
+            if self._pares_pendientes >= self.relaciones_por_lote:
+                self._volcar()
+
+    def _volcar(self):
+        if not self._pendientes:
+            return
+        inicio = time.perf_counter()
+        nodos, relaciones = self.neo4j.escribir_asociaciones(self._pendientes)
+        self.segundos += time.perf_counter() - inicio
+        self.accidentes += len(self._pendientes)
+        self.nodos += nodos
+        self.relaciones += relaciones
+        self.lotes += 1
+        contar("neo4j.relaciones", relaciones)
+        self._pendientes = []
+        self._pares_pendientes = 0
+
+    def close(self):
+        self._volcar()
+
+    def resumen(self):
+        # relaciones_por_s mide solo el tiempo de escritura (sin lectura ni join)
+        return {"accidentes": self.accidentes, "relaciones": self.relaciones, "nodos_creados": self.nodos,
+                "transacciones": self.lotes, "segundos_escritura": self.segundos,
+                "relaciones_por_s": self.relaciones / self.segundos if self.segundos else 0.0}
+
+def escribir_asociaciones_grafo(lotes_accidentes, eventos, neo4j, distancia_maxima_km=1000, k=1,
+                                relaciones_por_lote=NEO4J_ESCRITURA_LOTE):
+    # Asocia los accidentes (por lotes, con ids) con sus k eventos más cercanos y escribe
+    # los pares en Neo4j a medida que se calculan
+    if not isinstance(eventos, LoteEventos):
+        eventos = LoteEventos.desde_documentos(eventos)
+    with EscritorGrafo(neo4j, relaciones_por_lote) as escritor:
+        for asociacion in asociar_por_lotes(lotes_accidentes, eventos, distancia_maxima_km, k):
+            escritor.escribir(asociacion[0], eventos, *asociacion[1:])
+    return escritor.resumen()
@@ -0,0 +1,182 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from sklearn.neighbors import BallTree
+from app.config import JOIN_WORKERS
+from app.services.data_processing import (
+    preparar_accidentes,
+    preparar_eventos,
+    unir_accidentes_eventos_lote,
+    unir_accidentes_eventos_intervalos,
+)
+
+PARTICIONES_POR_WORKER = 4  # Particiones de tiempo por worker, para repartir mejor la carga
+
+def _crear_compartido(array):
+    # Copia un array a un bloque de memoria compartida; devuelve el bloque y su descriptor
+    array = np.ascontiguousarray(array)
+    bloque = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=bloque.buf)[...] = array
+    return bloque, (bloque.name, array.shape, array.dtype.str)
+
+def _adjuntar(descriptor):
+    nombre, forma, tipo = descriptor
+    try:
+        bloque = shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        # Python < 3.13: los workers comparten el resource tracker del proceso principal,
+        # que es quien elimina el bloque con unlink()
+        bloque = shared_memory.SharedMemory(name=nombre)
+    return bloque, np.ndarray(forma, dtype=np.dtype(tipo), buffer=bloque.buf)
+
+# Estado de cada worker: eventos compartidos (sin copiar) y BallTree construido una vez
+_worker = {}
+
+def _inicializar_worker(descriptores_eventos, distancia_maxima_km, modo):
+    bloques = []
+    arrays = []
+    for descriptor in descriptores_eventos:
+        bloque, array = _adjuntar(descriptor)
+        bloques.append(bloque)
+        arrays.append(array)
+    evt_coords, evt_inicio, evt_fin = arrays
+    _worker["bloques"] = bloques
+    _worker["eventos"] = (evt_coords, evt_inicio, evt_fin)
+    _worker["distancia"] = distancia_maxima_km
+    _worker["modo"] = modo
+    _worker["tree"] = BallTree(evt_coords, metric='haversine') if modo == "balltree" and len(evt_coords) else None
+
+def _unir_particion(descriptor_coords, descriptor_epoch, inicio, fin):
+    bloque_coords, acc_coords = _adjuntar(descriptor_coords)
+    bloque_epoch, acc_epoch = _adjuntar(descriptor_epoch)
+    try:
+        evt_coords, evt_inicio, evt_fin = _worker["eventos"]
+        if _worker["modo"] == "intervalos":
+            idx_acc, idx_evt = unir_accidentes_eventos_intervalos(
+                acc_coords[inicio:fin], acc_epoch[inicio:fin], evt_coords, evt_inicio, evt_fin, _worker["distancia"])
+        else:
+            idx_acc, idx_evt = unir_accidentes_eventos_lote(
+                acc_coords[inicio:fin], acc_epoch[inicio:fin], evt_coords, evt_inicio, evt_fin, _worker["distancia"],
+                tree=_worker["tree"])
+        return idx_acc + inicio, idx_evt
+    finally:
+        del acc_coords, acc_epoch
+        bloque_coords.close()
+        bloque_epoch.close()
+
+class JoinParalelo:
+    # Pool de procesos para el join. Los arrays de eventos se comparten una sola vez vía
+    # multiprocessing.shared_memory; cada llamada a unir() comparte los accidentes, los
+    # reparte por rangos de tiempo y combina los pares de cada partición. Como cada worker
+    # aplica el mismo algoritmo serial sobre los mismos eventos, el resultado es idéntico.
+
+    def __init__(self, evt_coords, evt_inicio, evt_fin, distancia_maxima_km=1000, modo="balltree",
+                 num_workers=JOIN_WORKERS):
+        if modo not in ("balltree", "intervalos"):
+            raise ValueError(f"Modo de join sin versión paralela: {modo}")
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self._bloques = []
+        descriptores = []
+        for array in (evt_coords, evt_inicio, evt_fin):
+            bloque, descriptor = _crear_compartido(array)
+            self._bloques.append(bloque)
+            descriptores.append(descriptor)
+        self._pool = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_inicializar_worker,
+                                         initargs=(descriptores, distancia_maxima_km, modo))
+
+    def unir(self, acc_coords, acc_epoch):
+        vacio = np.empty(0, dtype=np.int64)
+        if len(acc_coords) == 0:
+            return vacio, vacio
+
+        # Particionar por rango de tiempo: ordenar y cortar en tramos contiguos
+        orden = np.argsort(acc_epoch, kind="stable")
+        bloque_coords, descriptor_coords = _crear_compartido(acc_coords[orden])
+        bloque_epoch, descriptor_epoch = _crear_compartido(acc_epoch[orden])
+        try:
+            num_particiones = min(len(orden), self.num_workers * PARTICIONES_POR_WORKER)
+            cortes = np.linspace(0, len(orden), num_particiones + 1).astype(np.int64)
+            futuros = [
+                self._pool.submit(_unir_particion, descriptor_coords, descriptor_epoch, int(inicio), int(fin))
+                for inicio, fin in zip(cortes[:-1], cortes[1:]) if fin > inicio
+            ]
+            partes = [futuro.result() for futuro in futuros]
+        finally:
+            for bloque in (bloque_coords, bloque_epoch):
+                bloque.close()
+                bloque.unlink()
+
+        idx_acc = orden[np.concatenate([acc for acc, _ in partes])]
+        idx_evt = np.concatenate([evt for _, evt in partes])
+        # Mismo orden que el join serial (por índice de accidente)
+        orden_salida = np.argsort(idx_acc, kind="stable")
+        return idx_acc[orden_salida], idx_evt[orden_salida]
+
+    def close(self):
+        self._pool.shutdown()
+        for bloque in self._bloques:
+            bloque.close()
+            bloque.unlink()
+        self._bloques = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def unir_accidentes_eventos_paralelo(accidentes, eventos, distancia_maxima_km=1000, modo="balltree",
+                                     num_workers=JOIN_WORKERS):
+    # Igual que unir_accidentes_eventos pero repartiendo el join entre num_workers procesos
+    acc_coords, acc_epoch, acc_indices = preparar_accidentes(accidentes)
+    evt_coords, evt_inicio, evt_fin, evt_indices = preparar_eventos(eventos)
+    vacio = np.empty(0, dtype=np.int64)
+    if len(acc_coords) == 0 or len(evt_coords) == 0:
+        return vacio, vacio
+    with JoinParalelo(evt_coords, evt_inicio, evt_fin, distancia_maxima_km, modo, num_workers) as join:
+        idx_acc, idx_evt = join.unir(acc_coords, acc_epoch)
+    return acc_indices[idx_acc], evt_indices[idx_evt]
+
+def medir_escalado(accidentes, eventos, max_workers=None, distancia_maxima_km=1000, modo="balltree"):
+    # Reporte de escalado de 1 a max_workers procesos (tiempo del join sin preparación de datos)
+    max_workers = max_workers or os.cpu_count() or 1
+    acc_coords, acc_epoch, _ = preparar_accidentes(accidentes)
+    evt_coords, evt_inicio, evt_fin, _ = preparar_eventos(eventos)
+
+    inicio = time.perf_counter()
+    if modo == "intervalos":
+        referencia = unir_accidentes_eventos_intervalos(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                        distancia_maxima_km)
+    else:
+        referencia = unir_accidentes_eventos_lote(acc_coords, acc_epoch, evt_coords, evt_inicio, evt_fin,
+                                                  distancia_maxima_km)
+    segundos_serial = time.perf_counter() - inicio
+
+    filas = [{"workers": "serial", "segundos": segundos_serial, "accidentes_por_segundo": len(acc_coords) / segundos_serial,
+              "speedup": 1.0, "igual_a_serial": True}]
+    num_workers = 1
+    while True:
+        with JoinParalelo(evt_coords, evt_inicio, evt_fin, distancia_maxima_km, modo, num_workers) as join:
+            join.unir(acc_coords[:1], acc_epoch[:1])  # Arrancar los workers fuera de la medición
+            inicio = time.perf_counter()
+            resultado = join.unir(acc_coords, acc_epoch)
+            segundos = time.perf_counter() - inicio
+        filas.append({
+            "workers": num_workers,
+            "segundos": segundos,
+            "accidentes_por_segundo": len(acc_coords) / segundos,
+            "speedup": segundos_serial / segundos,
+            "igual_a_serial": all(np.array_equal(a, b) for a, b in zip(resultado, referencia)),
+        })
+        if num_workers >= max_workers:
+            break
+        num_workers = min(num_workers * 2, max_workers)
+    return filas
+
+def imprimir_reporte_escalado(filas):
+    print(f"{'Workers':>8} {'Segundos':>10} {'Acc/s':>12} {'Speedup':>8} {'Igual':>6}")
+    for fila in filas:
+        print(f"{fila['workers']:>8} {fila['segundos']:>10.3f} {fila['accidentes_por_segundo']:>12.0f} "
+              f"{fila['speedup']:>8.2f} {str(fila['igual_a_serial']):>6}")
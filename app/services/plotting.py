@@ -2,12 +2,36 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
+from app.utils.instrumentation import span, medido
 
 EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'exports')
-os.makedirs(EXPORT_DIR, exist_ok=True)
 
-def plot_comparison(count, title, xlabel, ylabel, period=None):
-    plt.figure(figsize=(12, 8))
+def _ruta_export(nombre):
+    # Las carpetas de exportación se crean al escribir el primer CSV, no al importar el módulo
+    ruta = os.path.join(EXPORT_DIR, nombre)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    return ruta
+
+def _mostrar_o_guardar(fig, salida=None, formatos=("png",)):
+    # Sin salida se abre la ventana interactiva; con salida (ruta sin extensión) se
+    # escribe un archivo por formato y se libera la figura
+    if salida is None:
+        with span("render.mostrar"):  # Incluye el tiempo con la ventana abierta
+            plt.show()
+        return []
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    rutas = []
+    with span("render.guardar", formatos=list(formatos)):
+        for formato in formatos:
+            ruta = f"{salida}.{formato}"
+            fig.savefig(ruta, format=formato)
+            rutas.append(ruta)
+        plt.close(fig)
+    return rutas
+
+@medido("render.plot_comparison")
+def plot_comparison(count, title, xlabel, ylabel, period=None, salida=None, formatos=("png",)):
+    fig = plt.figure(figsize=(12, 8))
     bars = plt.bar(count.keys(), count.values(), color=plt.cm.Paired.colors)
     plt.xlabel(xlabel, fontsize=12)
     plt.ylabel(ylabel, fontsize=12)
@@ -26,17 +50,21 @@ def plot_comparison(count, title, xlabel, ylabel, period=None):
                  f'{height}', ha='center', va='bottom', fontsize=10, fontweight='bold')
 
     plt.tight_layout()
-    plt.show()
+    return _mostrar_o_guardar(fig, salida, formatos)
 
-def graficar_todas_condiciones_mongodb(counts, titles, x_labels, y_labels, fields, period=None, total_accidents=None, export=True):
+@medido("render.graficar_todas_condiciones_mongodb")
+def graficar_todas_condiciones_mongodb(counts, titles, x_labels, y_labels, fields, period=None, total_accidents=None, export=True,
+                                       salida=None, formatos=("png",), quantiles=None):
     import matplotlib.pyplot as plt
 
     # Guardar datos en CSV
     if export:
-        for count, field in zip(counts, fields):
-            df = pd.DataFrame(list(count.items()), columns=[field, 'Count'])
-            filename = f'mongodb/{field}_{period}.csv'
-            df.to_csv(os.path.join(EXPORT_DIR, filename), index=False)
+        with span("exportacion.csv"):
+            for count, field in zip(counts, fields):
+                items = [(f"{k[0]:.2f}-{k[1]:.2f}" if isinstance(k, tuple) else k, v) for k, v in count.items()]
+                df = pd.DataFrame(items, columns=[field, 'Count'])
+                filename = f'mongodb/{field}_{period}.csv'
+                df.to_csv(_ruta_export(filename), index=False)
 
     # Generar gráficos
     num_fields = len(fields)
@@ -55,7 +83,9 @@ def graficar_todas_condiciones_mongodb(counts, titles, x_labels, y_labels, field
         if field in ['Precipitation(in)', 'Temperature(F)', 'Humidity(%)']:
             # Continuous data
             try:
-                values = [float(k) for k in count.keys() if k != 'Unknown']
+                bin_ranges = [k for k in count.keys() if k != 'Unknown']
+                prebinned = bool(bin_ranges) and all(isinstance(k, tuple) for k in bin_ranges)
+                values = [] if prebinned else [float(k) for k in bin_ranges]
                 quantities = [v for k, v in count.items() if k != 'Unknown']
 
                 unknowns = count.get('Unknown', 0)
@@ -67,9 +97,24 @@ def graficar_todas_condiciones_mongodb(counts, titles, x_labels, y_labels, field
                             fontsize=12,
                             bbox=dict(facecolor='white', alpha=0.5))
 
-                bins = np.linspace(min(values), max(values), 11)
-                counts_hist, bin_edges = np.histogram(values, bins=bins, weights=quantities)
-                bin_labels = [f"{bin_edges[i]:.2f}-{bin_edges[i+1]:.2f}" for i in range(len(bin_edges)-1)]
+                # Approximate quantiles from the merged sketches (datos_condiciones_anuales)
+                field_quantiles = (quantiles or {}).get(field)
+                if field_quantiles and field_quantiles.get('p50') is not None:
+                    ax.text(0.95, 0.80, '\n'.join(f'{name}: {value:.2f}' for name, value in field_quantiles.items()),
+                            horizontalalignment='right',
+                            verticalalignment='top',
+                            transform=ax.transAxes,
+                            fontsize=9,
+                            bbox=dict(facecolor='white', alpha=0.5))
+
+                if prebinned:
+                    # Histogram already computed by the database: {(start, end): count}
+                    counts_hist = np.array(quantities)
+                    bin_labels = [f"{start:.2f}-{end:.2f}" for start, end in bin_ranges]
+                else:
+                    bins = np.linspace(min(values), max(values), 11)
+                    counts_hist, bin_edges = np.histogram(values, bins=bins, weights=quantities)
+                    bin_labels = [f"{bin_edges[i]:.2f}-{bin_edges[i+1]:.2f}" for i in range(len(bin_edges)-1)]
 
                 bars = ax.bar(bin_labels, counts_hist, color='coral')
                 ax.set_xlabel(xlabel, fontsize=10)
@@ -149,17 +194,20 @@ def graficar_todas_condiciones_mongodb(counts, titles, x_labels, y_labels, field
         fig.suptitle(total_title, fontsize=14, y=0.98)
 
     plt.tight_layout(rect=[0, 0, 1, 0.96])
-    plt.show()
+    return _mostrar_o_guardar(fig, salida, formatos)
 
-def graficar_combinado(count_type, count_severity, period=None, total_accidents=None, export=True):
+@medido("render.graficar_combinado")
+def graficar_combinado(count_type, count_severity, period=None, total_accidents=None, export=True, salida=None,
+                       formatos=("png",)):
     import matplotlib.pyplot as plt
 
     # Guardar datos en CSV
     if export:
-        df_type = pd.DataFrame(list(count_type.items()), columns=['EventType', 'Count'])
-        df_severity = pd.DataFrame(list(count_severity.items()), columns=['Severity', 'Count'])
-        df_type.to_csv(os.path.join(EXPORT_DIR, f'Combinated/type{period}.csv'), index=False)
-        df_severity.to_csv(os.path.join(EXPORT_DIR, f'Combinated/severity_{period}.csv'), index=False)
+        with span("exportacion.csv"):
+            df_type = pd.DataFrame(list(count_type.items()), columns=['EventType', 'Count'])
+            df_severity = pd.DataFrame(list(count_severity.items()), columns=['Severity', 'Count'])
+            df_type.to_csv(_ruta_export(f'Combinated/type{period}.csv'), index=False)
+            df_severity.to_csv(_ruta_export(f'Combinated/severity_{period}.csv'), index=False)
 
     # Generar gráficos
     fig, axs = plt.subplots(1, 2, figsize=(18, 8))
@@ -200,17 +248,20 @@ def graficar_combinado(count_type, count_severity, period=None, total_accidents=
         plt.figtext(0.95, 0.95, total_info, horizontalalignment='right', fontsize=12, bbox=dict(facecolor='white', alpha=0.5))
 
     plt.tight_layout(rect=[0, 0, 1, 0.93])
-    plt.show()
+    return _mostrar_o_guardar(fig, salida, formatos)
 
-def graficar_neo4j(count_type, count_severity, period=None, total_events=None, export=True):
+@medido("render.graficar_neo4j")
+def graficar_neo4j(count_type, count_severity, period=None, total_events=None, export=True, salida=None,
+                   formatos=("png",)):
     
     if export:
-        df_type = pd.DataFrame(list(count_type.items()), columns=['EventType', 'Count'])
-        df_severity = pd.DataFrame(list(count_severity.items()), columns=['Severity', 'Count'])
-        filename_type = f'neo4j/count_type_neo4j_{period.replace(" ", "_")}.csv' if period else 'count_type_neo4j.csv'
-        filename_severity = f'neo4j/count_severity_neo4j_{period.replace(" ", "_")}.csv' if period else 'count_severity_neo4j.csv'
-        df_type.to_csv(os.path.join(EXPORT_DIR, filename_type), index=False)
-        df_severity.to_csv(os.path.join(EXPORT_DIR, filename_severity), index=False)
+        with span("exportacion.csv"):
+            df_type = pd.DataFrame(list(count_type.items()), columns=['EventType', 'Count'])
+            df_severity = pd.DataFrame(list(count_severity.items()), columns=['Severity', 'Count'])
+            filename_type = f'neo4j/count_type_neo4j_{period.replace(" ", "_")}.csv' if period else 'count_type_neo4j.csv'
+            filename_severity = f'neo4j/count_severity_neo4j_{period.replace(" ", "_")}.csv' if period else 'count_severity_neo4j.csv'
+            df_type.to_csv(_ruta_export(filename_type), index=False)
+            df_severity.to_csv(_ruta_export(filename_severity), index=False)
 
     # Generar gráficos
     fig, axs = plt.subplots(1, 2, figsize=(18, 8))
@@ -252,14 +303,16 @@ def graficar_neo4j(count_type, count_severity, period=None, total_events=None, e
                     bbox=dict(facecolor='white', alpha=0.5))
 
     plt.tight_layout(rect=[0, 0, 1, 0.93])
-    plt.show()
+    return _mostrar_o_guardar(fig, salida, formatos)
 
-def graficar_accidentes_mensuales(year, monthly_count, selected_category, category_type, total_accidents=None, export=True):
+@medido("render.graficar_accidentes_mensuales")
+def graficar_accidentes_mensuales(year, monthly_count, selected_category, category_type, total_accidents=None, export=True,
+                                  salida=None, formatos=("png",)):
     months = [month for month in range(1, 13)]
     quantities = [monthly_count.get(month, 0) for month in months]
     month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
                   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=(12, 8))
     bars = plt.bar(month_names, quantities, color=plt.cm.viridis.colors)
     plt.xlabel("Month", fontsize=12)
     plt.ylabel("Number of Accidents", fontsize=12)
@@ -270,12 +323,13 @@ def graficar_accidentes_mensuales(year, monthly_count, selected_category, catego
 
     # Guardar datos en CSV
     if export:
-        df = pd.DataFrame({
-            'Month': month_names,
-            'Accidents': quantities
-        })
-        filename = f'mensual/accidentes_mensuales_{year}_{selected_category.replace(" ", "_")}.csv'
-        df.to_csv(os.path.join(EXPORT_DIR, filename), index=False)
+        with span("exportacion.csv"):
+            df = pd.DataFrame({
+                'Month': month_names,
+                'Accidents': quantities
+            })
+            filename = f'mensual/accidentes_mensuales_{year}_{selected_category.replace(" ", "_")}.csv'
+            df.to_csv(_ruta_export(filename), index=False)
 
     if total_accidents:
         plt.figtext(0.95, 0.95, f'Total Accidents: {total_accidents}', horizontalalignment='right', fontsize=10, bbox=dict(facecolor='white', alpha=0.5))
@@ -287,4 +341,4 @@ def graficar_accidentes_mensuales(year, monthly_count, selected_category, catego
                  f'{height}', ha='center', va='bottom', fontsize=10, fontweight='bold')
 
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    return _mostrar_o_guardar(fig, salida, formatos)
\ No newline at end of file
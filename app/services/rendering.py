@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+from app.config import GRAFICOS_DIR, RENDER_WORKERS, RENDER_FORMATOS
+
+# Tipo de gráfico -> función de app.services.plotting que lo dibuja
+GRAFICOS = {
+    "combinado": "graficar_combinado",
+    "mongodb": "graficar_todas_condiciones_mongodb",
+    "neo4j": "graficar_neo4j",
+    "mensual": "graficar_accidentes_mensuales",
+}
+
+def _inicializar_worker():
+    # Backend sin ventana: cada proceso dibuja directo a archivo
+    matplotlib.use("Agg")
+
+def renderizar(tipo, datos, salida, formatos=RENDER_FORMATOS, export=True):
+    # Dibuja un gráfico con los argumentos que devuelven las funciones datos_* de main
+    from app.services import plotting
+    funcion = getattr(plotting, GRAFICOS[tipo])
+    return funcion(**datos, export=export, salida=salida, formatos=formatos)
+
+class RenderizadorLotes:
+    # Reparte el dibujo de gráficos en un pool de procesos. Los datos se calculan en el
+    # proceso principal (conexiones, cachés y joins compartidos) y a los workers solo
+    # viajan los conteos, así el dibujo de un gráfico se solapa con la consulta del siguiente.
+
+    def __init__(self, directorio=GRAFICOS_DIR, formatos=RENDER_FORMATOS, num_workers=RENDER_WORKERS, export=True):
+        self.directorio = directorio
+        self.formatos = tuple(formatos)
+        self.export = export
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.pool = None
+        self.pendientes = []
+        if self.num_workers == 1:
+            _inicializar_worker()
+
+    def __enter__(self):
+        if self.num_workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_inicializar_worker)
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            if exc[0] is not None:
+                # Tras un error no se dibuja lo que quedó en cola (cancel_futures requiere Python 3.9)
+                for pendiente in self.pendientes:
+                    if not isinstance(pendiente, list):
+                        pendiente.cancel()
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def enviar(self, tipo, datos, nombre):
+        salida = os.path.join(self.directorio, nombre)
+        if self.pool is None:
+            self.pendientes.append(renderizar(tipo, datos, salida, self.formatos, self.export))
+        else:
+            self.pendientes.append(self.pool.submit(renderizar, tipo, datos, salida, self.formatos, self.export))
+
+    def esperar(self):
+        # Rutas escritas, en el orden en que se enviaron los gráficos
+        rutas = []
+        for pendiente in self.pendientes:
+            rutas.extend(pendiente if isinstance(pendiente, list) else pendiente.result())
+        self.pendientes = []
+        return rutas
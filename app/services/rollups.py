@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+from datetime import date
+from itertools import chain
+from bson import ObjectId
+import numpy as np
+from app.config import ROLLUP_PATH, ROLLUP_CONDICIONES_PATH, BINS_CONDICIONES, KLL_K
+from app.databases.records import LoteAccidentes, fechas_a_epoch
+from app.services.data_processing import calcular_join_periodo
+from app.services.sketches import EstadisticasCampo, columna_numerica
+from app.services.sync import dias_eventos
+
+def _sumar_celdas(conteos, join, mes=None):
+    # Suma las celdas del cubo del join (agregado por estado si lo hubiera), solo las del mes si se indica
+    for tipo, severidad, mes_celda, _, cantidad in join.cubo().celdas():
+        if mes is None or mes_celda == mes:
+            clave = (mes_celda, tipo, severidad)
+            conteos[clave] = conteos.get(clave, 0) + cantidad
+
+def _filas_conteos(conteos):
+    return [[mes, tipo, severidad, cantidad] for (mes, tipo, severidad), cantidad in sorted(conteos.items())]
+
+class _ArchivoRollup:
+    # Años materializados en un JSON. Varios hilos (el servicio HTTP atiende años distintos
+    # a la vez) comparten la instancia: los cambios a self.anios y su escritura van bajo
+    # el mismo lock, y cada escritor usa su propio temporal.
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.anios = {}
+        self._lock = threading.RLock()
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as archivo:
+                self.anios = json.load(archivo)
+
+    def guardar(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+            temporal = f"{self.ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(self.anios, archivo)
+            os.replace(temporal, self.ruta)
+
+    def invalidar(self, anio=None):
+        with self._lock:
+            if anio is None:
+                self.anios = {}
+            else:
+                self.anios.pop(str(anio), None)
+            self.guardar()
+
+class RollupMensual(_ArchivoRollup):
+    # Conteos materializados de accidentes asociados a eventos climáticos por
+    # (año, mes, EventType, Severity). Cada año guarda además dos marcas de agua: el _id
+    # (ObjectId, creciente con la inserción) del último accidente procesado, así solo
+    # se unen los accidentes insertados después, y el id de nodo del último evento visto.
+    # Un evento que llega tarde puede cambiar el evento asociado a accidentes ya contados:
+    # los meses que alcanza quedan pendientes y se reconstruyen con reconstruir_mes.
+
+    def __init__(self, ruta=ROLLUP_PATH):
+        super().__init__(ruta)
+
+    def _entrada(self, anio, distancia_maxima_km, modo):
+        # Si el join se configuró distinto al materializar el año, se reconstruye desde cero
+        parametros = [distancia_maxima_km, modo]
+        with self._lock:
+            entrada = self.anios.get(str(anio))
+            if entrada is None or entrada.get("parametros") != parametros:
+                entrada = {"parametros": parametros, "marca_de_agua": None, "marca_eventos": None, "pendientes": [],
+                           "accidentes": 0, "conteos": []}
+                self.anios[str(anio)] = entrada
+            return entrada
+
+    def marca_de_agua(self, anio, distancia_maxima_km=1000, modo="balltree"):
+        marca = self._entrada(anio, distancia_maxima_km, modo)["marca_de_agua"]
+        return ObjectId(marca) if marca else None
+
+    def marca_eventos(self, anio, distancia_maxima_km=1000, modo="balltree"):
+        # Id de nodo del último evento visto; None si el año se materializó sin esta marca,
+        # y entonces todos sus eventos cuentan como nuevos
+        return self._entrada(anio, distancia_maxima_km, modo).get("marca_eventos")
+
+    def registrar_eventos_nuevos(self, anio, eventos_nuevos, marca_eventos, distancia_maxima_km=1000, modo="balltree"):
+        # Marca como pendientes los meses del año que cubren las ventanas de los eventos nuevos
+        # (LoteEventos), igual que la sincronización incremental, y avanza la marca de eventos.
+        # Los pendientes se guardan antes de reconstruirlos: si algo falla se reconstruyen en
+        # la próxima consulta. Sin accidentes contados no hay meses que corregir.
+        with self._lock:
+            entrada = self._entrada(anio, distancia_maxima_km, modo)
+            pendientes = set(entrada.get("pendientes", []))
+            if entrada["marca_de_agua"]:
+                anio = int(anio)
+                pendientes.update(desde.month for desde, _ in dias_eventos(eventos_nuevos, date(anio, 1, 1),
+                                                                           date(anio + 1, 1, 1)))
+            entrada["pendientes"] = sorted(pendientes)
+            entrada["marca_eventos"] = marca_eventos
+            self.guardar()
+            return entrada["pendientes"]
+
+    def meses_pendientes(self, anio, distancia_maxima_km=1000, modo="balltree"):
+        return list(self._entrada(anio, distancia_maxima_km, modo).get("pendientes", []))
+
+    def reconstruir_mes(self, anio, mes, lotes, eventos, distancia_maxima_km=1000, modo="balltree", num_workers=1):
+        # Reemplaza los conteos del mes por el join de sus accidentes ya contados (lotes
+        # leídos hasta la marca de agua) contra todos los eventos del año
+        join = calcular_join_periodo(lotes, eventos, distancia_maxima_km, modo, num_workers)
+        with self._lock:
+            entrada = self._entrada(anio, distancia_maxima_km, modo)
+            conteos = {(m, tipo, severidad): cantidad for m, tipo, severidad, cantidad in entrada["conteos"]
+                       if m != mes}
+            _sumar_celdas(conteos, join, mes)
+            entrada["conteos"] = _filas_conteos(conteos)
+            entrada["pendientes"] = [pendiente for pendiente in entrada.get("pendientes", []) if pendiente != mes]
+            self.guardar()
+        return join.total_accidentes
+
+    def actualizar(self, anio, lotes_nuevos, obtener_eventos, distancia_maxima_km=1000, modo="balltree", num_workers=1):
+        # Une solo los accidentes posteriores a la marca de agua y suma sus conteos. Los
+        # lotes (documentos o LoteAccidentes) deben incluir _id. Los eventos se piden
+        # únicamente si llegó al menos un lote nuevo.
+        lotes_nuevos = iter(lotes_nuevos)
+        primer_lote = next(lotes_nuevos, None)
+        if primer_lote is None:
+            return 0
+
+        entrada = self._entrada(anio, distancia_maxima_km, modo)
+        marca = [ObjectId(entrada["marca_de_agua"]) if entrada["marca_de_agua"] else None]
+
+        def registrar(lotes):
+            for lote in lotes:
+                if isinstance(lote, LoteAccidentes):
+                    maximo = lote.max_id
+                else:
+                    maximo = max((accidente["_id"] for accidente in lote), default=None)
+                if maximo is not None and (marca[0] is None or maximo > marca[0]):
+                    marca[0] = maximo
+                yield lote
+
+        lotes = registrar(chain([primer_lote], lotes_nuevos))
+        join = calcular_join_periodo(lotes, obtener_eventos(), distancia_maxima_km, modo, num_workers)
+
+        with self._lock:
+            conteos = {(mes, tipo, severidad): cantidad for mes, tipo, severidad, cantidad in entrada["conteos"]}
+            _sumar_celdas(conteos, join)
+            entrada["conteos"] = _filas_conteos(conteos)
+            entrada["accidentes"] += join.total_accidentes
+            entrada["marca_de_agua"] = str(marca[0])
+            self.guardar()
+        return join.total_accidentes
+
+    def conteo_mensual(self, anio, tipo_clima=None, severidad=None):
+        conteo = {}
+        for mes, tipo, sev, cantidad in self.anios.get(str(anio), {}).get("conteos", []):
+            if tipo_clima and tipo != tipo_clima:
+                continue
+            if severidad and sev != severidad:
+                continue
+            conteo[mes] = conteo.get(mes, 0) + cantidad
+        return conteo
+
+
+class RollupCondiciones(_ArchivoRollup):
+    # Condiciones ambientales materializadas por mes: total de accidentes, conteos de los
+    # campos categóricos y, por cada campo de BINS_CONDICIONES, histograma fijo y sketch de
+    # cuantiles (app/services/sketches.py). Como en RollupMensual, cada año guarda la marca
+    # de agua del último _id procesado; las distribuciones de varios meses o años se arman
+    # fusionando los resúmenes guardados, sin volver a leer los accidentes.
+
+    def __init__(self, ruta=ROLLUP_CONDICIONES_PATH, bins=BINS_CONDICIONES, k=KLL_K):
+        super().__init__(ruta)
+        self.bins = {campo: list(limites) for campo, limites in bins.items()}
+        self.k = k
+
+    def _entrada(self, anio):
+        # Si cambiaron los bins o k, el año se reconstruye desde cero
+        parametros = [self.bins, self.k]
+        with self._lock:
+            entrada = self.anios.get(str(anio))
+            if entrada is None or entrada.get("parametros") != parametros:
+                entrada = {"parametros": parametros, "marca_de_agua": None, "accidentes": 0, "meses": {}}
+                self.anios[str(anio)] = entrada
+            return entrada
+
+    def marca_de_agua(self, anio):
+        marca = self._entrada(anio)["marca_de_agua"]
+        return ObjectId(marca) if marca else None
+
+    def _mes_nuevo(self):
+        return {"total": 0, "categoricos": {},
+                "numericos": {campo: EstadisticasCampo(*limites, k=self.k) for campo, limites in self.bins.items()}}
+
+    def actualizar(self, anio, lotes_nuevos, campos_categoricos=("Weather_Condition",)):
+        # Suma a cada mes los documentos posteriores a la marca de agua. Los lotes deben
+        # incluir _id, Start_Time y los campos; los accidentes con fecha inválida se omiten.
+        entrada = self._entrada(anio)
+        marca = ObjectId(entrada["marca_de_agua"]) if entrada["marca_de_agua"] else None
+        meses = {}  # Meses tocados, deserializados una sola vez
+        nuevos = 0
+        leidos = False
+        for lote in lotes_nuevos:
+            leidos = True
+            epoch, validas = fechas_a_epoch(documento["Start_Time"] for documento in lote)
+            numero_mes = epoch.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+            for mes in np.unique(numero_mes[validas]).tolist():
+                indices = np.flatnonzero(validas & (numero_mes == mes))
+                documentos = [lote[i] for i in indices]
+                if mes not in meses:
+                    guardado = entrada["meses"].get(f"{mes:02d}")
+                    # Copias: lo guardado solo cambia bajo el lock, al terminar
+                    meses[mes] = self._mes_nuevo() if guardado is None else {
+                        "total": guardado["total"],
+                        "categoricos": {campo: dict(conteo) for campo, conteo in guardado["categoricos"].items()},
+                        "numericos": {campo: EstadisticasCampo.desde_dict(datos)
+                                      for campo, datos in guardado["numericos"].items()}}
+                resumen = meses[mes]
+                resumen["total"] += len(documentos)
+                for campo in campos_categoricos:
+                    conteo = resumen["categoricos"].setdefault(campo, {})
+                    for documento in documentos:
+                        valor = documento.get(campo)
+                        valor = "Unknown" if valor is None else str(valor)
+                        conteo[valor] = conteo.get(valor, 0) + 1
+                for campo, estadisticas in resumen["numericos"].items():
+                    estadisticas.actualizar(columna_numerica(documentos, campo))
+                nuevos += len(documentos)
+            maximo = max((documento["_id"] for documento in lote), default=None)
+            if maximo is not None and (marca is None or maximo > marca):
+                marca = maximo
+        if not leidos:
+            return 0
+        resumenes = {f"{mes:02d}": {
+            "total": resumen["total"], "categoricos": resumen["categoricos"],
+            "numericos": {campo: estadisticas.a_dict() for campo, estadisticas in resumen["numericos"].items()}}
+            for mes, resumen in meses.items()}
+        with self._lock:
+            entrada["meses"].update(resumenes)
+            entrada["accidentes"] += nuevos
+            entrada["marca_de_agua"] = str(marca) if marca is not None else None
+            self.guardar()
+        return nuevos
+
+    def combinar(self, anios, meses=None):
+        # (total, conteos categóricos por campo, EstadisticasCampo por campo) de los meses
+        # pedidos (todos por defecto) de los años dados
+        total = 0
+        categoricos = {}
+        numericos = {campo: EstadisticasCampo(*limites, k=self.k) for campo, limites in self.bins.items()}
+        with self._lock:
+            guardados = {anio: dict(self.anios.get(str(anio), {}).get("meses", {})) for anio in anios}
+        for anio in anios:
+            for mes, resumen in sorted(guardados[anio].items()):
+                if meses is not None and int(mes) not in meses:
+                    continue
+                total += resumen["total"]
+                for campo, conteo in resumen["categoricos"].items():
+                    combinado = categoricos.setdefault(campo, {})
+                    for valor, cantidad in conteo.items():
+                        combinado[valor] = combinado.get(valor, 0) + cantidad
+                for campo, datos in resumen["numericos"].items():
+                    if campo in numericos:
+                        numericos[campo].fusionar(EstadisticasCampo.desde_dict(datos))
+        return total, categoricos, numericos
+
@@ -0,0 +1,229 @@
+import numpy as np
+from app.config import KLL_K
+
+# Estadísticas de una columna numérica que se actualizan lote a lote y se fusionan: los
+# resúmenes de cada mes se guardan (app/services/rollups.py) y los de varios meses o años se
+# obtienen sumándolos, sin volver a leer los documentos.
+
+CUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+def columna_numerica(documentos, campo):
+    # Valores del campo como float64; ausentes, texto y NaN quedan como NaN (desconocidos)
+    valores = [documento.get(campo) for documento in documentos]
+    return np.array([float(valor) if isinstance(valor, (int, float)) and not isinstance(valor, bool) else np.nan
+                     for valor in valores], dtype=np.float64)
+
+class HistogramaFijo:
+    # Conteos en num_bins bins iguales entre inicio y fin, fijados de antemano (no dependen de
+    # los datos) para que los histogramas de distintos períodos se sumen bin a bin. Como en
+    # np.histogram el último bin incluye fin; los valores fuera de rango se cuentan aparte.
+
+    def __init__(self, inicio, fin, num_bins):
+        if not inicio < fin or num_bins < 1:
+            raise ValueError("El histograma necesita inicio < fin y al menos un bin")
+        self.inicio, self.fin, self.num_bins = float(inicio), float(fin), int(num_bins)
+        self.limites = np.linspace(self.inicio, self.fin, self.num_bins + 1)
+        self.conteos = np.zeros(self.num_bins, dtype=np.int64)
+        self.debajo = 0
+        self.encima = 0
+
+    def actualizar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[~np.isnan(valores)]
+        bins = np.searchsorted(self.limites, valores, "right") - 1
+        bins[valores == self.fin] = self.num_bins - 1
+        self.debajo += int((bins < 0).sum())
+        self.encima += int((bins >= self.num_bins).sum())
+        self.conteos += np.bincount(bins[(bins >= 0) & (bins < self.num_bins)], minlength=self.num_bins)
+        return self
+
+    def fusionar(self, otro):
+        if (self.inicio, self.fin, self.num_bins) != (otro.inicio, otro.fin, otro.num_bins):
+            raise ValueError("Solo se fusionan histogramas con los mismos bins")
+        self.conteos += otro.conteos
+        self.debajo += otro.debajo
+        self.encima += otro.encima
+        return self
+
+    @property
+    def total(self):
+        return int(self.conteos.sum()) + self.debajo + self.encima
+
+    def conteo(self):
+        # {(inicio, fin): cantidad} como los histogramas de agregar_condiciones_ambientales; los
+        # valores fuera de rango van en (-inf, inicio) y (fin, inf) si los hay
+        conteo = {}
+        if self.debajo:
+            conteo[(float("-inf"), self.inicio)] = self.debajo
+        limites = self.limites.tolist()
+        for inicio, fin, cantidad in zip(limites[:-1], limites[1:], self.conteos.tolist()):
+            conteo[(inicio, fin)] = cantidad
+        if self.encima:
+            conteo[(self.fin, float("inf"))] = self.encima
+        return conteo
+
+    def a_dict(self):
+        return {"inicio": self.inicio, "fin": self.fin, "num_bins": self.num_bins, "conteos": self.conteos.tolist(),
+                "debajo": self.debajo, "encima": self.encima}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        histograma = cls(datos["inicio"], datos["fin"], datos["num_bins"])
+        histograma.conteos = np.array(datos["conteos"], dtype=np.int64)
+        histograma.debajo, histograma.encima = datos["debajo"], datos["encima"]
+        return histograma
+
+class SketchKLL:
+    # Cuantiles aproximados en memoria acotada (sketch KLL). Los valores se guardan en
+    # niveles; cada valor del nivel h representa 2**h valores. Cuando un nivel supera su
+    # capacidad se ordena y sube la mitad de sus valores (los de posición par o impar, al
+    # azar) al nivel siguiente. Los niveles bajos tienen menos capacidad (k * (2/3)**altura),
+    # así el sketch ocupa O(k) valores para cualquier n. Dos sketches se fusionan juntando
+    # sus niveles y compactando.
+    FACTOR = 2 / 3
+
+    def __init__(self, k=KLL_K, semilla=0):
+        self.k = int(k)
+        self.niveles = [np.empty(0, dtype=np.float64)]
+        self.n = 0
+        self.minimo = None
+        self.maximo = None
+        self._rng = np.random.default_rng(semilla)
+
+    def _capacidad(self, nivel):
+        return max(int(np.ceil(self.k * self.FACTOR ** (len(self.niveles) - nivel - 1))), 2)
+
+    def _compactar(self):
+        nivel = 0
+        while nivel < len(self.niveles):
+            valores = self.niveles[nivel]
+            if len(valores) <= self._capacidad(nivel):
+                nivel += 1
+                continue
+            crece = nivel + 1 == len(self.niveles)
+            if crece:
+                self.niveles.append(np.empty(0, dtype=np.float64))
+            valores = np.sort(valores)
+            # Con cantidad impar el menor queda en el nivel: el peso total no cambia
+            impar = len(valores) % 2
+            self.niveles[nivel] = valores[:impar]
+            self.niveles[nivel + 1] = np.concatenate([self.niveles[nivel + 1],
+                                                      valores[impar + self._rng.integers(2)::2]])
+            # Un nivel nuevo reduce la capacidad de los de abajo: se revisan desde el primero
+            nivel = 0 if crece else nivel + 1
+
+    def _extremos(self, minimo, maximo):
+        self.minimo = minimo if self.minimo is None else min(self.minimo, minimo)
+        self.maximo = maximo if self.maximo is None else max(self.maximo, maximo)
+
+    def actualizar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[~np.isnan(valores)]
+        if not len(valores):
+            return self
+        self.n += len(valores)
+        self._extremos(float(valores.min()), float(valores.max()))
+        self.niveles[0] = np.concatenate([self.niveles[0], valores])
+        self._compactar()
+        return self
+
+    def fusionar(self, otro):
+        if self.k != otro.k:
+            raise ValueError("Solo se fusionan sketches con el mismo k")
+        if not otro.n:
+            return self
+        while len(self.niveles) < len(otro.niveles):
+            self.niveles.append(np.empty(0, dtype=np.float64))
+        for nivel, valores in enumerate(otro.niveles):
+            self.niveles[nivel] = np.concatenate([self.niveles[nivel], valores])
+        self.n += otro.n
+        self._extremos(otro.minimo, otro.maximo)
+        self._compactar()
+        return self
+
+    def _ordenados(self):
+        # (valores ordenados, peso acumulado) de todas las muestras
+        valores = np.concatenate(self.niveles)
+        pesos = np.concatenate([np.full(len(muestras), 2 ** nivel, dtype=np.int64)
+                                for nivel, muestras in enumerate(self.niveles)])
+        orden = np.argsort(valores, kind="stable")
+        return valores[orden], np.cumsum(pesos[orden])
+
+    def cuantiles(self, probabilidades=CUANTILES):
+        # Valor aproximado de cada cuantil (0 es el mínimo y 1 el máximo exactos); None sin datos
+        if not self.n:
+            return [None] * len(probabilidades)
+        valores, acumulado = self._ordenados()
+        indices = np.searchsorted(acumulado, np.asarray(probabilidades, dtype=np.float64) * self.n, "left")
+        resultado = valores[np.minimum(indices, len(valores) - 1)].tolist()
+        return [self.minimo if p <= 0 else self.maximo if p >= 1 else valor
+                for p, valor in zip(probabilidades, resultado)]
+
+    def rango(self, valor):
+        # Fracción aproximada de los valores <= valor
+        if not self.n:
+            return None
+        valores, acumulado = self._ordenados()
+        posicion = np.searchsorted(valores, valor, "right")
+        return float(acumulado[posicion - 1]) / self.n if posicion else 0.0
+
+    @property
+    def tamano(self):
+        return sum(len(muestras) for muestras in self.niveles)
+
+    def a_dict(self):
+        return {"k": self.k, "n": self.n, "minimo": self.minimo, "maximo": self.maximo,
+                "niveles": [muestras.tolist() for muestras in self.niveles]}
+
+    @classmethod
+    def desde_dict(cls, datos, semilla=0):
+        sketch = cls(datos["k"], semilla)
+        sketch.niveles = [np.array(muestras, dtype=np.float64) for muestras in datos["niveles"]] or sketch.niveles
+        sketch.n, sketch.minimo, sketch.maximo = datos["n"], datos["minimo"], datos["maximo"]
+        return sketch
+
+class EstadisticasCampo:
+    # Distribución de un campo numérico: histograma de bins fijos, sketch de cuantiles y
+    # cantidad de valores desconocidos (ausentes, texto o NaN)
+
+    def __init__(self, inicio, fin, num_bins, k=KLL_K):
+        self.histograma = HistogramaFijo(inicio, fin, num_bins)
+        self.sketch = SketchKLL(k)
+        self.desconocidos = 0
+
+    def actualizar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        validos = valores[~np.isnan(valores)]
+        self.desconocidos += len(valores) - len(validos)
+        self.histograma.actualizar(validos)
+        self.sketch.actualizar(validos)
+        return self
+
+    def fusionar(self, otro):
+        self.histograma.fusionar(otro.histograma)
+        self.sketch.fusionar(otro.sketch)
+        self.desconocidos += otro.desconocidos
+        return self
+
+    def conteo(self):
+        # Histograma listo para graficar_todas_condiciones_mongodb
+        conteo = self.histograma.conteo()
+        if self.desconocidos:
+            conteo["Unknown"] = self.desconocidos
+        return conteo
+
+    def cuantiles(self, probabilidades=CUANTILES):
+        # {"p50": valor, ...}
+        return {f"p{p * 100:g}": valor for p, valor in zip(probabilidades, self.sketch.cuantiles(probabilidades))}
+
+    def a_dict(self):
+        return {"histograma": self.histograma.a_dict(), "sketch": self.sketch.a_dict(),
+                "desconocidos": self.desconocidos}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        estadisticas = cls.__new__(cls)
+        estadisticas.histograma = HistogramaFijo.desde_dict(datos["histograma"])
+        estadisticas.sketch = SketchKLL.desde_dict(datos["sketch"])
+        estadisticas.desconocidos = datos["desconocidos"]
+        return estadisticas
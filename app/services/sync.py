@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from bson import ObjectId
+from app.config import DISTANCIA_MAXIMA_KM, SYNC_DIR, SYNC_K, SYNC_MARGEN_EVENTOS_S
+from app.databases.mongodb import consultar_accidentes_compactos, CAMPOS_JOIN
+from app.databases.records import LoteAccidentes, LoteEventos
+from app.services.data_processing import asociar_eventos_cercanos, preparar_eventos, rangos_por_accidente
+from app.utils.instrumentation import span, contar
+
+# Columnas de la tabla de pares y su tipo
+COLUMNAS_PARES = {
+    "acc_id": str,
+    "acc_epoch": np.int64,
+    "evt_id": str,
+    "evt_inicio": np.int64,
+    "evt_fin": np.int64,
+    "evt_tipo": str,
+    "evt_severidad": str,
+    "distancia_km": np.float64,
+    "desfase_s": np.int64,
+    "rango": np.int8,
+}
+CAMPOS_SYNC = ["_id"] + CAMPOS_JOIN
+
+def _vacias():
+    return {campo: np.empty(0, dtype=tipo) for campo, tipo in COLUMNAS_PARES.items()}
+
+def _dia(fecha):
+    # Límite de día como texto: compara bien contra Start_Time con "T" o con espacio
+    return fecha.strftime("%Y-%m-%d")
+
+def _iso(fecha):
+    return fecha.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _mes_siguiente(fecha):
+    return date(fecha.year + fecha.month // 12, fecha.month % 12 + 1, 1)
+
+def _meses(inicio, fin):
+    # [inicio, fin) cortado en cada inicio de mes
+    tramos = []
+    while inicio < fin:
+        corte = min(_mes_siguiente(inicio), fin)
+        tramos.append((inicio, corte))
+        inicio = corte
+    return tramos
+
+def dias_eventos(eventos, inicio, fin):
+    # Días que cubren las ventanas de los eventos, unidos en tramos contiguos dentro de
+    # [inicio, fin) y cortados por mes
+    if not len(eventos):
+        return []
+    base = np.datetime64(inicio.isoformat(), "D").astype(np.int64)
+    desde = np.maximum(eventos.inicio // 86400, base)
+    hasta = np.minimum(eventos.fin // 86400 + 1, np.datetime64(fin.isoformat(), "D").astype(np.int64))
+    orden = np.argsort(desde, kind="stable")
+    tramos = []
+    for d, h in zip(desde[orden].tolist(), hasta[orden].tolist()):
+        if d >= h:
+            continue
+        if tramos and d <= tramos[-1][1]:
+            tramos[-1][1] = max(tramos[-1][1], h)
+        else:
+            tramos.append([d, h])
+    dia = lambda n: date.fromordinal(date(1970, 1, 1).toordinal() + n)
+    return [tramo for d, h in tramos for tramo in _meses(dia(d), dia(h))]
+
+def pares_asociados(lote, eventos, distancia_maxima_km=DISTANCIA_MAXIMA_KM, k=SYNC_K):
+    # Los k eventos más cercanos y vigentes de cada accidente de un LoteAccidentes con ids,
+    # con las columnas de la tabla de pares
+    evt_coords, evt_inicio, evt_fin, _ = preparar_eventos(eventos)
+    idx_acc, idx_evt, distancias, desfases = asociar_eventos_cercanos(
+        lote.coords, lote.epoch, evt_coords, evt_inicio, evt_fin, distancia_maxima_km, k)
+    return {
+        "acc_id": lote.ids[idx_acc],
+        "acc_epoch": lote.epoch[idx_acc],
+        "evt_id": eventos.ids[idx_evt],
+        "evt_inicio": eventos.inicio[idx_evt],
+        "evt_fin": eventos.fin[idx_evt],
+        "evt_tipo": eventos.tipos[eventos.tipo[idx_evt]],
+        "evt_severidad": eventos.severidades[eventos.severidad[idx_evt]],
+        "distancia_km": distancias,
+        "desfase_s": desfases,
+        "rango": (rangos_por_accidente(idx_acc) + 1).astype(np.int8),
+    }
+
+def mejores_pares(columnas, k):
+    # Deja los k pares más cercanos de cada accidente sin repetir (accidente, evento). Los
+    # empates de distancia se resuelven por EventId.
+    if not len(columnas["acc_id"]):
+        return columnas
+    acc = np.unique(columnas["acc_id"], return_inverse=True)[1]
+    evt = np.unique(columnas["evt_id"], return_inverse=True)[1]
+    orden = np.lexsort((evt, columnas["distancia_km"], acc))
+    # El mismo par calculado dos veces tiene la misma distancia: queda contiguo al ordenar
+    repetido = np.zeros(len(orden), dtype=bool)
+    repetido[1:] = (acc[orden][1:] == acc[orden][:-1]) & (evt[orden][1:] == evt[orden][:-1])
+    orden = orden[~repetido]
+    rango = rangos_por_accidente(acc[orden])
+    orden = orden[rango < k]
+    resultado = {campo: valores[orden] for campo, valores in columnas.items()}
+    resultado["rango"] = (rango[rango < k] + 1).astype(np.int8)
+    return resultado
+
+class TablaAsociaciones:
+    # Pares accidente-evento persistidos en un .npz por mes del accidente (pares/AAAA-MM.npz)
+    # más el estado de la sincronización en estado.json: parámetros del join y marcas de agua
+    # de cada fuente. Una sincronización solo reescribe los meses que tocan los datos nuevos.
+
+    def __init__(self, directorio=SYNC_DIR):
+        self.directorio = directorio
+        self.estado = self._leer_estado()
+
+    def _ruta_estado(self):
+        return os.path.join(self.directorio, "estado.json")
+
+    def _ruta_mes(self, anio, mes):
+        return os.path.join(self.directorio, "pares", f"{anio}-{mes:02d}.npz")
+
+    def _leer_estado(self):
+        if os.path.exists(self._ruta_estado()):
+            with open(self._ruta_estado(), encoding="utf-8") as archivo:
+                return json.load(archivo)
+        return {"parametros": None, "marca_accidentes": None, "marca_eventos": None, "pares": 0,
+                "ultima_sincronizacion": None}
+
+    def guardar_estado(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        temporal = self._ruta_estado() + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(self.estado, archivo, indent=2)
+        os.replace(temporal, self._ruta_estado())
+
+    def reiniciar(self, parametros=None):
+        shutil.rmtree(os.path.join(self.directorio, "pares"), ignore_errors=True)
+        self.estado = {"parametros": parametros, "marca_accidentes": None, "marca_eventos": None, "pares": 0,
+                       "ultima_sincronizacion": None}
+        self.guardar_estado()
+
+    def meses(self):
+        carpeta = os.path.join(self.directorio, "pares")
+        if not os.path.isdir(carpeta):
+            return []
+        return sorted(tuple(int(parte) for parte in nombre[:-4].split("-"))
+                      for nombre in os.listdir(carpeta) if nombre.endswith(".npz"))
+
+    def leer_mes(self, anio, mes):
+        try:
+            with np.load(self._ruta_mes(anio, mes), allow_pickle=False) as datos:
+                return {campo: datos[campo] for campo in COLUMNAS_PARES}
+        except FileNotFoundError:
+            return _vacias()
+
+    def _guardar_mes(self, anio, mes, columnas):
+        ruta = self._ruta_mes(anio, mes)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta + ".tmp.npz"
+        np.savez_compressed(temporal, **columnas)
+        os.replace(temporal, ruta)
+
+    def fusionar(self, pares, k=SYNC_K):
+        # Agrega pares nuevos a los meses de sus accidentes y deja los k mejores de cada
+        # accidente. Devuelve cuántos pares ganó la tabla (negativo si hubo reemplazos).
+        if not len(pares["acc_id"]):
+            return 0
+        meses = pares["acc_epoch"].astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        diferencia = 0
+        for clave in np.unique(meses).tolist():
+            anio, mes = 1970 + clave // 12, clave % 12 + 1
+            del_mes = meses == clave
+            actuales = self.leer_mes(anio, mes)
+            with span("sync.fusionar"):
+                combinadas = mejores_pares({campo: np.concatenate([actuales[campo], pares[campo][del_mes]])
+                                            for campo in COLUMNAS_PARES}, k)
+            self._guardar_mes(anio, mes, combinadas)
+            diferencia += len(combinadas["acc_id"]) - len(actuales["acc_id"])
+        self.estado["pares"] += diferencia
+        return diferencia
+
+    def leer(self, fecha_inicio=None, fecha_fin=None, solo_mas_cercano=False):
+        # Pares de los accidentes entre fecha_inicio y fecha_fin (AAAA-MM-DD, inclusive)
+        inicio = date.fromisoformat(fecha_inicio) if fecha_inicio else date.min
+        fin = date.fromisoformat(fecha_fin) if fecha_fin else date.max
+        partes = [self.leer_mes(anio, mes) for anio, mes in self.meses()
+                  if (anio, mes) >= (inicio.year, inicio.month) and (anio, mes) <= (fin.year, fin.month)]
+        columnas = {campo: np.concatenate([parte[campo] for parte in partes]) if partes else _vacias()[campo]
+                    for campo in COLUMNAS_PARES}
+        dias = columnas["acc_epoch"] // 86400
+        mascara = np.ones(len(dias), dtype=bool)
+        if fecha_inicio:
+            mascara &= dias >= np.datetime64(fecha_inicio, "D").astype(np.int64)
+        if fecha_fin:
+            mascara &= dias <= np.datetime64(fecha_fin, "D").astype(np.int64)
+        if solo_mas_cercano:
+            mascara &= columnas["rango"] == 1
+        return {campo: valores[mascara] for campo, valores in columnas.items()}
+
+def _ultimo_id(coleccion_mongodb):
+    documento = coleccion_mongodb.find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+    return documento["_id"] if documento else None
+
+def leer_eventos_nuevos(neo4j, fecha_inicio, fecha_fin, desde_nodo=None, fin_exclusivo=False):
+    # (LoteEventos, id de nodo mayor) de los eventos insertados después de desde_nodo; cada
+    # lote se convierte apenas llega. Sin eventos nuevos el id sigue siendo desde_nodo.
+    lotes = []
+    ultimo = desde_nodo
+    for lote in neo4j.iterar_eventos_nuevos(fecha_inicio, fecha_fin, desde_nodo, fin_exclusivo=fin_exclusivo):
+        maximo = max(evento["NodeId"] for evento in lote)
+        ultimo = maximo if ultimo is None else max(ultimo, maximo)
+        with span("parseo.eventos"):
+            lotes.append(LoteEventos.desde_documentos(lote))
+    return LoteEventos.concatenar(lotes), ultimo
+
+def sincronizar(coleccion_mongodb, neo4j, tabla, fecha_inicio, fecha_fin, distancia_maxima_km=DISTANCIA_MAXIMA_KM,
+                k=SYNC_K, margen_s=SYNC_MARGEN_EVENTOS_S):
+    # Actualiza la tabla de pares del período [fecha_inicio, fecha_fin] (días AAAA-MM-DD)
+    # leyendo solo lo insertado desde la última sincronización:
+    #   1. eventos con id de nodo mayor a la marca (también los que llegan con fechas viejas);
+    #   2. accidentes con _id mayor a la marca, mes a mes, contra todos los eventos vigentes;
+    #   3. accidentes ya procesados de los días que cubren los eventos nuevos, contra esos eventos.
+    # Si cambian el período o los parámetros del join, la tabla se reconstruye desde cero.
+    inicio_reloj = time.perf_counter()
+    inicio = date.fromisoformat(fecha_inicio)
+    fin = date.fromisoformat(fecha_fin) + timedelta(days=1)
+    margen = timedelta(seconds=margen_s)
+    parametros = {"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "distancia_km": distancia_maxima_km, "k": k,
+                  "margen_s": margen_s}
+    if tabla.estado["parametros"] != parametros:
+        tabla.reiniciar(parametros)
+    marca_accidentes = tabla.estado["marca_accidentes"]
+    marca_accidentes = ObjectId(marca_accidentes) if marca_accidentes else None
+    marca_eventos = tabla.estado["marca_eventos"]
+    resumen = {"accidentes_nuevos": 0, "eventos_nuevos": 0, "accidentes_revisados": 0, "pares_nuevos": 0}
+
+    # Tope fijo de accidentes: lo insertado durante la sincronización queda para la próxima
+    tope_accidentes = _ultimo_id(coleccion_mongodb)
+
+    with span("sync.eventos_nuevos"):
+        if marca_accidentes is None:
+            # Sin accidentes procesados el paso 3 no corre: de los eventos nuevos alcanza la marca
+            resumen["eventos_nuevos"], ultimo = neo4j.contar_eventos_nuevos(_iso(inicio - margen), _iso(fin),
+                                                                            marca_eventos, fin_exclusivo=True)
+            eventos_nuevos = None
+        else:
+            eventos_nuevos, ultimo = leer_eventos_nuevos(neo4j, _iso(inicio - margen), _iso(fin), marca_eventos,
+                                                         fin_exclusivo=True)
+            resumen["eventos_nuevos"] = len(eventos_nuevos)
+    nueva_marca_eventos = marca_eventos if ultimo is None else ultimo
+
+    if tope_accidentes is not None and tope_accidentes != marca_accidentes:
+        for desde, hasta in _meses(inicio, fin):
+            lotes = consultar_accidentes_compactos(coleccion_mongodb, _dia(desde), _dia(hasta), CAMPOS_SYNC,
+                                                   desde_id=marca_accidentes, fin_exclusivo=True, con_ids=True,
+                                                   hasta_id=tope_accidentes)
+            accidentes = LoteAccidentes.concatenar(lotes)
+            if not len(accidentes):
+                continue
+            eventos = neo4j.obtener_lote_eventos(_iso(desde - margen), _iso(hasta), fin_exclusivo=True)
+            with span("sync.join.accidentes_nuevos"):
+                pares = pares_asociados(accidentes, eventos, distancia_maxima_km, k)
+            resumen["pares_nuevos"] += tabla.fusionar(pares, k)
+            resumen["accidentes_nuevos"] += len(accidentes)
+
+    if marca_accidentes is not None and len(eventos_nuevos):
+        for desde, hasta in dias_eventos(eventos_nuevos, inicio, fin):
+            lotes = consultar_accidentes_compactos(coleccion_mongodb, _dia(desde), _dia(hasta), CAMPOS_SYNC,
+                                                   fin_exclusivo=True, con_ids=True, hasta_id=marca_accidentes)
+            accidentes = LoteAccidentes.concatenar(lotes)
+            if not len(accidentes):
+                continue
+            with span("sync.join.eventos_nuevos"):
+                pares = pares_asociados(accidentes, eventos_nuevos, distancia_maxima_km, k)
+            resumen["pares_nuevos"] += tabla.fusionar(pares, k)
+            resumen["accidentes_revisados"] += len(accidentes)
+
+    # Las marcas avanzan solo si todo se fusionó; si algo falla, la próxima corrida repite
+    # el delta y los pares repetidos se descartan al fusionar
+    if tope_accidentes is not None:
+        tabla.estado["marca_accidentes"] = str(tope_accidentes)
+    tabla.estado["marca_eventos"] = nueva_marca_eventos
+    resumen["segundos"] = time.perf_counter() - inicio_reloj
+    resumen["fecha"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    tabla.estado["ultima_sincronizacion"] = resumen
+    tabla.guardar_estado()
+    contar("sync.pares_nuevos", resumen["pares_nuevos"])
+    return resumen
@@ -0,0 +1,144 @@
+import numpy as np
+
+# Zonas metropolitanas (lat, lng, estado, peso, dispersión en grados): los accidentes de
+# US-Accidents se concentran en pocas ciudades grandes y el resto se reparte por el país
+METROS = [
+    (34.05, -118.24, "CA", 14, 0.6), (37.77, -122.42, "CA", 6, 0.4), (32.72, -117.16, "CA", 3, 0.3),
+    (29.76, -95.37, "TX", 7, 0.5), (32.78, -96.80, "TX", 6, 0.5), (30.27, -97.74, "TX", 4, 0.3),
+    (25.76, -80.19, "FL", 7, 0.4), (28.54, -81.38, "FL", 5, 0.4), (27.95, -82.46, "FL", 3, 0.3),
+    (40.71, -74.01, "NY", 6, 0.4), (39.95, -75.17, "PA", 4, 0.4), (33.75, -84.39, "GA", 4, 0.4),
+    (35.23, -80.84, "NC", 4, 0.4), (35.78, -78.64, "NC", 3, 0.3), (47.61, -122.33, "WA", 3, 0.3),
+    (45.52, -122.68, "OR", 3, 0.3), (41.88, -87.63, "IL", 3, 0.4), (42.33, -83.05, "MI", 2, 0.4),
+    (44.98, -93.27, "MN", 3, 0.4), (39.74, -104.99, "CO", 2, 0.3), (36.16, -86.78, "TN", 3, 0.3),
+    (38.91, -77.04, "VA", 4, 0.4), (33.45, -112.07, "AZ", 2, 0.4), (29.95, -90.07, "LA", 2, 0.3),
+    (34.00, -81.03, "SC", 3, 0.4), (40.76, -111.89, "UT", 2, 0.3),
+]
+FRACCION_RURAL = 0.12  # Accidentes repartidos uniformemente en el territorio continental
+LIMITES_EEUU = (25.0, 49.0, -124.5, -67.0)
+
+CONDICIONES = ["Fair", "Clear", "Mostly Cloudy", "Cloudy", "Partly Cloudy", "Overcast", "Light Rain", "Rain",
+               "Light Snow", "Snow", "Fog", "Haze", "Heavy Rain", "Thunderstorm"]
+PESOS_CONDICIONES = [30, 14, 12, 11, 9, 8, 6, 2, 2, 0.5, 1.5, 1.5, 1, 0.5]
+
+TIPOS_EVENTO = ["Rain", "Fog", "Snow", "Cold", "Precipitation", "Storm", "Hail"]
+PESOS_TIPOS = [60, 17, 14, 3, 2, 3, 1]
+SEVERIDADES = {
+    "Rain": (["Light", "Moderate", "Heavy"], [70, 20, 10]),
+    "Fog": (["Moderate", "Severe"], [35, 65]),
+    "Snow": (["Light", "Moderate", "Heavy"], [75, 15, 10]),
+    "Cold": (["Severe"], [1]),
+    "Precipitation": (["UNK"], [1]),
+    "Storm": (["Severe"], [1]),
+    "Hail": (["Other"], [1]),
+}
+# Mediana y dispersión (log) de la duración de los eventos, en minutos
+DURACION_MEDIANA_MIN = 60
+DURACION_SIGMA = 1.1
+
+def _normalizar(pesos):
+    pesos = np.asarray(pesos, dtype=np.float64)
+    return pesos / pesos.sum()
+
+def _inicio_anio(anio):
+    return int(np.datetime64(f"{anio}-01-01T00:00:00", "s").astype(np.int64))
+
+def _segundos_anio(anio):
+    return _inicio_anio(anio + 1) - _inicio_anio(anio)
+
+def _ubicaciones(rng, n, dispersion=1.0):
+    # Puntos agrupados alrededor de las zonas metropolitanas más una fracción rural
+    metros = rng.choice(len(METROS), size=n, p=_normalizar([m[3] for m in METROS]))
+    centros = np.array([(m[0], m[1]) for m in METROS])[metros]
+    sigma = np.array([m[4] for m in METROS])[metros] * dispersion
+    lat = centros[:, 0] + rng.normal(0, 1, n) * sigma
+    lng = centros[:, 1] + rng.normal(0, 1, n) * sigma * 1.3
+    estados = np.array([m[2] for m in METROS])[metros]
+    rural = rng.random(n) < FRACCION_RURAL
+    lat_min, lat_max, lng_min, lng_max = LIMITES_EEUU
+    lat[rural] = rng.uniform(lat_min, lat_max, rural.sum())
+    lng[rural] = rng.uniform(lng_min, lng_max, rural.sum())
+    estados = estados.astype(object)
+    estados[rural] = "Other"
+    return np.round(lat, 6), np.round(lng, 6), estados
+
+def _horas_accidente(rng, n):
+    # Distribución horaria con picos en las horas punta de la mañana y la tarde
+    pesos = np.array([1, 0.8, 0.7, 0.7, 1, 2, 4, 7, 7, 4.5, 4, 4, 4, 4.5, 5.5, 7, 8, 7.5, 5, 3.5, 2.8, 2.4, 2, 1.5])
+    return rng.choice(24, size=n, p=_normalizar(pesos))
+
+def generar_accidentes(n, anio=2017, semilla=0, tamano_lote=50000):
+    # Documentos con la forma de US-Accidents, entregados en lotes para no tenerlos todos
+    # en memoria. El mismo (n, anio, semilla, tamano_lote) siempre produce los mismos datos.
+    rng = np.random.default_rng(semilla)
+    inicio_anio = _inicio_anio(anio)
+    segundos_anio = _segundos_anio(anio)
+    for inicio in range(0, n, tamano_lote):
+        m = min(tamano_lote, n - inicio)
+        lat, lng, estados = _ubicaciones(rng, m)
+        dias = rng.integers(0, segundos_anio // 86400, m)
+        segundos = inicio_anio + dias * 86400 + _horas_accidente(rng, m) * 3600 + rng.integers(0, 3600, m)
+        inicio_texto = np.datetime_as_string(segundos.astype("datetime64[s]"), unit="s")
+        fin_texto = np.datetime_as_string((segundos + rng.integers(900, 21600, m)).astype("datetime64[s]"), unit="s")
+        severidades = rng.choice([1, 2, 3, 4], size=m, p=[0.01, 0.8, 0.17, 0.02])
+        condiciones = rng.choice(len(CONDICIONES), size=m, p=_normalizar(PESOS_CONDICIONES))
+        temperaturas = np.round(rng.normal(62, 18, m), 1)
+        humedades = np.clip(np.round(rng.normal(64, 22, m)), 1, 100)
+        precipitacion = np.where(rng.random(m) < 0.1, np.round(rng.exponential(0.08, m), 2), 0.0)
+        sin_precipitacion = rng.random(m) < 0.3  # Campo ausente, como en el dataset original
+        lote = []
+        for i in range(m):
+            documento = {
+                "ID": f"A-{inicio + i + 1}",
+                "Severity": int(severidades[i]),
+                "Start_Time": inicio_texto[i].replace("T", " "),
+                "End_Time": fin_texto[i].replace("T", " "),
+                "Start_Lat": float(lat[i]),
+                "Start_Lng": float(lng[i]),
+                "Distance(mi)": 0.01,
+                "Description": "Synthetic accident",
+                "State": estados[i],
+                "Weather_Condition": CONDICIONES[condiciones[i]],
+                "Temperature(F)": float(temperaturas[i]),
+                "Humidity(%)": float(humedades[i]),
+            }
+            if not sin_precipitacion[i]:
+                documento["Precipitation(in)"] = float(precipitacion[i])
+            lote.append(documento)
+        yield lote
+
+def generar_eventos(n, anio=2017, semilla=0):
+    # Registros con la forma que devuelve Neo4jConnector para :Evento. Los eventos salen de
+    # estaciones cerca de las mismas ciudades; la nieve se concentra en invierno y en el
+    # norte, y la duración sigue una log-normal con cola larga.
+    rng = np.random.default_rng(semilla + 1)
+    lat, lng, _ = _ubicaciones(rng, n, dispersion=1.5)
+    tipos = rng.choice(len(TIPOS_EVENTO), size=n, p=_normalizar(PESOS_TIPOS))
+    dias = rng.integers(0, _segundos_anio(anio) // 86400, n)
+    mes = (np.datetime64(f"{anio}-01-01") + dias.astype("timedelta64[D]")).astype("datetime64[M]").astype(np.int64) % 12
+    invierno = np.isin(mes, [0, 1, 2, 10, 11])
+    # Nieve fuera de temporada o en el sur pasa a lluvia
+    nieve = tipos == TIPOS_EVENTO.index("Snow")
+    tipos[nieve & ~(invierno & (lat > 35))] = TIPOS_EVENTO.index("Rain")
+    inicio = _inicio_anio(anio) + dias * 86400 + rng.integers(0, 86400, n)
+    duracion = np.maximum(rng.lognormal(np.log(DURACION_MEDIANA_MIN), DURACION_SIGMA, n), 5) * 60
+    fin = inicio + duracion.astype(np.int64)
+    inicio_texto = np.datetime_as_string(inicio.astype("datetime64[s]"), unit="s")
+    fin_texto = np.datetime_as_string(fin.astype("datetime64[s]"), unit="s")
+    severidades = np.empty(n, dtype=object)
+    for indice, tipo in enumerate(TIPOS_EVENTO):
+        del_tipo = tipos == indice
+        valores, pesos = SEVERIDADES[tipo]
+        severidades[del_tipo] = np.array(valores, dtype=object)[rng.choice(len(valores), size=del_tipo.sum(),
+                                                                             p=_normalizar(pesos))]
+    eventos = []
+    for i in range(n):
+        eventos.append({
+            "EventId": f"W-{i + 1}",
+            "Lat": float(lat[i]),
+            "Lng": float(lng[i]),
+            "Severity": severidades[i],
+            "EventType": TIPOS_EVENTO[tipos[i]],
+            "StartTime": inicio_texto[i] + "Z",
+            "EndTime": fin_texto[i] + "Z",
+        })
+    return eventos
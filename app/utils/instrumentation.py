@@ -0,0 +1,193 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from functools import wraps
+from app.config import INSTRUMENTACION, TRAZAS_DIR, RSS_INTERVALO_S
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Traza de la acción en curso (None = instrumentación inactiva: span() y contar() no hacen nada)
+_traza = None
+_local = threading.local()
+_NULO = nullcontext()
+
+def rss_actual():
+    # Memoria residente del proceso en bytes; sin /proc se usa el pico de getrusage
+    try:
+        with open("/proc/self/statm") as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return rss_pico_proceso()
+
+def rss_pico_proceso():
+    if resource is None:
+        return None
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+class Traza:
+    # Spans y contadores de una acción. Cada span guarda su padre (el span abierto en el
+    # mismo hilo), duración y RSS al terminar; un hilo aparte muestrea el RSS para el pico.
+
+    def __init__(self, nombre, intervalo_rss=RSS_INTERVALO_S):
+        self.nombre = nombre
+        self.fecha = datetime.now(timezone.utc)
+        self.inicio = time.perf_counter()
+        self.duracion = None
+        self.spans = []
+        self.contadores = {}
+        self.rss_inicio = rss_actual()
+        self.rss_pico = self.rss_inicio
+        self._lock = threading.Lock()
+        self._fin = threading.Event()
+        self._muestreador = threading.Thread(target=self._muestrear, args=(intervalo_rss,), daemon=True)
+        self._muestreador.start()
+
+    def _muestrear(self, intervalo):
+        while not self._fin.wait(intervalo):
+            self._registrar_rss(rss_actual())
+
+    def _registrar_rss(self, rss):
+        if rss is not None and (self.rss_pico is None or rss > self.rss_pico):
+            self.rss_pico = rss
+
+    def terminar(self):
+        self._fin.set()
+        self._muestreador.join()
+        self._registrar_rss(rss_actual())
+        self.duracion = time.perf_counter() - self.inicio
+
+    def agregar_span(self, registro):
+        with self._lock:
+            registro["id"] = len(self.spans)
+            self.spans.append(registro)
+        return registro["id"]
+
+    def contar(self, nombre, cantidad):
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def resumen(self):
+        # Spans agrupados por ruta (nombres de los padres + propio): llamadas, tiempo total,
+        # tiempo propio (sin hijos) y máximo
+        hijos = {}
+        for registro in self.spans:
+            if registro["padre"] is not None:
+                hijos[registro["padre"]] = hijos.get(registro["padre"], 0.0) + registro["segundos"]
+        filas = {}
+        for registro in self.spans:
+            fila = filas.setdefault(registro["ruta"], {"ruta": registro["ruta"], "llamadas": 0, "segundos": 0.0,
+                                                        "propios": 0.0, "max_segundos": 0.0, "rss_max_bytes": None})
+            fila["llamadas"] += 1
+            fila["segundos"] += registro["segundos"]
+            fila["propios"] += max(registro["segundos"] - hijos.get(registro["id"], 0.0), 0.0)
+            fila["max_segundos"] = max(fila["max_segundos"], registro["segundos"])
+            if registro["rss_bytes"] is not None:
+                fila["rss_max_bytes"] = max(fila["rss_max_bytes"] or 0, registro["rss_bytes"])
+        return sorted(filas.values(), key=lambda fila: fila["ruta"])
+
+    def tabla(self):
+        lineas = [f"--- Instrumentación: {self.nombre} ({self.duracion:.3f} s, RSS pico "
+                  f"{_mb(self.rss_pico)} MB, inicio {_mb(self.rss_inicio)} MB) ---",
+                  f"{'Etapa':<44} {'Llamadas':>8} {'Total s':>9} {'Propio s':>9} {'Máx s':>8} {'RSS MB':>8}"]
+        for fila in self.resumen():
+            lineas.append(f"{fila['ruta'][-44:]:<44} {fila['llamadas']:>8} {fila['segundos']:>9.3f} "
+                          f"{fila['propios']:>9.3f} {fila['max_segundos']:>8.3f} {_mb(fila['rss_max_bytes']):>8}")
+        for nombre, cantidad in sorted(self.contadores.items()):
+            lineas.append(f"{nombre:<44} {cantidad:>8}")
+        return "\n".join(lineas)
+
+    def a_dict(self):
+        return {
+            "accion": self.nombre,
+            "fecha": self.fecha.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "segundos": self.duracion,
+            "rss_inicio_bytes": self.rss_inicio,
+            "rss_pico_bytes": self.rss_pico,
+            "rss_pico_proceso_bytes": rss_pico_proceso(),
+            "contadores": self.contadores,
+            "resumen": self.resumen(),
+            "spans": self.spans,
+        }
+
+    def guardar(self, directorio=TRAZAS_DIR):
+        os.makedirs(directorio, exist_ok=True)
+        nombre = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.nombre)
+        ruta = os.path.join(directorio, f"traza_{nombre}_{self.fecha.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            json.dump(self.a_dict(), archivo, indent=2, ensure_ascii=False)
+        return ruta
+
+def _mb(valor):
+    return "-" if valor is None else f"{valor / 1e6:.1f}"
+
+@contextmanager
+def accion(nombre, habilitada=None, guardar=True):
+    # Delimita una acción (una opción del menú, una corrida de batch.py). Con la
+    # instrumentación habilitada imprime el resumen al terminar y guarda la traza JSON.
+    global _traza
+    if not (INSTRUMENTACION if habilitada is None else habilitada) or _traza is not None:
+        yield None
+        return
+    traza = Traza(nombre)
+    _traza = traza
+    try:
+        yield traza
+    finally:
+        _traza = None
+        traza.terminar()
+        print(traza.tabla())
+        if guardar:
+            print(f"Traza guardada en {traza.guardar()}")
+
+@contextmanager
+def _span(traza, nombre, atributos):
+    pila = getattr(_local, "pila", None)
+    if pila is None:
+        pila = _local.pila = []
+    padre = pila[-1] if pila else None
+    registro = {"nombre": nombre, "ruta": f"{padre[1]}/{nombre}" if padre else nombre,
+                "padre": padre[0] if padre else None, "hilo": threading.current_thread().name,
+                "inicio_s": time.perf_counter() - traza.inicio, "segundos": 0.0, "rss_bytes": None,
+                "atributos": atributos}
+    # El id se asigna al abrir para que los hijos puedan referenciarlo
+    identificador = traza.agregar_span(registro)
+    pila.append((identificador, registro["ruta"]))
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro["segundos"] = time.perf_counter() - inicio
+        registro["rss_bytes"] = rss_actual()
+        traza._registrar_rss(registro["rss_bytes"])
+        pila.pop()
+
+def span(nombre, **atributos):
+    # Mide un bloque; los spans abiertos dentro de él en el mismo hilo quedan como hijos
+    traza = _traza
+    if traza is None:
+        return _NULO
+    return _span(traza, nombre, atributos)
+
+def contar(nombre, cantidad=1):
+    traza = _traza
+    if traza is not None:
+        traza.contar(nombre, int(cantidad))
+
+def medido(nombre):
+    # Decorador: cada llamada a la función es un span
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with span(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,37 @@
+import numpy as np
+
+def a_json(valor):
+    # Tipos NumPy a Python y claves de dict a texto, para json.dumps
+    if isinstance(valor, dict):
+        return {str(a_json(clave)): a_json(v) for clave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [a_json(v) for v in valor]
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+def _limite(valor):
+    # Los bins abiertos de HistogramaFijo (-inf/inf) van como null: JSON no tiene infinitos
+    valor = a_json(valor)
+    return valor if np.isfinite(valor) else None
+
+def histograma_a_filas(conteo):
+    # {(inicio, fin): n, "Unknown": n} o {valor: n} -> lista de filas
+    filas = []
+    for clave, cantidad in conteo.items():
+        if isinstance(clave, tuple):
+            filas.append({"inicio": _limite(clave[0]), "fin": _limite(clave[1]), "cantidad": a_json(cantidad)})
+        else:
+            filas.append({"valor": a_json(clave), "cantidad": a_json(cantidad)})
+    return filas
+
+def condiciones_a_json(datos):
+    # Resultado de main.datos_mongodb con un histograma por campo (y sus cuantiles si los hay)
+    campos = {campo: {"title": titulo, "x_label": etiqueta_x, "counts": histograma_a_filas(conteo)}
+              for campo, titulo, etiqueta_x, conteo in
+              zip(datos["fields"], datos["titles"], datos["x_labels"], datos["counts"])}
+    for campo, cuantiles in datos.get("quantiles", {}).items():
+        campos[campo]["quantiles"] = a_json(cuantiles)
+    return {"period": datos["period"], "total_accidents": datos["total_accidents"], "fields": campos}
@@ -0,0 +1,7 @@
+import os
+import sys
+import matplotlib
+
+# Las pruebas importan app.* desde la raíz del repositorio y dibujan sin ventanas
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+matplotlib.use("Agg")
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from app.services.data_processing import calcular_distancia, haversine_km
+
+# (lat1, lon1, lat2, lon2, km) con distancias conocidas; con dlat = lat2 - lon1 las
+# coordenadas de EE.UU. daban un error de dominio en asin o distancias absurdas
+CASOS = [
+    (34.05, -118.25, 34.05, -118.25, 0.0),
+    (0.0, 0.0, 1.0, 0.0, 111.19),
+    (40.0, -100.0, 41.0, -100.0, 111.19),
+    (34.05, -118.25, 40.71, -74.01, 3936.0),
+    (41.88, -87.63, 29.76, -95.37, 1515.0),
+]
+
+@pytest.mark.parametrize("lat1, lon1, lat2, lon2, km", CASOS)
+def test_calcular_distancia(lat1, lon1, lat2, lon2, km):
+    assert calcular_distancia(lat1, lon1, lat2, lon2) == pytest.approx(km, rel=2e-3, abs=1e-6)
+
+@pytest.mark.parametrize("lat1, lon1, lat2, lon2, km", CASOS)
+def test_calcular_distancia_igual_a_haversine_km(lat1, lon1, lat2, lon2, km):
+    # El join por fuerza bruta y los vectorizados deben medir lo mismo
+    vectorizada = haversine_km(*np.radians([lat1, lon1, lat2, lon2]))
+    assert calcular_distancia(lat1, lon1, lat2, lon2) == pytest.approx(float(vectorizada), abs=1e-9)
+    assert calcular_distancia(lat2, lon2, lat1, lon1) == pytest.approx(float(vectorizada), abs=1e-9)
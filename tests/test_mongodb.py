@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from app.databases.memory import ColeccionMemoria
+import app.main
+from app.config import BINS_CONDICIONES
+from app.databases.mongodb import agregar_condiciones_ambientales, CAMPOS_CONDICIONES, CAMPOS_NUMERICOS
+from app.services.plotting import graficar_todas_condiciones_mongodb
+from app.services.sketches import HistogramaFijo
+
+INICIO, FIN = "2017-01-01T00:00:00Z", "2017-12-31T23:59:59Z"
+
+# Accidentes con los casos que la pipeline trata aparte: ausentes, null, texto, NaN y
+# booleanos cuentan como "Unknown"; hay valores debajo y encima de BINS_CONDICIONES y uno
+# igual al fin del rango, que cae en el último bin
+DOCUMENTOS = [
+    {"Start_Time": "2017-01-03 08:00:00", "Weather_Condition": "Rain", "Precipitation(in)": 0.0,
+     "Temperature(F)": 30.0, "Humidity(%)": 90},
+    {"Start_Time": "2017-02-10 09:30:00", "Weather_Condition": "Rain", "Precipitation(in)": 0.5,
+     "Temperature(F)": 41.5, "Humidity(%)": 75},
+    {"Start_Time": "2017-03-15 17:45:00", "Weather_Condition": "Clear", "Precipitation(in)": 1.0,
+     "Temperature(F)": 68.0, "Humidity(%)": 40},
+    {"Start_Time": "2017-06-01 12:00:00", "Weather_Condition": None, "Precipitation(in)": None,
+     "Temperature(F)": 88.0, "Humidity(%)": "N/A"},
+    {"Start_Time": "2017-07-04 20:15:00", "Precipitation(in)": "0.2", "Temperature(F)": float("nan"),
+     "Humidity(%)": True},
+    {"Start_Time": "2017-11-20 06:10:00", "Weather_Condition": "Snow", "Precipitation(in)": 2.5,
+     "Temperature(F)": -45.0, "Humidity(%)": 100},
+    # Fuera del período
+    {"Start_Time": "2018-01-02 10:00:00", "Weather_Condition": "Fog", "Precipitation(in)": 3.0,
+     "Temperature(F)": 10.0, "Humidity(%)": 99},
+]
+
+def _coleccion_memoria(documentos):
+    return ColeccionMemoria(documentos)
+
+def _coleccion_mongomock(documentos):
+    mongomock = pytest.importorskip("mongomock")
+    coleccion = mongomock.MongoClient().db.accidentes
+    if documentos:
+        coleccion.insert_many([dict(documento) for documento in documentos])
+    return coleccion
+
+@pytest.fixture(params=[_coleccion_memoria, _coleccion_mongomock], ids=["memoria", "mongomock"])
+def crear_coleccion(request):
+    return request.param
+
+def _valores(campo):
+    # Valores numéricos válidos del campo dentro del período
+    valores = [documento.get(campo) for documento in DOCUMENTOS[:-1]]
+    return [valor for valor in valores if isinstance(valor, (int, float)) and not isinstance(valor, bool)
+            and valor == valor]
+
+def test_conteos_categoricos_y_desconocidos(crear_coleccion):
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion(DOCUMENTOS), INICIO, FIN, CAMPOS_CONDICIONES)
+    assert total == 6
+    assert conteos[0] == {"Rain": 2, "Clear": 1, "Snow": 1, "Unknown": 2}
+    for conteo, campo in zip(conteos[1:], CAMPOS_CONDICIONES[1:]):
+        valores = _valores(campo)
+        assert sum(conteo.values()) == total
+        assert conteo.get("Unknown", 0) == total - len(valores)
+
+@pytest.mark.parametrize("campo", CAMPOS_NUMERICOS)
+def test_buckets_fijos_como_histograma(crear_coleccion, campo):
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion(DOCUMENTOS), INICIO, FIN, CAMPOS_CONDICIONES)
+    conteo = conteos[CAMPOS_CONDICIONES.index(campo)]
+    inicio, fin, num_bins = BINS_CONDICIONES[campo]
+    valores = _valores(campo)
+    esperado = HistogramaFijo(inicio, fin, num_bins).actualizar(valores).conteo()
+    if len(valores) < total:
+        esperado["Unknown"] = total - len(valores)
+    assert conteo == esperado
+    # Dentro del rango, los mismos bins que np.histogram
+    dentro, limites = np.histogram(valores, bins=np.linspace(inicio, fin, num_bins + 1))
+    assert [conteo[(a, b)] for a, b in zip(limites[:-1].tolist(), limites[1:].tolist())] == dentro.tolist()
+
+def test_valor_unico_tiene_bins(crear_coleccion):
+    documentos = [{"Start_Time": "2017-05-05 10:00:00", "Weather_Condition": "Clear", "Precipitation(in)": 0.0,
+                   "Temperature(F)": 50.0, "Humidity(%)": 50}] * 3
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion(documentos), INICIO, FIN, CAMPOS_CONDICIONES)
+    assert total == 3
+    for conteo in conteos[1:]:
+        assert "Unknown" not in conteo
+        assert sum(conteo.values()) == 3
+
+def test_coleccion_vacia(crear_coleccion):
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion([]), INICIO, FIN, CAMPOS_CONDICIONES)
+    assert total == 0
+    assert conteos[0] == {}
+    for conteo, campo in zip(conteos[1:], CAMPOS_CONDICIONES[1:]):
+        assert conteo == HistogramaFijo(*BINS_CONDICIONES[campo]).conteo()
+
+def test_periodo_sin_numeros(crear_coleccion):
+    # Un campo numérico sin ningún valor válido tiene sus bins vacíos y todo es "Unknown"
+    documentos = [{"Start_Time": "2017-05-05 10:00:00", "Weather_Condition": "Clear", "Precipitation(in)": None,
+                   "Temperature(F)": "N/A", "Humidity(%)": 40}] * 2
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion(documentos), INICIO, FIN, CAMPOS_CONDICIONES)
+    assert total == 2
+    for conteo, campo in zip(conteos[1:3], CAMPOS_CONDICIONES[1:3]):
+        assert conteo == {**HistogramaFijo(*BINS_CONDICIONES[campo]).conteo(), "Unknown": 2}
+
+@pytest.mark.parametrize("documentos", [DOCUMENTOS, []], ids=["con_datos", "vacia"])
+def test_graficar_conteos_del_servidor(crear_coleccion, documentos, tmp_path):
+    conteos, total = agregar_condiciones_ambientales(crear_coleccion(documentos), INICIO, FIN, CAMPOS_CONDICIONES)
+    rutas = graficar_todas_condiciones_mongodb(conteos, CAMPOS_CONDICIONES, CAMPOS_CONDICIONES,
+                                               ["Number of Accidents"] * 4, CAMPOS_CONDICIONES, "2017", total,
+                                               export=False, salida=str(tmp_path / "condiciones"))
+    assert rutas == [str(tmp_path / "condiciones.png")]
+    assert (tmp_path / "condiciones.png").stat().st_size > 0
+
+def test_agregacion_en_servidor_y_por_lotes_coinciden(crear_coleccion, monkeypatch):
+    # Los dos caminos de datos_mongodb devuelven los mismos bins, fusionables con RollupCondiciones
+    coleccion = crear_coleccion(DOCUMENTOS)
+    datos = {}
+    for en_servidor in (True, False):
+        monkeypatch.setattr(app.main, "AGREGACION_EN_SERVIDOR", en_servidor)
+        datos[en_servidor] = app.main.datos_mongodb(INICIO, FIN, coleccion)
+    assert datos[True]["total_accidents"] == datos[False]["total_accidents"] == 6
+    assert datos[True]["counts"] == datos[False]["counts"]
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import pytest
+from app.databases.memory import ColeccionMemoria, Neo4jMemoria
+from app.databases.records import LoteEventos
+from app.main import datos_accidentes_mensuales
+from app.services.cache import CacheResultados
+from app.services.rollups import RollupMensual
+from app.services.synthetic import generar_accidentes, generar_eventos
+
+ACCIDENTES = list(chain.from_iterable(generar_accidentes(6000)))
+EVENTOS = list(generar_eventos(1200))
+
+def _conteo(coleccion, neo4j, rollup, cache=None):
+    return datos_accidentes_mensuales("2017", "1", "All", coleccion, neo4j, rollup, cache)["monthly_count"]
+
+def _completo(tmp_path, accidentes, eventos):
+    # Conteo de un rollup nuevo con todos los datos: lo que debe dar el incremental
+    rollup = RollupMensual(str(tmp_path / "completo" / f"{len(accidentes)}_{len(eventos)}.json"))
+    return _conteo(ColeccionMemoria(accidentes), Neo4jMemoria(eventos), rollup)
+
+@pytest.fixture
+def incremental(tmp_path):
+    coleccion = ColeccionMemoria(ACCIDENTES[:4500])
+    neo4j = Neo4jMemoria(EVENTOS[:800])
+    rollup = RollupMensual(str(tmp_path / "rollups" / "mensual.json"))
+    cache = CacheResultados(str(tmp_path / "cache"))
+    assert _conteo(coleccion, neo4j, rollup, cache) == _completo(tmp_path, ACCIDENTES[:4500], EVENTOS[:800])
+    return coleccion, neo4j, rollup, cache
+
+def test_eventos_tardios(tmp_path, incremental):
+    coleccion, neo4j, rollup, cache = incremental
+    antes = _conteo(coleccion, neo4j, rollup, cache)
+    neo4j.insertar(EVENTOS[800:])
+    despues = _conteo(coleccion, neo4j, rollup, cache)
+    assert despues != antes
+    assert despues == _completo(tmp_path, ACCIDENTES[:4500], EVENTOS)
+    assert rollup.meses_pendientes("2017") == []
+
+def test_eventos_y_accidentes_nuevos(tmp_path, incremental):
+    coleccion, neo4j, rollup, cache = incremental
+    neo4j.insertar(EVENTOS[800:])
+    coleccion.insertar(ACCIDENTES[4500:])
+    assert _conteo(coleccion, neo4j, rollup, cache) == _completo(tmp_path, ACCIDENTES, EVENTOS)
+
+def test_evento_tardio_recalcula_solo_su_mes(tmp_path, incremental):
+    coleccion, neo4j, rollup, cache = incremental
+    tardio = dict(EVENTOS[0], EventId="tardio", StartTime="2017-03-10T08:00:00Z", EndTime="2017-03-10T20:00:00Z")
+    neo4j.insertar([tardio])
+    marca = rollup.marca_eventos("2017")
+    reconstruidos = []
+    reconstruir_mes = rollup.reconstruir_mes
+    rollup.reconstruir_mes = lambda anio, mes, *args: reconstruidos.append(mes) or reconstruir_mes(anio, mes, *args)
+    assert _conteo(coleccion, neo4j, rollup, cache) == _completo(tmp_path, ACCIDENTES[:4500], EVENTOS[:800] + [tardio])
+    assert reconstruidos == [3]
+    assert rollup.marca_eventos("2017") > marca
+
+def test_sin_datos_nuevos_no_recalcula(incremental):
+    coleccion, neo4j, rollup, cache = incremental
+    rollup.reconstruir_mes = None  # Fallaría si se llamara
+    assert _conteo(coleccion, neo4j, rollup, cache) == _conteo(coleccion, neo4j, rollup, cache)
+
+def test_anio_sin_contar_no_lee_eventos_nuevos(tmp_path):
+    # En la primera consulta del año solo se pide el id del último evento
+    neo4j = Neo4jMemoria(EVENTOS[:800])
+    neo4j.iterar_eventos_nuevos = None  # Fallaría si se llamara
+    rollup = RollupMensual(str(tmp_path / "rollups" / "mensual.json"))
+    assert _conteo(ColeccionMemoria(ACCIDENTES[:4500]), neo4j, rollup) == _completo(tmp_path, ACCIDENTES[:4500],
+                                                                                   EVENTOS[:800])
+    assert rollup.marca_eventos("2017") == neo4j.contar_eventos_nuevos("2017-01-01T00:00:00Z",
+                                                                      "2017-12-31T23:59:59Z")[1]
+
+def test_anios_distintos_en_paralelo(tmp_path):
+    # Hilos que guardan años distintos sobre el mismo rollup, como el servicio HTTP
+    ruta = tmp_path / "rollups" / "mensual.json"
+    rollup = RollupMensual(str(ruta))
+    anios = [str(anio) for anio in range(2000, 2032)]
+
+    def registrar(anio):
+        for marca in range(20):
+            rollup.registrar_eventos_nuevos(anio, LoteEventos.desde_documentos([]), marca)
+        return anio
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert sorted(pool.map(registrar, anios)) == anios
+    guardado = RollupMensual(str(ruta))
+    assert sorted(guardado.anios) == anios
+    assert all(guardado.marca_eventos(anio) == 19 for anio in anios)
+    assert [archivo.name for archivo in ruta.parent.iterdir()] == ["mensual.json"]
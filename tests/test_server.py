@@ -0,0 +1,145 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.main import datos_graficos_combinados
+from app.server import servicio_sintetico, ServidorAnalisis
+
+NUM_ACCIDENTES = 3000
+
+SOLICITUDES = [
+    "/eventos?inicio=2017-03-01&fin=2017-03-31",
+    "/eventos?inicio=2017-01-01&fin=2017-12-31&estado=CA",
+    "/combinado?inicio=2017-01-01&fin=2017-06-30",
+    "/combinado?inicio=2017-01-01&fin=2017-06-30&tipo_clima=Rain",
+    "/combinado?inicio=2017-01-01&fin=2017-06-30&severidad=Severe",
+    "/combinado?inicio=2017-07-01&fin=2017-12-31",
+    "/mensual?anio=2017",
+    "/mensual?anio=2017&tipo=severidad&categoria=Severe",
+    "/condiciones?inicio=2017-01-01&fin=2017-12-31",
+    "/condiciones?inicio=2017-04-01&fin=2017-04-30&circulo=34.05,-118.25,200",
+]
+
+class Cliente:
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.servidor = ServidorAnalisis(("127.0.0.1", 0), servicio, silencioso=True)
+        self.base = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._hilo.start()
+
+    def get(self, ruta):
+        # (código HTTP, respuesta JSON sin el tiempo de cálculo)
+        try:
+            with urllib.request.urlopen(self.base + ruta, timeout=60) as respuesta:
+                estado, datos = respuesta.status, json.load(respuesta)
+        except urllib.error.HTTPError as error:
+            estado, datos = error.code, json.load(error)
+        datos.pop("segundos", None)
+        return estado, datos
+
+    def cerrar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self.servicio.close()
+
+def _cliente(directorio):
+    return Cliente(servicio_sintetico(NUM_ACCIDENTES, directorio=str(directorio)))
+
+@pytest.fixture
+def cliente(tmp_path):
+    cliente = _cliente(tmp_path)
+    yield cliente
+    cliente.cerrar()
+
+def test_salud(cliente):
+    estado, datos = cliente.get("/salud")
+    assert estado == 200
+    assert datos["estado"] == "ok"
+    assert datos["solicitudes"] == 0
+
+def test_eventos(cliente):
+    estado, datos = cliente.get("/eventos?inicio=2017-03-01&fin=2017-03-31")
+    eventos = cliente.servicio.neo4j.obtener_eventos_por_periodo("2017-03-01T00:00:00Z", "2017-03-31T23:59:59Z")
+    assert estado == 200
+    assert datos["total_events"] == len(eventos) > 0
+    assert sum(datos["count_type"].values()) == len(eventos)
+    assert sum(datos["count_severity"].values()) == len(eventos)
+
+def test_combinado(cliente):
+    estado, datos = cliente.get("/combinado?inicio=2017-01-01&fin=2017-06-30")
+    esperado = datos_graficos_combinados("2017-01-01T00:00:00Z", "2017-06-30T23:59:59Z", None, None,
+                                         cliente.servicio.coleccion, cliente.servicio.neo4j)
+    assert estado == 200
+    assert datos["total_accidents"] == esperado["total_accidents"] > 0
+    assert datos["count_type"] == esperado["count_type"]
+    assert datos["count_severity"] == esperado["count_severity"]
+    # Filtrar un tipo reutiliza el join del período
+    estado, lluvia = cliente.get("/combinado?inicio=2017-01-01&fin=2017-06-30&tipo_clima=Rain")
+    assert estado == 200
+    assert lluvia["count_type"] == {"Rain": esperado["count_type"]["Rain"]}
+    assert cliente.servicio.cache_joins.estadisticas()["aciertos"] >= 1
+
+def test_mensual(cliente):
+    estado, datos = cliente.get("/mensual?anio=2017")
+    assert estado == 200
+    assert sum(datos["monthly_count"].values()) == datos["total_accidents"] > 0
+    assert set(datos["monthly_count"]) <= {str(mes) for mes in range(1, 13)}
+    # La segunda solicitud sale del rollup sin volver a sumar los mismos accidentes
+    _, repetido = cliente.get("/mensual?anio=2017")
+    assert repetido == datos
+    _, severos = cliente.get("/mensual?anio=2017&tipo=severidad&categoria=Severe")
+    assert severos["total_accidents"] <= datos["total_accidents"]
+
+def test_condiciones(cliente):
+    estado, datos = cliente.get("/condiciones?inicio=2017-01-01&fin=2017-12-31")
+    total = cliente.servicio.coleccion.count_documents(
+        {"Start_Time": {"$gte": "2017-01-01T00:00:00Z", "$lte": "2017-12-31T23:59:59Z"}})
+    assert estado == 200
+    assert datos["total_accidents"] == total > 0
+    assert set(datos["fields"]) == {"Weather_Condition", "Precipitation(in)", "Temperature(F)", "Humidity(%)"}
+    for campo in datos["fields"].values():
+        assert sum(fila["cantidad"] for fila in campo["counts"]) == total
+
+@pytest.mark.parametrize("ruta, estado", [
+    ("/eventos", 400),
+    ("/combinado?inicio=2017-06-30&fin=2017-01-01", 400),
+    ("/mensual?anio=17", 400),
+    ("/mensual?anio=2017&tipo=severidad", 400),
+    ("/condiciones?inicio=2017-01-01&fin=2017-12-31&estado=CA&caja=30,-120,40,-110", 400),
+    ("/inexistente", 404),
+])
+def test_errores(cliente, ruta, estado):
+    codigo, datos = cliente.get(ruta)
+    assert codigo == estado
+    assert "error" in datos
+    if estado == 400:
+        assert cliente.get("/salud")[1]["errores"] == 1
+
+def test_solicitudes_concurrentes(tmp_path):
+    # Las mismas solicitudes, cada una repetida varias veces y todas a la vez contra un
+    # servicio nuevo, dan lo mismo que una por una: el lector, las cachés y el rollup
+    # compartidos no mezclan resultados ni calculan dos veces el join de un período
+    secuencial = _cliente(tmp_path / "secuencial")
+    try:
+        esperado = {ruta: secuencial.get(ruta) for ruta in SOLICITUDES}
+    finally:
+        secuencial.cerrar()
+
+    concurrente = _cliente(tmp_path / "concurrente")
+    try:
+        rutas = SOLICITUDES * 4
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            respuestas = list(pool.map(concurrente.get, rutas))
+        for ruta, respuesta in zip(rutas, respuestas):
+            assert respuesta == esperado[ruta], ruta
+        salud = concurrente.get("/salud")[1]
+        assert salud["solicitudes"] == len(rutas)
+        assert salud["errores"] == 0
+        periodos_combinados = {ruta.split("&tipo_clima")[0].split("&severidad")[0] for ruta in SOLICITUDES
+                               if ruta.startswith("/combinado")}
+        assert salud["cache_joins"]["fallos"] == len(periodos_combinados)
+    finally:
+        concurrente.cerrar()